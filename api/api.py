@@ -1,12 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from PIL import Image
-import numpy as np
-import tensorflow as tf
 import json
-import io
 import os
 
+from api.batch_upload import chunked, iter_uploaded_images
+from api.backends import detect_backend, load_backend
+from api import preprocessing
+from api import response_format
+from api.startup import Startup, import_runtime
+from api.upload_guard import UploadGuard, UploadRejected, parse_formats
+
 #Initialisation de l'API
 app = Flask(__name__)
 
@@ -16,38 +19,66 @@ CORS(app)
 # Chemins
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-MODEL_PATH = os.path.join(
-    BASE_DIR, "modele", "classification_type_riz.keras"
+MODEL_PATH = os.environ.get(
+    "MODEL_PATH", os.path.join(BASE_DIR, "modele", "classification_type_riz.keras")
 )
 
 LABELS_PATH = os.path.join(
     BASE_DIR, "modele", "class_names.json"
 )
 
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "auto")
+
+# Garde-fou des envois : taille, format et dimensions verifies avant decodage
+upload_guard = UploadGuard(
+    max_bytes=int(os.environ.get("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024))),
+    max_pixels=int(os.environ.get("UPLOAD_MAX_PIXELS", "40000000")),
+    formats=parse_formats(os.environ.get("UPLOAD_FORMATS"))
+)
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("REQUEST_MAX_BYTES", str(256 * 1024 * 1024))) or None
+
 # Chargement du modele et labels
-# Charge une seule fois au démarrage du serveur
-try:
-    model = tf.keras.models.load_model(MODEL_PATH)
+# Charge une seule fois, en arriere-plan : le serveur repond tout de suite
+predictor = None
+class_names = None
+startup = Startup()
+
+def load_resources():
+    global predictor, class_names
+    with startup.phase("import"):
+        import_runtime(detect_backend(MODEL_PATH) if MODEL_BACKEND == "auto" else MODEL_BACKEND)
+
+    #Backend keras/tflite/onnx selon MODEL_BACKEND ou l'extension du fichier
+    backend = load_backend(MODEL_PATH, kind=MODEL_BACKEND, cache_dir=os.environ.get("MODEL_CACHE_DIR"))
+    startup.record("load", backend.load_seconds)
+
+    #Graphe compile et prechauffe avant la premiere requete
+    startup.record("warmup", backend.warmup())
 
     with open(LABELS_PATH, "r") as f:
         class_indices = json.load(f)
 
     class_names = {v: k for k, v in class_indices.items()}
+    predictor = backend
     print("Modele et labels charges avec succes.")
-except Exception as e:
-    print(f"Erreur lors du chargement des ressources : {e}")
+    return True
+
+startup.run_in_background(load_resources)
 
 
 #Pretraitement image
-IMG_SIZE = (224, 224)
+IMG_SIZE = preprocessing.IMG_SIZE
+BATCH_SIZE = 32
 
 def preprocess_image(image_content):
     """Prend les bytes de l'image, traite et retourne l'array prêt pour le modele"""
-    image = Image.open(io.BytesIO(image_content)).convert("RGB")
-    image = image.resize(IMG_SIZE)
-    img_array = np.array(image) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+    #Decodage reduit (draft JPEG) + float32 sans copie intermediaire
+    return preprocessing.preprocess_image(image_content, dtype=predictor.input_dtype)
+
+
+def format_prediction(predictions, top_k=None, include_probs=True):
+    """Construit la reponse a partir de la sortie softmax d'une image"""
+    return response_format.prediction_payload(predictions, class_names, top_k, include_probs)
 
 
 #Routes API
@@ -56,40 +87,86 @@ def root():
     return jsonify({"message": "Rice Classification API est en cours"})
 
 
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    return jsonify({"status": "alive", "startup": startup.state})
+
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    #200 seulement une fois le modele charge et prechauffe
+    return jsonify(startup.describe()), 200 if predictor is not None else 503
+
+
 @app.route("/predict", methods=["POST"])
 def predict():
+    if predictor is None:
+        return jsonify({"error": "Modele en cours de chargement"}), 503
     if 'file' not in request.files:
         return jsonify({"error": "Aucun fichier envoye"}), 400
     
     file = request.files['file']
     
     try:
-        img_bytes = file.read()
+        top_k = response_format.parse_top_k(request.values.get("top_k"), len(class_names))
+    except ValueError:
+        return jsonify({"error": "top_k doit etre un entier positif"}), 400
+    include_probs = response_format.parse_flag(request.values.get("include_probs"))
+    
+    try:
+        img_bytes = upload_guard.read(file.stream)
+        upload_guard.check(img_bytes)
         img_array = preprocess_image(img_bytes)
 
         #Prediction
-        predictions = model.predict(img_array)[0]
-        
-        #Preparer toutes les probabilites pour le graphique
-        all_probs = {class_names[i]: float(predictions[i]) for i in range(len(class_names))}
-        
-        #Trier pour obtenir le Top 3
-        sorted_probs = sorted(all_probs.items(), key=lambda x: x[1], reverse=True)
+        predictions = predictor.predict(img_array)[0]
         
-        #Formatage
-        return jsonify({
-            "predicted_class": sorted_probs[0][0],
-            "confidence": float(sorted_probs[0][1]),
-            "top_3_predictions": [
-                {"class": name, "confidence": conf} for name, conf in sorted_probs[:3]
-            ],
-            "all_probabilities": all_probs
-        })
+        return jsonify(format_prediction(predictions, top_k, include_probs))
+
+    except UploadRejected as e:
+        return jsonify({"error": str(e), "reason": e.reason}), e.status
 
     except Exception as e:
         return jsonify({"error": f"Erreur lors de la prediction : {str(e)}"}), 500
 
 
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Plusieurs fichiers ou une archive tar/zip, une ligne JSON par image"""
+    if predictor is None:
+        return jsonify({"error": "Modele en cours de chargement"}), 503
+    files = [f for key in request.files for f in request.files.getlist(key)]
+    if not files:
+        return jsonify({"error": "Aucun fichier envoye"}), 400
+    
+    def generate():
+        try:
+            for chunk in chunked(enumerate(iter_uploaded_images(files, max_bytes=upload_guard.max_bytes)), BATCH_SIZE):
+                #Les images sont ecrites directement dans le tampon du lot
+                buffer = preprocessing.new_batch_buffer(len(chunk), dtype=predictor.input_dtype)
+                valid = []
+                for index, (filename, img_bytes) in chunk:
+                    try:
+                        upload_guard.check(img_bytes)
+                        preprocessing.preprocess_into(img_bytes, buffer[len(valid)])
+                        valid.append((index, filename))
+                    except UploadRejected as e:
+                        yield json.dumps({"index": index, "filename": filename, "error": str(e), "status": e.status}) + "\n"
+                    except Exception as e:
+                        yield json.dumps({"index": index, "filename": filename, "error": f"Image illisible : {str(e)}"}) + "\n"
+                if not valid:
+                    continue
+                
+                #Un seul appel au modele pour tout le lot
+                predictions = predictor.predict(buffer[:len(valid)])
+                for (index, filename), probs in zip(valid, predictions):
+                    yield json.dumps({"index": index, "filename": filename, **format_prediction(probs)}) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"Erreur lors de la prediction : {str(e)}"}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 #Lancement app
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
\ No newline at end of file
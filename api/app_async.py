@@ -0,0 +1,544 @@
+"""Variante ASGI (asynchrone) de l'API de production
+
+Memes routes et memes reponses JSON que api/app_prod.py (dont elle reutilise
+le modele, le cache et le micro-batcher) :
+- la lecture des envois est non bloquante : un client lent n'occupe pas de
+  worker, des milliers de connexions peuvent attendre sur une seule boucle
+- le decodage (CPU) part dans un pool de threads (ou de processus)
+- l'inference passe par le micro-batcher, attendu sans bloquer la boucle
+
+    uvicorn api.app_async:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+
+from api import app_prod as engine
+from api.batching import Rejected
+from api import metrics, preprocessing
+from api.batch_upload import iter_uploaded_images
+from api.upload_guard import UploadRejected
+from api.cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Pool de décodage : "thread" (PIL relâche le GIL) ou "process"
+DECODE_EXECUTOR = os.environ.get("DECODE_EXECUTOR", "thread")
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", "0")) or os.cpu_count()
+
+if DECODE_EXECUTOR == "process":
+    decode_executor = ProcessPoolExecutor(max_workers=DECODE_WORKERS)
+else:
+    decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+
+class FlaskJSONResponse(Response):
+    """JSON sérialisé comme jsonify() de Flask : réponses identiques à app_prod"""
+
+    media_type = "application/json"
+
+    def render(self, content):
+        return (json.dumps(content, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n").encode()
+
+
+class RequestMetrics:
+    """Compteur et durée des requêtes HTTP (mêmes séries que les hooks
+    before/after_request d'app_prod), mesurés à l'envoi des en-têtes"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            recorded = True
+            endpoint = _endpoint(scope)
+            engine.REQUESTS.inc(endpoint=endpoint, status=str(status))
+            engine.REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start" and not recorded:
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            if not recorded:
+                record(500)
+
+
+def _endpoint(scope):
+    """Route déclarée (ex. /predict), comme request.url_rule.rule côté Flask"""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "inconnue"
+
+
+def _decode_function():
+    """Prétraitement exécuté dans le pool de décodage"""
+    if DECODE_EXECUTOR == "process":
+        # Le résultat revient par pickle : pas de tampon partagé possible ici
+        return partial(preprocessing.preprocess_image, dtype=engine.model.input_dtype)
+    return engine.preprocess_image
+
+
+async def root(request):
+    return FlaskJSONResponse(engine.root_payload())
+
+
+async def health(request):
+    payload, status = engine.health_payload()
+    return FlaskJSONResponse(payload, status_code=status)
+
+
+async def health_live(request):
+    payload, status = engine.live_payload()
+    return FlaskJSONResponse(payload, status_code=status)
+
+
+async def get_classes(request):
+    payload, status = engine.classes_payload()
+    return FlaskJSONResponse(payload, status_code=status)
+
+
+async def get_info(request):
+    payload, status = engine.info_payload()
+    return FlaskJSONResponse(payload, status_code=status)
+
+
+async def get_stats(request):
+    cache = engine.prediction_cache
+    return FlaskJSONResponse({
+        "cache": cache.stats() if cache is not None else {"enabled": False},
+        "queue": engine.queue_stats(),
+        "timestamp": engine.datetime.now().isoformat()
+    })
+
+
+async def get_experiment(request):
+    payload, status = engine.experiment_payload()
+    return FlaskJSONResponse(payload, status_code=status)
+
+
+async def get_metrics(request):
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _values(request, form):
+    """Paramètres du formulaire, puis de la query string (comme request.values de Flask)"""
+    return {
+        name: form.get(name) or request.query_params.get(name)
+        for name in ("top_k", "include_probs")
+    }
+
+
+def _prediction_response(fmt, result, predictions):
+    if fmt == engine.response_format.JSON:
+        return FlaskJSONResponse(result)
+    body, media_type, headers = engine.encoded_prediction(fmt, result, predictions)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def _request_too_large(request):
+    """Refus sur Content-Length avant de lire le multipart ; None si acceptable"""
+    rejected = engine.request_too_large(request.headers.get("content-length"))
+    if rejected is None:
+        return None
+    return FlaskJSONResponse(rejected[0], status_code=rejected[1])
+
+
+class _BodyTooLarge(Exception):
+    def __init__(self, received):
+        super().__init__(received)
+        self.received = received
+
+
+def _counted(request, limit):
+    """Même requête, corps compté pendant la lecture : _BodyTooLarge au-delà de `limit`"""
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                raise _BodyTooLarge(received)
+        return message
+
+    return Request(request.scope, receive)
+
+
+async def _read_form(request):
+    """(formulaire, None) ou (None, réponse 413)
+
+    Content-Length est vérifié avant toute lecture ; sans lui (envoi chunked),
+    la limite REQUEST_MAX_BYTES s'applique pendant la lecture du multipart.
+    """
+    too_large = _request_too_large(request)
+    if too_large is not None:
+        return None, too_large
+    if not engine.REQUEST_MAX_BYTES:
+        return await request.form(), None
+    try:
+        return await _counted(request, engine.REQUEST_MAX_BYTES).form(), None
+    except _BodyTooLarge as e:
+        rejected = engine.request_too_large(e.received)
+        return None, FlaskJSONResponse(rejected[0], status_code=rejected[1])
+
+
+async def _read_upload(file):
+    """Lit au plus UPLOAD_MAX_BYTES + 1 octets et vérifie l'image avant décodage"""
+    size = engine.UPLOAD_MAX_BYTES + 1 if engine.UPLOAD_MAX_BYTES else -1
+    img_bytes = await file.read(size)
+    engine.upload_guard.check(img_bytes)
+    return img_bytes
+
+
+def _upload_rejected(error):
+    payload, status = engine.upload_rejected_payload(error)
+    return FlaskJSONResponse(payload, status_code=status)
+
+
+async def predict(request):
+    """Route de prédiction"""
+    started = time.perf_counter()
+    if engine.model is None:
+        return FlaskJSONResponse({"error": "Modèle non chargé"}, status_code=503)
+
+    # Lecture asynchrone du multipart : aucun worker bloqué par un envoi lent
+    form, too_large = await _read_form(request)
+    if too_large is not None:
+        return too_large
+    file = form.get("file")
+    if file is None or isinstance(file, str):
+        return FlaskJSONResponse({"error": "Aucun fichier envoyé"}, status_code=400)
+    if file.filename == '':
+        return FlaskJSONResponse({"error": "Nom de fichier vide"}, status_code=400)
+
+    options, error = engine.prediction_options(_values(request, form), request.headers.get("accept"))
+    if error is not None:
+        return FlaskJSONResponse(error[0], status_code=error[1])
+
+    record = False
+    try:
+        logger.info(f"Réception d'une image: {file.filename}")
+        with engine.STAGE_LATENCY.time(stage="read"):
+            img_bytes = await _read_upload(file)
+
+        recorder = engine.traffic_recorder
+        record = recorder is not None and recorder.sampled()
+        loop = asyncio.get_running_loop()
+        k = engine.similar_k(request.query_params.get("similar"))
+        if k is not None and engine.similarity_search is None:
+            payload, status = engine.similar_payload(img_bytes, k)
+            return FlaskJSONResponse(payload, status_code=status)
+
+        cache = engine.prediction_cache
+        digest = content_hash(img_bytes) if cache is not None or record else None
+        cached = cache.get(digest) if cache is not None else None
+        if cached is not None:
+            result = engine.format_prediction(cached, options["top_k"], options["include_probs"])
+            if k is not None:
+                payload, _ = await loop.run_in_executor(None, engine.similar_payload, img_bytes, k)
+                result["similar"] = payload["neighbors"]
+            engine.PREDICTIONS.inc(class_name=result['predicted_class'])
+            logger.info(f"✅ Prédiction (cache): {result['predicted_class']} ({result['confidence']:.2%})")
+            if record:
+                engine._record_traffic(img_bytes, digest, file.filename, 200, result, started=started)
+            return _prediction_response(options["format"], result, cached)
+
+        predictions = None
+        embedding = None
+        decoded = None
+        decode = _decode_function()
+        if engine.shape_cascade is not None:
+            # Premier étage de la cascade ; l'image décodée sert ensuite au CNN
+            # (sauf pool de processus : elle ne peut pas y être envoyée sans copie)
+            executor = None if DECODE_EXECUTOR == "process" else decode_executor
+            predictions, decoded = await loop.run_in_executor(executor, engine.cascade_stage, img_bytes)
+            if DECODE_EXECUTOR != "process":
+                decode = partial(engine.preprocess_image, image=decoded)
+        served_by_candidate = False
+        if predictions is None:
+            deadline = engine.request_deadline(request.headers.get(engine.DEADLINE_HEADER), started)
+            engine.check_admission(deadline)
+            with engine.STAGE_LATENCY.time(stage="preprocess"):
+                img_array = await loop.run_in_executor(decode_executor, decode, img_bytes)
+            experiment = engine.experiment
+            served_by_candidate = experiment is not None and experiment.route()
+            shadow_input = experiment.shadow_input(img_array) if experiment is not None else None
+            # Softmax et embedding sortent de la même passe du backend actif
+            joint = k is not None and not served_by_candidate and engine.model.embedding
+            start = time.perf_counter()
+            with engine.STAGE_LATENCY.time(stage="inference"):
+                try:
+                    if served_by_candidate:
+                        future = experiment.submit(img_array)
+                    elif joint:
+                        future = engine.submit_with_embedding(img_array, deadline=deadline, admit=True)
+                    else:
+                        if k is not None:
+                            # Backend sans embedding : sous-modèle Keras, avant que le
+                            # tampon ne soit rendu par l'inférence
+                            embeddings = await loop.run_in_executor(None, engine.similarity_search.embed, img_array)
+                            embedding = embeddings[0]
+                        future = engine.submit_batch(img_array, deadline=deadline, admit=True)
+                    outputs = await asyncio.wrap_future(future)
+                    if joint:
+                        probs, embeddings = engine.split_embedding(outputs)
+                        predictions, embedding = probs[0], embeddings[0]
+                    else:
+                        predictions = outputs[0]
+                    if served_by_candidate and k is not None:
+                        embedding = (await loop.run_in_executor(None, engine.embed_batch, img_array))[0]
+                except Rejected:
+                    # Lot jamais parti vers le modèle : rendre son tampon
+                    engine.model.release_buffer(img_array)
+                    raise
+                finally:
+                    if served_by_candidate:
+                        # Le candidat a son propre backend : le tampon du modèle principal
+                        # (case de l'anneau en mode inference-server) n'est rendu par personne
+                        engine.model.release_buffer(img_array)
+            if experiment is not None and not served_by_candidate:
+                experiment.observe_primary(time.perf_counter() - start)
+            if shadow_input is not None:
+                experiment.shadow(shadow_input, predictions[None])
+
+        if cache is not None and not served_by_candidate:
+            cache.put(digest, predictions)
+        neighbors = None
+        if k is not None:
+            if embedding is None:
+                # Réponse de la cascade : l'image décodée sert aussi à l'embedding
+                payload, _ = await loop.run_in_executor(None, engine.similar_payload, img_bytes, k, decoded)
+                neighbors = payload["neighbors"]
+            else:
+                neighbors = await loop.run_in_executor(None, engine.similar_neighbors, embedding, k)
+        with engine.STAGE_LATENCY.time(stage="serialize"):
+            result = engine.format_prediction(predictions, options["top_k"], options["include_probs"])
+            if neighbors is not None:
+                result["similar"] = neighbors
+            response = _prediction_response(options["format"], result, predictions)
+        engine.PREDICTIONS.inc(class_name=result['predicted_class'])
+        logger.info(f"✅ Prédiction: {result['predicted_class']} ({result['confidence']:.2%})")
+        if record:
+            engine._record_traffic(img_bytes, digest, file.filename, 200, result, started=started)
+        return response
+
+    except UploadRejected as e:
+        return _upload_rejected(e)
+
+    except Rejected as e:
+        payload, status, headers = engine.rejected_payload(e)
+        if record:
+            engine._record_traffic(img_bytes, digest, file.filename, status, started=started)
+        return FlaskJSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la prédiction: {str(e)}")
+        if record:
+            engine._record_traffic(img_bytes, digest, file.filename, 500, started=started)
+        return FlaskJSONResponse({"error": f"Erreur lors de la prédiction: {str(e)}"}, status_code=500)
+
+
+async def predict_grains(request):
+    """Photo de plateau : un résultat par grain (voir app_prod)"""
+    if engine.model is None:
+        return FlaskJSONResponse({"error": "Modèle non chargé"}, status_code=503)
+    form, too_large = await _read_form(request)
+    if too_large is not None:
+        return too_large
+    file = form.get("file")
+    if file is None or isinstance(file, str):
+        return FlaskJSONResponse({"error": "Aucun fichier envoyé"}, status_code=400)
+    if file.filename == '':
+        return FlaskJSONResponse({"error": "Nom de fichier vide"}, status_code=400)
+
+    background = form.get("background") or request.query_params.get("background", "auto")
+    if background not in ("auto", "dark", "light"):
+        return FlaskJSONResponse({"error": "background doit valoir auto, dark ou light"}, status_code=400)
+
+    try:
+        img_bytes = await _read_upload(file)
+        loop = asyncio.get_running_loop()
+        payload, status = await loop.run_in_executor(None, engine.grains_payload, img_bytes, background)
+        return FlaskJSONResponse(payload, status_code=status)
+    except UploadRejected as e:
+        return _upload_rejected(e)
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'analyse multi-grains: {str(e)}")
+        return FlaskJSONResponse({"error": f"Erreur lors de l'analyse multi-grains: {str(e)}"}, status_code=500)
+
+
+async def similar(request):
+    """Grains de référence les plus proches de l'image envoyée"""
+    form, too_large = await _read_form(request)
+    if too_large is not None:
+        return too_large
+    file = form.get("file")
+    if file is None or isinstance(file, str):
+        return FlaskJSONResponse({"error": "Aucun fichier envoyé"}, status_code=400)
+    if file.filename == '':
+        return FlaskJSONResponse({"error": "Nom de fichier vide"}, status_code=400)
+
+    try:
+        img_bytes = await _read_upload(file)
+        value = form.get("k") or request.query_params.get("k")
+        k = engine.similar_k(value, engine.SIMILARITY_K)
+        loop = asyncio.get_running_loop()
+        payload, status = await loop.run_in_executor(None, engine.similar_payload, img_bytes, k)
+        return FlaskJSONResponse(payload, status_code=status)
+    except UploadRejected as e:
+        return _upload_rejected(e)
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la recherche de similarité: {str(e)}")
+        return FlaskJSONResponse({"error": f"Erreur lors de la recherche de similarité: {str(e)}"}, status_code=500)
+
+
+def _read_chunk(images):
+    """Lit le prochain lot d'images de l'envoi (dans un thread : un générateur
+    ne peut pas être transmis à un pool de processus)"""
+    chunk = []
+    for item in images:
+        chunk.append(item)
+        if len(chunk) >= engine.BATCH_MAX_SIZE:
+            break
+    return chunk
+
+
+def _preprocess_next(images):
+    """Lit et prétraite le prochain lot (pool de threads, tampon du backend)"""
+    chunk = _read_chunk(images)
+    return engine._preprocess_chunk(chunk) if chunk else None
+
+
+def _decode_chunk(chunk, dtype, guard):
+    """Décodage d'un lot dans le pool de processus : seuls les octets y sont envoyés,
+    le lot revient par pickle dans un tampon local"""
+    buffer = preprocessing.new_batch_buffer(len(chunk), dtype=dtype)
+    valid, errors = engine.decode_chunk(chunk, buffer, guard)
+    return valid, buffer[:len(valid)], errors
+
+
+async def _next_chunk(loop, images):
+    """Prochain lot prétraité -> (valides, lot, erreurs), None en fin d'envoi"""
+    if DECODE_EXECUTOR != "process":
+        return await loop.run_in_executor(decode_executor, _preprocess_next, images)
+    chunk = await loop.run_in_executor(None, _read_chunk, images)
+    if not chunk:
+        return None
+    prepared = await loop.run_in_executor(
+        decode_executor, _decode_chunk, chunk, engine.model.input_dtype, engine.upload_guard
+    )
+    engine.count_upload_rejections(prepared[2])
+    return prepared
+
+
+async def predict_batch(request):
+    """Prédiction multi-images, un enregistrement par image (voir app_prod)"""
+    if engine.model is None:
+        return FlaskJSONResponse({"error": "Modèle non chargé"}, status_code=503)
+    form, too_large = await _read_form(request)
+    if too_large is not None:
+        return too_large
+    files = [f for _, f in form.multi_items() if not isinstance(f, str)]
+    if not files:
+        return FlaskJSONResponse({"error": "Aucun fichier envoyé"}, status_code=400)
+
+    options, error = engine.prediction_options(_values(request, form), request.headers.get("accept"))
+    if error is not None:
+        return FlaskJSONResponse(error[0], status_code=error[1])
+
+    async def generate():
+        loop = asyncio.get_running_loop()
+        images = enumerate(iter_uploaded_images(files, max_bytes=engine.UPLOAD_MAX_BYTES))
+        pending = deque()
+        try:
+            while True:
+                prepared = await _next_chunk(loop, images)
+                if prepared is None:
+                    break
+                valid, batch, errors = prepared
+                for error in errors:
+                    yield engine._batch_record(options, error)
+                if valid:
+                    pending.append((valid, engine.submit_batch(batch)))
+                while pending and pending[0][1].done():
+                    for line in engine._emit_results(*pending.popleft(), options):
+                        yield line
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de la lecture du lot: {str(e)}")
+            yield engine._batch_record(options, {"error": f"Erreur lors de la lecture du lot: {str(e)}"})
+        while pending:
+            valid, future = pending.popleft()
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                pass
+            for line in engine._emit_results(valid, future, options):
+                yield line
+
+    media_type, headers = engine.batch_media_type(options)
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+
+async def not_found(request, exc):
+    return FlaskJSONResponse({"error": "Route non trouvée"}, status_code=404)
+
+
+async def internal_error(request, exc):
+    return FlaskJSONResponse({"error": "Erreur serveur interne"}, status_code=500)
+
+
+routes = [
+    Route("/", root, methods=["GET"]),
+    Route("/health", health, methods=["GET"]),
+    Route("/health/ready", health, methods=["GET"]),
+    Route("/health/live", health_live, methods=["GET"]),
+    Route("/classes", get_classes, methods=["GET"]),
+    Route("/info", get_info, methods=["GET"]),
+    Route("/stats", get_stats, methods=["GET"]),
+    Route("/experiment", get_experiment, methods=["GET"]),
+    Route("/metrics", get_metrics, methods=["GET"]),
+    Route("/predict", predict, methods=["POST"]),
+    Route("/predict/batch", predict_batch, methods=["POST"]),
+    Route("/predict/grains", predict_grains, methods=["POST"]),
+    Route("/similar", similar, methods=["POST"]),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestMetrics),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["GET", "POST"],
+            allow_headers=["Content-Type", "X-Request-Timeout-Ms"]
+        )
+    ],
+    exception_handlers={404: not_found, 500: internal_error}
+)
@@ -1,14 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_app_context, request, jsonify, stream_with_context
 from flask_cors import CORS
-from PIL import Image
 import numpy as np
-import tensorflow as tf
 import json
-import io
 import os
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from api.batching import MicroBatcher, Rejected
+from api.backends import detect_backend, load_backend, parse_buckets
+from api.batch_upload import chunked, iter_uploaded_images
+from api import preprocessing
+from api.cache import PredictionCache, content_hash
+from api import metrics
+from api import response_format
+from api.traffic import TrafficRecorder
+from api.model_registry import ModelRegistry, ModelWatcher
+from api.experiment import Experiment
+from api.startup import Startup, import_runtime
+from api.upload_guard import UploadGuard, UploadRejected, parse_formats
+
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,120 +38,839 @@ CORS(app, resources={
     r"/*": {
         "origins": ["*"],  # En prod, mettre les domaines autorisés
         "methods": ["GET", "POST"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "X-Request-Timeout-Ms"]
     }
 })
 
 # Chemins
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-MODEL_PATH = os.path.join(BASE_DIR, "modele", "classification_type_riz.keras")
-LABELS_PATH = os.path.join(BASE_DIR, "modele", "class_names.json")
+MODEL_PATH = os.environ.get(
+    "MODEL_PATH", os.path.join(BASE_DIR, "modele", "classification_type_riz.keras")
+)
+LABELS_PATH = os.environ.get(
+    "LABELS_PATH", os.path.join(BASE_DIR, "modele", "class_names.json")
+)
+
+# Backend d'inférence : keras, tflite, onnx, remote ou auto (selon l'extension de MODEL_PATH)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "auto")
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0")) or None
+
+# Backend "remote" : socket Unix du processus d'inférence dédié (api.inference_server)
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET", "/tmp/rice-inference.sock")
+
+# Positionné par gunicorn.conf.py quand le maître charge l'application avant le fork
+PRELOAD_APP = os.environ.get("PRELOAD_APP") == "1"
+
+# Chargement du modèle en arrière-plan (hors preload) : le worker répond tout de
+# suite à / et /health/live, /health/ready passe à 200 quand l'inférence est prête
+BACKGROUND_LOAD = os.environ.get("BACKGROUND_LOAD", "1") == "1"
+
+# Cache disque du modèle optimisé (backend onnx : graphe après optimisations
+# ONNX Runtime), réutilisé aux démarrages suivants
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR")
+
+# Registre de modèles versionnés (opt-in, voir api.model_registry) : le modèle et
+# les labels viennent de la version pointée par CURRENT, sondée toutes les
+# MODEL_POLL_SECONDS secondes pour un rechargement à chaud
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR")
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", "5"))
 
 # Variables globales
 model = None
 class_names = None
-IMG_SIZE = (224, 224)
+model_version = None
+experiment = None
+
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR) if MODEL_REGISTRY_DIR else None
+if model_registry is not None and model_registry.current():
+    _version = model_registry.get(model_registry.current())
+    MODEL_PATH, LABELS_PATH, model_version = _version.model_path, _version.labels_path, _version.name
+IMG_SIZE = preprocessing.IMG_SIZE
+
+# Micro-batching : un lot part des qu'il atteint BATCH_MAX_SIZE images
+# ou apres BATCH_MAX_WAIT_MS millisecondes d'attente
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+
+# Contrôle d'admission de /predict sous surcharge : au-delà de INFERENCE_MAX_QUEUE
+# requêtes en attente, refus immédiat (429) ; une requête dont l'échéance
+# (REQUEST_DEADLINE_MS, ou l'en-tête X-Request-Timeout-Ms du client s'il est plus
+# court) ne peut pas être tenue est refusée (503), et abandonnée avant l'inférence
+# si elle expire dans la file. Les refus portent un en-tête Retry-After. 0 = désactivé.
+INFERENCE_MAX_QUEUE = int(os.environ.get("INFERENCE_MAX_QUEUE", "64"))
+REQUEST_DEADLINE_MS = float(os.environ.get("REQUEST_DEADLINE_MS", "30000"))
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+# Tailles de lot pour lesquelles le graphe d'inference est compile
+INFERENCE_BUCKETS = parse_buckets(os.environ.get("INFERENCE_BUCKETS"))
+
+# Cache des prédictions (clé = SHA-256 de l'image), partagé via Redis si configuré
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") == "1"
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "3600"))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+
+# Enregistrement du trafic /predict (opt-in) pour le rejeu avec api.replay
+TRAFFIC_LOG_PATH = os.environ.get("TRAFFIC_LOG_PATH")
+TRAFFIC_SAMPLE_RATE = float(os.environ.get("TRAFFIC_SAMPLE_RATE", "1.0"))
+TRAFFIC_IMAGE_DIR = os.environ.get("TRAFFIC_IMAGE_DIR")
+
+# Grains similaires (/similar, /predict?similar=k) : index construit hors ligne
+# par `python -m api.similarity build`, ouvert en memmap au démarrage
+SIMILARITY_INDEX_DIR = os.environ.get(
+    "SIMILARITY_INDEX_DIR", os.path.join(BASE_DIR, "modele", "similarity")
+)
+# Modèle Keras de l'embedding quand le backend ne le produit pas (tflite, onnx)
+SIMILARITY_MODEL_PATH = os.environ.get(
+    "SIMILARITY_MODEL_PATH", os.path.join(BASE_DIR, "modele", "classification_type_riz.keras")
+)
+SIMILARITY_K = int(os.environ.get("SIMILARITY_K", "5"))
+SIMILARITY_MAX_K = int(os.environ.get("SIMILARITY_MAX_K", "50"))
+SIMILARITY_NPROBE = int(os.environ.get("SIMILARITY_NPROBE", "8"))
+
+# Modèle candidat (opt-in) comparé au modèle principal sur le trafic /predict :
+# "shadow" (copie asynchrone, hors du chemin de la réponse) ou "split" (A/B)
+EXPERIMENT_MODEL_PATH = os.environ.get("EXPERIMENT_MODEL_PATH")
+EXPERIMENT_BACKEND = os.environ.get("EXPERIMENT_BACKEND", "auto")
+EXPERIMENT_MODE = os.environ.get("EXPERIMENT_MODE", "shadow")
+EXPERIMENT_FRACTION = float(os.environ.get("EXPERIMENT_FRACTION", "0.1"))
+EXPERIMENT_MAX_PENDING = int(os.environ.get("EXPERIMENT_MAX_PENDING", "256"))
+
+# Mode multi-grains (/predict/grains) : nombre max de grains classés par photo
+GRAINS_MAX = int(os.environ.get("GRAINS_MAX", "500"))
+# Plus grand côté de la copie réduite utilisée pour la segmentation (segmentation.MAX_SIDE)
+GRAINS_SEGMENT_MAX_SIDE = int(os.environ.get("GRAINS_SEGMENT_MAX_SIDE", "1600"))
+
+# Garde-fou des envois (api.upload_guard), vérifié avant tout décodage : taille
+# max d'une image, d'une requête entière (refus avant lecture du corps), budget
+# de pixels lu dans l'en-tête et formats autorisés (signature). 0 = pas de limite
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+REQUEST_MAX_BYTES = int(os.environ.get("REQUEST_MAX_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.environ.get("UPLOAD_MAX_PIXELS", "40000000"))
+UPLOAD_FORMATS = parse_formats(os.environ.get("UPLOAD_FORMATS"))
+
+app.config["MAX_CONTENT_LENGTH"] = REQUEST_MAX_BYTES or None
+
+# Cascade (opt-in) : classifieur de forme avant le CNN, servi seul au-dessus du seuil
+CASCADE_ENABLED = os.environ.get("CASCADE_ENABLED", "0") == "1"
+CASCADE_PATH = os.environ.get(
+    "CASCADE_PATH", os.path.join(BASE_DIR, "modele", "shape_classifier.npz")
+)
+CASCADE_THRESHOLD = float(os.environ.get("CASCADE_THRESHOLD", "0.95"))
 
 # Chargement du modèle
+def load_model_version(model_path, labels_path):
+    """Charge et préchauffe un backend + ses labels (démarrage ou rechargement à chaud)"""
+    if MODEL_BACKEND == "remote" and model is not None:
+        # Le processus d'inférence dédié recharge lui-même le modèle : ici, les labels seulement
+        backend = model
+    else:
+        path = INFERENCE_SOCKET if MODEL_BACKEND == "remote" else model_path
+        logger.info(f"Chargement du modèle depuis: {path} (backend: {MODEL_BACKEND})")
+        backend = load_backend(
+            path,
+            kind=MODEL_BACKEND,
+            bucket_sizes=INFERENCE_BUCKETS,
+            num_threads=INFERENCE_THREADS,
+            cache_dir=MODEL_CACHE_DIR
+        )
+        logger.info("Modele charg avec succes")
+
+        # Compilation + préchauffage : la première requête ne paie pas le traçage
+        backend.warmup()
+
+    logger.info(f"Chargement des labels depuis: {labels_path}")
+    with open(labels_path, "r") as f:
+        class_indices = json.load(f)
+    
+    # Inversion dictionnaire index → classe
+    names = {v: k for k, v in class_indices.items()}
+    logger.info(f"✅ Labels charges: {list(names.values())}")
+    return backend, names
+
+def load_experiment():
+    """Charge le modèle candidat ; en cas d'échec l'API sert sans expérience"""
+    global experiment
+    if not EXPERIMENT_MODEL_PATH:
+        return
+    try:
+        logger.info(f"Chargement du modèle candidat: {EXPERIMENT_MODEL_PATH} ({EXPERIMENT_MODE})")
+        backend = load_backend(
+            EXPERIMENT_MODEL_PATH,
+            kind=EXPERIMENT_BACKEND,
+            bucket_sizes=INFERENCE_BUCKETS,
+            num_threads=INFERENCE_THREADS,
+            cache_dir=MODEL_CACHE_DIR
+        )
+        backend.warmup()
+        experiment = Experiment(
+            backend, class_names,
+            mode=EXPERIMENT_MODE,
+            fraction=EXPERIMENT_FRACTION,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            max_pending=EXPERIMENT_MAX_PENDING,
+            name=os.path.basename(EXPERIMENT_MODEL_PATH)
+        )
+    except Exception as e:
+        logger.error(f"Modèle candidat non chargé, expérience désactivée: {e}")
+        experiment = None
+
 def load_resources():
-    """Charge le modele et les labels au demarrage"""
+    """Charge le modele et les labels au demarrage (phases chronométrées dans `startup`)"""
     global model, class_names
     
     try:
-        logger.info(f"Chargement du modèle depuis: {MODEL_PATH}")
-        model = tf.keras.models.load_model(MODEL_PATH)
-        logger.info("Modele charg avec succes")
-
-        logger.info(f"Chargement des labels depuis: {LABELS_PATH}")
-        with open(LABELS_PATH, "r") as f:
-            class_indices = json.load(f)
-        
-        # Inversion dictionnaire index → classe
-        class_names = {v: k for k, v in class_indices.items()}
-        logger.info(f"✅ Labels charges: {list(class_names.values())}")
-        
-        return True
+        with startup.phase("import"):
+            import_runtime(_backend_kind())
+        loaded, names = load_model_version(MODEL_PATH, LABELS_PATH)
+        startup.record("load", getattr(loaded, "load_seconds", None))
+        startup.record("warmup", loaded.warmup_seconds)
+        # `model` n'est publié qu'une fois préchauffé
+        model, class_names = loaded, names
     except Exception as e:
         logger.error(f"Erreur lors du chargement des ressources: {e}")
+        startup.error = str(e)
         return False
+    if EXPERIMENT_MODEL_PATH:
+        with startup.phase("experiment"):
+            load_experiment()
+    return True
+
+def _backend_kind():
+    return detect_backend(MODEL_PATH) if MODEL_BACKEND == "auto" else MODEL_BACKEND
+
+def start_loading():
+    """Charge le modèle en arrière-plan (BACKGROUND_LOAD) ou avant de rendre la main"""
+    if BACKGROUND_LOAD:
+        startup.run_in_background(load_resources)
+    elif not startup.run(load_resources):
+        logger.warning("L'API démarre sans modèle chargé")
+
+startup = Startup()
 
 # Charger au démarrage
-if not load_resources():
-    logger.warning("L'API démarre sans modèle chargé")
+if PRELOAD_APP and _backend_kind() == "keras":
+    # Les pools de threads TensorFlow ne survivent pas au fork : un modèle keras
+    # chargé dans le maître ne peut pas être partagé avec les workers
+    raise RuntimeError(
+        "SERVE_MODE=preload n'est pas compatible avec le backend keras : exporter le modèle "
+        "en tflite/onnx (python -m api.export_model) ou utiliser SERVE_MODE=workers ou inference-server"
+    )
+elif PRELOAD_APP:
+    # Le maître doit tenir le modèle avant le fork pour le partager
+    if not startup.run(load_resources):
+        logger.warning("L'API démarre sans modèle chargé")
+else:
+    start_loading()
+
+
+def prepare_fork():
+    """Appelé par le maître gunicorn juste avant le fork d'un worker"""
+    if model is not None:
+        model.prepare_fork()
+    if experiment is not None:
+        experiment.backend.prepare_fork()
+
+def after_fork():
+    """Appelé dans chaque worker après le fork (mode preload)"""
+    global startup
+    if model_watcher is not None:
+        model_watcher.start()
+    if model is None:
+        startup = Startup()
+        start_loading()
+        return
+    model.after_fork()
+    if experiment is not None:
+        experiment.backend.after_fork()
+    logger.info(f"Worker {os.getpid()} prêt (modèle partagé avec le maître)")
+
+
+def run_inference(batch):
+    """Appel unique au modele pour un lot (n, 224, 224, 3)"""
+    return model.predict(batch)
+
+def run_embedding_inference(batch):
+    """Softmax suivie de l'embedding (n, classes + d), en une passe du modele"""
+    return model.predict_with_embedding(batch)
+
+
+# Métriques Prometheus (/metrics)
+REQUESTS = metrics.Counter(
+    "rice_http_requests_total", "Requetes HTTP par route et statut", ("endpoint", "status")
+)
+REQUEST_LATENCY = metrics.Histogram(
+    "rice_http_request_duration_seconds", "Duree totale des requetes HTTP", ("endpoint",)
+)
+STAGE_LATENCY = metrics.Histogram(
+    "rice_predict_stage_seconds",
+    "Duree des etapes de prediction (read, shape, preprocess, inference, serialize, similar, segment)",
+    ("stage",)
+)
+BATCH_SIZE = metrics.Histogram(
+    "rice_inference_batch_size", "Images par lot d'inference", buckets=metrics.BATCH_SIZE_BUCKETS
+)
+BATCH_LATENCY = metrics.Histogram("rice_inference_batch_seconds", "Duree d'inference d'un lot")
+QUEUE_DEPTH = metrics.Gauge("rice_inference_queue_depth", "Requetes en attente d'un lot d'inference")
+QUEUE_LIMIT = metrics.Gauge("rice_inference_queue_limit", "Requetes en attente au-dela desquelles /predict refuse")
+QUEUE_WAIT = metrics.Gauge("rice_inference_queue_wait_seconds", "Attente estimee d'une nouvelle requete")
+REJECTED = metrics.Counter(
+    "rice_admission_rejected_total",
+    "Requetes /predict refusees avant inference (queue_full, deadline, expired)",
+    ("reason",)
+)
+MODEL_LOAD = metrics.Gauge("rice_model_load_seconds", "Duree de chargement du modele")
+MODEL_WARMUP = metrics.Gauge("rice_model_warmup_seconds", "Duree du prechauffage du modele")
+CACHE_REQUESTS = metrics.Counter(
+    "rice_cache_requests_total", "Acces au cache des predictions", ("result",)
+)
+CACHE_HIT_RATIO = metrics.Gauge("rice_cache_hit_ratio", "Taux de succes du cache des predictions")
+PREDICTIONS = metrics.Counter(
+    "rice_predictions_total", "Predictions servies par classe", ("class_name",)
+)
+UPLOAD_REJECTED = metrics.Counter(
+    "rice_upload_rejected_total",
+    "Envois refuses avant decodage (too_large, request_too_large, format, unreadable, too_many_pixels, empty)",
+    ("reason",)
+)
+CASCADE_ANSWERS = metrics.Counter(
+    "rice_cascade_answers_total", "Predictions de la cascade par etage (shape, cnn)", ("stage",)
+)
+EXPERIMENT_SERVED = metrics.Counter(
+    "rice_experiment_served_total", "Reponses /predict par modele (primary, candidate)", ("arm",)
+)
+EXPERIMENT_AGREEMENT = metrics.Gauge(
+    "rice_experiment_agreement_ratio", "Taux d'accord du candidat en shadow"
+)
+
+def _observe_batch(size, seconds):
+    BATCH_SIZE.observe(size)
+    BATCH_LATENCY.observe(seconds)
+
+batcher = MicroBatcher(
+    run_inference,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    on_batch=_observe_batch,
+    max_queue=INFERENCE_MAX_QUEUE
+)
+
+# Requêtes /predict?similar=k : file à part, le modèle y produit aussi l'embedding
+embedding_batcher = MicroBatcher(
+    run_embedding_inference,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    on_batch=_observe_batch,
+    max_queue=INFERENCE_MAX_QUEUE
+)
+
+# Le processus d'inférence dédié regroupe déjà les requêtes de tous les workers
+remote_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="remote-inference")
+# Sa file n'est pas visible d'ici : on borne les requêtes en vol de ce worker
+remote_slots = threading.BoundedSemaphore(INFERENCE_MAX_QUEUE) if INFERENCE_MAX_QUEUE else None
+
+prediction_cache = PredictionCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    redis_url=CACHE_REDIS_URL,
+    # Avec le registre, la version est fixée à chaque bascule (_activate_version)
+    watch_path=MODEL_PATH if model_registry is None else None
+) if CACHE_ENABLED else None
+if prediction_cache is not None and model_version is not None:
+    prediction_cache.set_version(model_version)
+
+def _activate_version(loaded, version):
+    """Bascule vers une version chargée : les lots suivants partent sur le nouveau modèle"""
+    global model, class_names, model_version
+    # run_inference() relit `model` à chaque lot : le lot en cours finit sur l'ancien
+    model, class_names = loaded
+    model_version = version.name
+    if prediction_cache is not None:
+        prediction_cache.set_version(version.name)
+    if experiment is not None:
+        experiment.reset_stats(class_names)
+    if similarity_search is not None:
+        # Sous-modèle d'embedding des backends tflite/onnx : rechargé au prochain appel
+        similarity_search.reset()
+
+def check_embedding(backend, names):
+    """ValueError si l'embedding du backend n'a pas la dimension de l'index de similarité"""
+    # Processus dédié : il bascule de son côté, la version servie peut encore être l'ancienne
+    if similarity_search is None or not backend.embedding or backend.batches_remotely:
+        return
+    # Passe d'essai hors requêtes : prépare aussi la fonction softmax + embedding
+    sample = np.zeros((1,) + tuple(backend.input_shape), dtype=backend.input_dtype)
+    dim = backend.predict_with_embedding(sample).shape[1] - len(names)
+    if dim != similarity_search.index.dim:
+        raise ValueError(
+            f"Embedding de dimension {dim}, l'index de similarité attend {similarity_search.index.dim} "
+            "(reconstruire l'index avec python -m api.similarity build)"
+        )
+
+def load_registered_version(version):
+    """Charge une version du registre ; refusée si son embedding ne correspond pas à l'index"""
+    loaded = load_model_version(version.model_path, version.labels_path)
+    check_embedding(*loaded)
+    return loaded
+
+model_watcher = ModelWatcher(
+    model_registry,
+    load=load_registered_version,
+    activate=_activate_version,
+    interval=MODEL_POLL_SECONDS,
+    active=model_version
+) if model_registry is not None else None
+if model_watcher is not None and not PRELOAD_APP:
+    model_watcher.start()
+
+upload_guard = UploadGuard(
+    max_bytes=UPLOAD_MAX_BYTES,
+    max_pixels=UPLOAD_MAX_PIXELS,
+    formats=UPLOAD_FORMATS
+)
+
+traffic_recorder = TrafficRecorder(
+    TRAFFIC_LOG_PATH,
+    sample_rate=TRAFFIC_SAMPLE_RATE,
+    image_dir=TRAFFIC_IMAGE_DIR
+) if TRAFFIC_LOG_PATH else None
+
+# Les fonctionnalités optionnelles (similarité, cascade, multi-grains) n'importent
+# leur module qu'une fois activées : ni temps d'import ni dépendance sinon
+def _load_similarity():
+    if not os.path.exists(os.path.join(SIMILARITY_INDEX_DIR, "meta.json")):
+        return None
+    from api.similarity import load_search
+    return load_search(
+        SIMILARITY_INDEX_DIR,
+        model_path=SIMILARITY_MODEL_PATH,
+        nprobe=SIMILARITY_NPROBE
+    )
+
+similarity_search = _load_similarity()
+
+def _load_cascade():
+    if not CASCADE_ENABLED:
+        return None
+    try:
+        from api.cascade import ShapeCascade
+        cascade = ShapeCascade(CASCADE_PATH, threshold=CASCADE_THRESHOLD)
+        logger.info(f"✅ Cascade de forme chargée (seuil {CASCADE_THRESHOLD})")
+        return cascade
+    except Exception as e:
+        logger.error(f"Cascade de forme désactivée: {e}")
+        return None
+
+shape_cascade = _load_cascade()
+
+EXPERIMENT_SERVED.set_function(lambda: {
+    (arm,): n for arm, n in experiment.stats.served.items()
+} if experiment is not None else {})
+EXPERIMENT_AGREEMENT.set_function(
+    lambda: experiment.stats.snapshot()["agreement_rate"] if experiment is not None else None
+)
+
+QUEUE_DEPTH.set_function(batcher.queue_depth)
+QUEUE_LIMIT.set_function(lambda: INFERENCE_MAX_QUEUE or None)
+QUEUE_WAIT.set_function(batcher.estimated_wait)
+MODEL_LOAD.set_function(lambda: getattr(model, "load_seconds", None))
+MODEL_WARMUP.set_function(lambda: model.warmup_seconds if model is not None else None)
+if prediction_cache is not None:
+    CACHE_REQUESTS.set_function(lambda: {
+        ("hit",): prediction_cache.hits, ("miss",): prediction_cache.misses
+    })
+    CACHE_HIT_RATIO.set_function(lambda: prediction_cache.stats()["hit_rate"])
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "inconnue"
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    if "request_start" in g:
+        REQUEST_LATENCY.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+# Garde-fou des envois
+def read_upload(stream):
+    """Lit une image envoyée (au plus UPLOAD_MAX_BYTES + 1 octets) et la vérifie ;
+    UploadRejected avant tout décodage"""
+    data = upload_guard.read(stream)
+    upload_guard.check(data)
+    return data
+
+def upload_rejected_payload(error):
+    UPLOAD_REJECTED.inc(reason=error.reason)
+    logger.warning(f"⛔ Envoi refusé ({error.reason}): {error}")
+    return {"error": str(error), "reason": error.reason}, error.status
+
+def request_too_large(content_length):
+    """Refus sur l'en-tête Content-Length, avant de lire le corps ; None si acceptable"""
+    try:
+        length = int(content_length) if content_length else 0
+    except ValueError:
+        return None
+    if REQUEST_MAX_BYTES and length > REQUEST_MAX_BYTES:
+        return upload_rejected_payload(UploadRejected(
+            f"Requête trop volumineuse (> {REQUEST_MAX_BYTES // (1024 * 1024)} Mo)", 413, "request_too_large"
+        ))
+    return None
 
 # Prétraitement image
-def preprocess_image(image_content):
-    """Prend les bytes de l'image, traite et retourne l'array prêt pour le modèle"""
+def preprocess_image(image_content, timings=None, image=None):
+    """Prend les bytes de l'image, traite et retourne l'array prêt pour le modèle
+
+    `image` : image déjà décodée en 224x224 (cascade), pour ne pas décoder deux fois
+    """
+    # Tampon fourni par le backend : en mode inference-server, une case de la
+    # mémoire partagée, les pixels ne sont alors jamais sérialisés
+    buffer = model.input_buffer(1) if model is not None else preprocessing.new_batch_buffer(1)
     try:
-        image = Image.open(io.BytesIO(image_content)).convert("RGB")
-        image = image.resize(IMG_SIZE)
-        img_array = np.array(image) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
-        return img_array
+        if image is None:
+            preprocessing.preprocess_into(image_content, buffer[0], timings=timings)
+        else:
+            preprocessing.to_array(image, buffer[0], timings=timings)
+        return buffer
     except Exception as e:
+        if model is not None:
+            model.release_buffer(buffer)
         logger.error(f"Erreur prétraitement: {e}")
         raise
 
-# Routes API
-@app.route("/", methods=["GET"])
-def root():
-    """Route racine - Informations sur l'API"""
-    return jsonify({
+def cascade_stage(image_content, timings=None):
+    """Premier étage : (probabilités ou None si pas assez confiant, image décodée)
+
+    L'image décodée en 224x224 est réutilisée par preprocess_image() quand
+    la requête continue vers le CNN.
+    """
+    start = time.perf_counter()
+    decoded = preprocessing.decode_image(image_content, timings=timings)
+    predictions = shape_cascade.answer(decoded)
+    elapsed = time.perf_counter() - start
+    STAGE_LATENCY.observe(elapsed, stage="shape")
+    if timings is not None:
+        timings["shape"] = elapsed * 1000.0
+    CASCADE_ANSWERS.inc(stage="shape" if predictions is not None else "cnn")
+    return predictions, decoded
+
+def request_deadline(client_timeout_ms=None, started=None):
+    """Échéance (time.monotonic()) d'une requête reçue à `started` (perf_counter)
+
+    La plus courte entre REQUEST_DEADLINE_MS et le délai annoncé par le
+    client (en-tête X-Request-Timeout-Ms) ; None si aucune des deux.
+    """
+    budgets = [REQUEST_DEADLINE_MS] if REQUEST_DEADLINE_MS > 0 else []
+    try:
+        if client_timeout_ms and float(client_timeout_ms) > 0:
+            budgets.append(float(client_timeout_ms))
+    except ValueError:
+        pass
+    if not budgets:
+        return None
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    return time.monotonic() + min(budgets) / 1000.0 - elapsed
+
+def check_admission(deadline=None):
+    """Refus anticipé (Rejected) avant de payer le décodage et le prétraitement"""
+    if model.batches_remotely:
+        if deadline is not None and deadline <= time.monotonic():
+            raise Rejected("Échéance dépassée avant l'inférence", status=503, reason="expired")
+        return
+    batcher.check_admission(deadline)
+
+def rejected_payload(error):
+    """(payload, status, en-têtes) d'une requête refusée par le contrôle d'admission"""
+    REJECTED.inc(reason=error.reason)
+    logger.warning(f"⛔ Requête refusée ({error.reason}): {error}")
+    return (
+        {"error": str(error), "reason": error.reason, "retry_after": int(error.retry_after_header)},
+        error.status,
+        {"Retry-After": error.retry_after_header}
+    )
+
+def _predict_remote(batch, deadline=None, admit=False, embedding=False):
+    """Processus dédié : admission sur les requêtes en vol de ce worker"""
+    predict_fn = model.predict_with_embedding if embedding else model.predict
+    if not admit:
+        return predict_fn(batch)
+    check_admission(deadline)
+    if remote_slots is not None and not remote_slots.acquire(blocking=False):
+        raise Rejected(
+            f"Trop de requêtes en cours ({INFERENCE_MAX_QUEUE})", status=429, reason="queue_full"
+        )
+    try:
+        return predict_fn(batch)
+    finally:
+        if remote_slots is not None:
+            remote_slots.release()
+
+def predict_batch_sync(batch, deadline=None, admit=False):
+    """Inférence bloquante d'un lot (micro-batcher local ou processus dédié)
+
+    admit=True : contrôle d'admission (file bornée, échéance), peut lever Rejected
+    """
+    if model.batches_remotely:
+        return _predict_remote(batch, deadline, admit)
+    return batcher.predict(batch, deadline=deadline, admit=admit)
+
+def submit_batch(batch, deadline=None, admit=False):
+    """Inférence asynchrone d'un lot -> Future"""
+    if model.batches_remotely:
+        return remote_executor.submit(_predict_remote, batch, deadline, admit)
+    return batcher.submit(batch, deadline=deadline, admit=admit)
+
+def submit_with_embedding(batch, deadline=None, admit=False):
+    """Comme submit_batch, sortie (n, classes + d) : voir split_embedding()"""
+    if model.batches_remotely:
+        return remote_executor.submit(_predict_remote, batch, deadline, admit, True)
+    return embedding_batcher.submit(batch, deadline=deadline, admit=admit)
+
+def split_embedding(outputs):
+    """(n, classes + d) -> (softmax (n, classes), embeddings (n, d))"""
+    num_classes = len(class_names)
+    return outputs[:, :num_classes], outputs[:, num_classes:]
+
+def predict_with_embedding_sync(batch, deadline=None, admit=False):
+    """Softmax et embeddings d'un lot en une seule passe du backend actif
+
+    Réservé aux backends qui exposent l'embedding (model.embedding)
+    """
+    if model.batches_remotely:
+        outputs = _predict_remote(batch, deadline, admit, embedding=True)
+    else:
+        outputs = embedding_batcher.predict(batch, deadline=deadline, admit=admit)
+    return split_embedding(outputs)
+
+def embed_batch(batch):
+    """Embeddings (n, d) d'un lot prétraité ; le tampon est rendu comme après une inférence
+
+    Par le backend actif si possible, sinon (tflite, onnx) par le sous-modèle
+    Keras de l'index de similarité
+    """
+    if model.embedding:
+        return predict_with_embedding_sync(batch)[1]
+    try:
+        return similarity_search.embed(batch)
+    finally:
+        model.release_buffer(batch)
+
+def format_prediction(predictions, top_k=None, include_probs=True):
+    """Construit la reponse a partir de la sortie softmax d'une image
+
+    top_k : taille du classement (None = top_3_predictions historique, 0 = aucun) ;
+    include_probs : distribution complète
+    """
+    return response_format.prediction_payload(predictions, class_names, top_k, include_probs)
+
+def prediction_options(values, accept):
+    """(options, None) ou (None, (payload, status)) : top_k, include_probs, format négocié"""
+    fmt = response_format.negotiate(accept)
+    if fmt is None:
+        return None, ({"error": "Format de réponse non disponible",
+                       "available": response_format.available()}, 406)
+    try:
+        top_k = response_format.parse_top_k(values.get("top_k"), len(class_names))
+    except ValueError:
+        return None, ({"error": "top_k doit être un entier positif"}, 400)
+    return {
+        "top_k": top_k,
+        "include_probs": response_format.parse_flag(values.get("include_probs")),
+        "format": fmt
+    }, None
+
+def encoded_prediction(fmt, result, predictions):
+    """(contenu, type, en-têtes) d'une prédiction en MessagePack ou float32 brut"""
+    if fmt == response_format.FLOAT32:
+        return response_format.float32_bytes(predictions), fmt, {
+            "X-Classes": response_format.class_header(class_names),
+            "X-Predicted-Class": result["predicted_class"]
+        }
+    return response_format.encode(fmt, result), fmt, {}
+
+# Contenu des routes d'information (partagé avec la variante ASGI api.app_async)
+def root_payload():
+    return {
         "message": "🌾 Rice Classification API",
         "version": "1.0.0",
         "status": "running",
         "model_loaded": model is not None,
         "endpoints": {
             "health": "/health",
+            "live": "/health/live",
+            "ready": "/health/ready",
             "predict": "/predict",
+            "predict_batch": "/predict/batch",
+            "predict_grains": "/predict/grains",
             "classes": "/classes",
-            "info": "/info"
+            "info": "/info",
+            "similar": "/similar",
+            "stats": "/stats",
+            "experiment": "/experiment",
+            "metrics": "/metrics"
         }
-    })
+    }
 
-@app.route("/health", methods=["GET"])
-def health():
-    """Healthcheck pour Docker"""
-    if model is None:
-        return jsonify({
+def health_payload():
+    # Non prêt tant que le préchauffage de l'inférence n'est pas terminé
+    if model is None or not model.warmed_up:
+        return {
             "status": "unhealthy",
-            "model_loaded": False,
+            "model_loaded": model is not None,
+            "warmed_up": False,
+            "startup": startup.describe(),
             "timestamp": datetime.now().isoformat()
-        }), 503
+        }, 503
     
-    return jsonify({
+    return {
         "status": "healthy",
         "model_loaded": True,
+        "warmed_up": True,
+        "warmup_seconds": round(model.warmup_seconds, 3),
         "available_classes": list(class_names.values()) if class_names else [],
+        "startup": startup.describe(),
         "timestamp": datetime.now().isoformat()
-    })
+    }, 200
 
-@app.route("/classes", methods=["GET"])
-def get_classes():
-    """Retourne la liste des classes disponibles"""
+def live_payload():
+    # Vivacité : le processus répond, que le modèle soit chargé ou non
+    return {
+        "status": "alive",
+        "startup": startup.state,
+        "timestamp": datetime.now().isoformat()
+    }, 200
+
+def classes_payload():
     if class_names is None:
-        return jsonify({"error": "Classes non chargées"}), 503
+        return {"error": "Classes non chargées"}, 503
     
-    return jsonify({
+    return {
         "classes": list(class_names.values()),
         "num_classes": len(class_names)
-    })
+    }, 200
 
-@app.route("/info", methods=["GET"])
-def get_info():
-    """Informations sur le modele"""
+def info_payload():
     if model is None:
-        return jsonify({"error": "Modèle non chargé"}), 503
+        return {"error": "Modèle non chargé"}, 503
     
-    return jsonify({
+    return {
         "model_type": "CNN Transfer Learning",
         "input_shape": [224, 224, 3],
         "num_classes": len(class_names) if class_names else 0,
         "classes": list(class_names.values()) if class_names else [],
-        "framework": "TensorFlow/Keras"
+        "framework": "TensorFlow/Keras",
+        "backend": model.describe(),
+        "model_version": model_version,
+        "load_seconds": round(model.load_seconds, 3) if getattr(model, "load_seconds", None) else None,
+        "warmup_seconds": round(model.warmup_seconds, 3) if model.warmup_seconds else None,
+        "registry": model_watcher.status() if model_watcher is not None else None,
+        "startup": startup.describe(),
+        "cascade": shape_cascade.describe() if shape_cascade is not None else None,
+        "similarity_index": similarity_search.index.describe() if similarity_search is not None else None
+    }, 200
+
+def experiment_payload():
+    if experiment is None:
+        return {"enabled": False}, 200
+    return {
+        "enabled": True,
+        "primary": {"version": model_version, "backend": model.describe() if model is not None else None},
+        **experiment.describe(),
+        "stats": experiment.stats.snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }, 200
+
+def similar_k(value, default=None):
+    """Paramètre k borné à [1, SIMILARITY_MAX_K] ; None si absent ou invalide"""
+    try:
+        k = int(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+    return None if k is None else max(1, min(k, SIMILARITY_MAX_K))
+
+def similar_neighbors(embedding, k):
+    """k grains de référence les plus proches d'un embedding"""
+    start = time.perf_counter()
+    neighbors = similarity_search.neighbors(embedding, k)
+    STAGE_LATENCY.observe(time.perf_counter() - start, stage="similar")
+    return neighbors
+
+def similar_payload(img_bytes, k, image=None):
+    """Voisins les plus proches d'une image parmi les grains de référence
+
+    `image` : image déjà décodée (cascade), pour ne pas décoder deux fois
+    """
+    if similarity_search is None:
+        return {"error": "Index de similarité non construit (python -m api.similarity build)"}, 503
+    if model is None:
+        return {"error": "Modèle non chargé"}, 503
+    embedding = embed_batch(preprocess_image(img_bytes, image=image))[0]
+    return {"k": k, "neighbors": similar_neighbors(embedding, k)}, 200
+
+# Routes API
+@app.route("/", methods=["GET"])
+def root():
+    """Route racine - Informations sur l'API"""
+    return jsonify(root_payload())
+
+@app.route("/health", methods=["GET"])
+@app.route("/health/ready", methods=["GET"])
+def health():
+    """Sonde de disponibilité : 200 seulement quand l'inférence est prête"""
+    payload, status = health_payload()
+    return jsonify(payload), status
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    """Sonde de vivacité (healthcheck Docker) : répond dès le démarrage du worker"""
+    payload, status = live_payload()
+    return jsonify(payload), status
+
+@app.route("/classes", methods=["GET"])
+def get_classes():
+    """Retourne la liste des classes disponibles"""
+    payload, status = classes_payload()
+    return jsonify(payload), status
+
+@app.route("/info", methods=["GET"])
+def get_info():
+    """Informations sur le modele"""
+    payload, status = info_payload()
+    return jsonify(payload), status
+
+def queue_stats():
+    """File d'inférence de ce worker (pour l'autoscaling : profondeur et attente estimée)"""
+    return {
+        "depth": batcher.queue_depth(),
+        "max_depth": INFERENCE_MAX_QUEUE or None,
+        "estimated_wait_ms": round(batcher.estimated_wait() * 1000.0, 3),
+        "deadline_ms": REQUEST_DEADLINE_MS or None,
+        "rejected": {reason: REJECTED.value(reason=reason) for reason in ("queue_full", "deadline", "expired")}
+    }
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """Statistiques de fonctionnement (cache des prédictions, file d'inférence)"""
+    return jsonify({
+        "cache": prediction_cache.stats() if prediction_cache is not None else {"enabled": False},
+        "queue": queue_stats(),
+        "timestamp": datetime.now().isoformat()
     })
 
+@app.route("/experiment", methods=["GET"])
+def get_experiment():
+    """Comparaison modèle principal / candidat (accord, divergence, latences)"""
+    payload, status = experiment_payload()
+    return jsonify(payload), status
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Métriques au format texte Prometheus"""
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
 @app.route("/predict", methods=["POST"])
 def predict():
     """Route de prédiction"""
@@ -154,47 +887,390 @@ def predict():
     # Vérifier que le fichier n'est pas vide
     if file.filename == '':
         return jsonify({"error": "Nom de fichier vide"}), 400
+
+    # ?top_k=, ?include_probs=0, en-tête Accept (json, msgpack, float32)
+    options, error = prediction_options(request.values, request.headers.get("Accept"))
+    if error is not None:
+        return jsonify(error[0]), error[1]
     
+    record = False
     try:
         logger.info(f"Réception d'une image: {file.filename}")
         
-        # Lire et prétraiter l'image
-        img_bytes = file.read()
-        img_array = preprocess_image(img_bytes)
+        # Lire l'image (taille, signature et dimensions vérifiées avant décodage)
+        start = time.perf_counter()
+        img_bytes = read_upload(file.stream)
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage="read")
 
-        # Prédiction
-        logger.info("Prédiction en cours...")
-        predictions = model.predict(img_array, verbose=0)[0]
-        
-        # 1. Préparer toutes les probabilités pour le graphique
-        all_probs = {
-            class_names[i]: float(predictions[i]) 
-            for i in range(len(class_names))
-        }
-        
-        # 2. Trier pour obtenir le Top 3
-        sorted_probs = sorted(all_probs.items(), key=lambda x: x[1], reverse=True)
-        
-        # 3. Formatage final
-        result = {
-            "predicted_class": sorted_probs[0][0],
-            "confidence": float(sorted_probs[0][1]),
-            "top_3_predictions": [
-                {"class": name, "confidence": float(conf)} 
-                for name, conf in sorted_probs[:3]
-            ],
-            "all_probabilities": all_probs
-        }
+        record = traffic_recorder is not None and traffic_recorder.sampled()
+        digest = content_hash(img_bytes) if prediction_cache is not None or record else None
+
+        # /predict?similar=k : ajoute les k grains de référence les plus proches
+        k = similar_k(request.args.get("similar"))
+        if k is not None and similarity_search is None:
+            return jsonify(similar_payload(img_bytes, k)[0]), 503
+
+        # Image déjà vue : ni décodage, ni prétraitement, ni inférence
+        cached = prediction_cache.get(digest) if prediction_cache is not None else None
+        if cached is not None:
+            result = format_prediction(cached, options["top_k"], options["include_probs"])
+            if k is not None:
+                result["similar"] = similar_payload(img_bytes, k)[0]["neighbors"]
+            PREDICTIONS.inc(class_name=result['predicted_class'])
+            logger.info(f"✅ Prédiction (cache): {result['predicted_class']} ({result['confidence']:.2%})")
+            if record:
+                _record_traffic(img_bytes, digest, file.filename, 200, result)
+            return _prediction_response(options["format"], result, cached)
+
+        timings = {}
+        predictions = None
+        embedding = None
+        decoded = None
+        if shape_cascade is not None:
+            predictions, decoded = cascade_stage(img_bytes, timings)
+
+        served_by_candidate = False
+        if predictions is None:
+            # Surcharge : refus avant le prétraitement si l'échéance ne peut pas être tenue
+            deadline = request_deadline(request.headers.get(DEADLINE_HEADER), g.get("request_start"))
+            check_admission(deadline)
+
+            start = time.perf_counter()
+            img_array = preprocess_image(img_bytes, timings=timings, image=decoded)
+            STAGE_LATENCY.observe(time.perf_counter() - start, stage="preprocess")
+
+            # Prédiction (modèle principal, ou candidat pour une fraction du trafic en A/B)
+            logger.info("Prédiction en cours...")
+            served_by_candidate = experiment is not None and experiment.route()
+            shadow_input = experiment.shadow_input(img_array) if experiment is not None else None
+            start = time.perf_counter()
+            if served_by_candidate:
+                try:
+                    predictions = experiment.predict(img_array)[0]
+                    if k is not None:
+                        embedding = embed_batch(img_array)[0]
+                finally:
+                    # Le candidat a son propre backend : le tampon du modèle principal
+                    # (case de l'anneau en mode inference-server) n'est rendu par personne
+                    model.release_buffer(img_array)
+            else:
+                try:
+                    if k is not None and model.embedding:
+                        # Softmax et embedding sortent de la même passe du backend actif
+                        probs, embeddings = predict_with_embedding_sync(img_array, deadline=deadline, admit=True)
+                        predictions, embedding = probs[0], embeddings[0]
+                    else:
+                        if k is not None:
+                            # Backend sans embedding : sous-modèle Keras, avant que le
+                            # tampon ne soit rendu par l'inférence
+                            embedding = similarity_search.embed(img_array)[0]
+                        predictions = predict_batch_sync(img_array, deadline=deadline, admit=True)[0]
+                except Rejected:
+                    # Lot jamais parti vers le modèle : rendre son tampon
+                    model.release_buffer(img_array)
+                    raise
+            elapsed = time.perf_counter() - start
+            STAGE_LATENCY.observe(elapsed, stage="inference")
+            timings["inference"] = elapsed * 1000.0
+            if experiment is not None and not served_by_candidate:
+                experiment.observe_primary(elapsed)
+            if shadow_input is not None:
+                # Le candidat tourne dans son propre thread : la réponse ne l'attend pas
+                experiment.shadow(shadow_input, predictions[np.newaxis])
+        # Le cache ne garde que les réponses du modèle principal
+        if prediction_cache is not None and not served_by_candidate:
+            prediction_cache.put(digest, predictions)
+
+        neighbors = None
+        if k is not None:
+            if embedding is None:
+                # Réponse de la cascade : l'image décodée sert aussi à l'embedding
+                embedding = embed_batch(preprocess_image(img_bytes, image=decoded))[0]
+            neighbors = similar_neighbors(embedding, k)
+
+        start = time.perf_counter()
+        result = format_prediction(predictions, options["top_k"], options["include_probs"])
+        if neighbors is not None:
+            result["similar"] = neighbors
+        response = _prediction_response(options["format"], result, predictions)
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage="serialize")
+        PREDICTIONS.inc(class_name=result['predicted_class'])
+        logger.info(f"⏱️ {preprocessing.format_timings(timings)}")
         
         logger.info(f"✅ Prédiction: {result['predicted_class']} ({result['confidence']:.2%})")
+        if record:
+            _record_traffic(img_bytes, digest, file.filename, 200, result)
         
-        return jsonify(result)
+        return response
+
+    except UploadRejected as e:
+        payload, status = upload_rejected_payload(e)
+        return jsonify(payload), status
+
+    except Rejected as e:
+        payload, status, headers = rejected_payload(e)
+        if record:
+            _record_traffic(img_bytes, digest, file.filename, status)
+        return jsonify(payload), status, headers
 
     except Exception as e:
         logger.error(f"❌ Erreur lors de la prédiction: {str(e)}")
+        if record:
+            _record_traffic(img_bytes, digest, file.filename, 500)
         return jsonify({"error": f"Erreur lors de la prédiction: {str(e)}"}), 500
 
+def _prediction_response(fmt, result, predictions):
+    if fmt == response_format.JSON:
+        return jsonify(result)
+    body, mimetype, headers = encoded_prediction(fmt, result, predictions)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def grains_payload(img_bytes, background="auto"):
+    """Segmente les grains d'une photo et les classe en un seul appel au modèle"""
+    # Import au premier appel : scipy n'est chargé que si /predict/grains sert
+    from api import segmentation
+
+    timings = {}
+    seg = segmentation.segment(
+        img_bytes, max_side=GRAINS_SEGMENT_MAX_SIDE, background=background, timings=timings
+    )
+    STAGE_LATENCY.observe(timings["segment"] / 1000.0, stage="segment")
+    if len(seg) > GRAINS_MAX:
+        return {"error": f"Trop de grains détectés ({len(seg)} > {GRAINS_MAX})"}, 422
+
+    grains = seg.grains
+    predictions = []
+    if grains:
+        start = time.perf_counter()
+        buffer = model.input_buffer(len(grains))
+        try:
+            for grain, out in zip(grains, buffer):
+                seg.crop_into(grain, out)
+        except Exception:
+            model.release_buffer(buffer)
+            raise
+        timings["crop"] = (time.perf_counter() - start) * 1000.0
+
+        # Toute la photo en une requête : le backend découpe selon ses buckets
+        start = time.perf_counter()
+        predictions = predict_batch_sync(buffer)
+        timings["inference"] = (time.perf_counter() - start) * 1000.0
+        STAGE_LATENCY.observe(timings["inference"] / 1000.0, stage="inference")
+
+    results = []
+    for index, (grain, probs) in enumerate(zip(grains, predictions)):
+        best = int(np.argmax(probs))
+        PREDICTIONS.inc(class_name=class_names[best])
+        results.append({
+            "index": index,
+            "box": grain.box,
+            "area": grain.area,
+            "predicted_class": class_names[best],
+            "confidence": float(probs[best]),
+            "possibly_merged": grain.possibly_merged
+        })
+
+    summary = segmentation.composition(
+        [r["predicted_class"] for r in results], list(class_names.values())
+    )
+    counts = summary["counts"]
+    return {
+        "num_grains": len(results),
+        "image_size": list(seg.image.size),
+        "dominant_class": max(counts, key=counts.get) if results else None,
+        "composition": summary,
+        "grains": results,
+        "timings_ms": {name: round(value, 2) for name, value in timings.items()}
+    }, 200
+
+@app.route("/predict/grains", methods=["POST"])
+def predict_grains():
+    """Photo de plateau : un résultat par grain et la composition du lot"""
+    if model is None:
+        return jsonify({"error": "Modèle non chargé"}), 503
+    if 'file' not in request.files:
+        return jsonify({"error": "Aucun fichier envoyé"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "Nom de fichier vide"}), 400
+
+    background = request.values.get("background", "auto")
+    if background not in ("auto", "dark", "light"):
+        return jsonify({"error": "background doit valoir auto, dark ou light"}), 400
+
+    try:
+        logger.info(f"Réception d'une photo multi-grains: {file.filename}")
+        payload, status = grains_payload(read_upload(file.stream), background)
+        if status == 200:
+            logger.info(f"✅ {payload['num_grains']} grains classés ({payload['dominant_class']})")
+        return jsonify(payload), status
+    except UploadRejected as e:
+        payload, status = upload_rejected_payload(e)
+        return jsonify(payload), status
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'analyse multi-grains: {str(e)}")
+        return jsonify({"error": f"Erreur lors de l'analyse multi-grains: {str(e)}"}), 500
+
+@app.route("/similar", methods=["POST"])
+def similar():
+    """Grains de référence les plus proches de l'image envoyée"""
+    if 'file' not in request.files:
+        return jsonify({"error": "Aucun fichier envoyé"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "Nom de fichier vide"}), 400
+
+    try:
+        payload, status = similar_payload(read_upload(file.stream), similar_k(request.values.get("k"), SIMILARITY_K))
+        return jsonify(payload), status
+    except UploadRejected as e:
+        payload, status = upload_rejected_payload(e)
+        return jsonify(payload), status
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la recherche de similarité: {str(e)}")
+        return jsonify({"error": f"Erreur lors de la recherche de similarité: {str(e)}"}), 500
+
+def _record_traffic(img_bytes, digest, filename, status, result=None, started=None):
+    """Ajoute la requête au journal de trafic (écriture en arrière-plan)
+
+    started : réception de la requête (perf_counter), à passer hors contexte Flask (app_async)
+    """
+    if started is None and has_app_context():
+        started = g.get("request_start")
+    latency_ms = (time.perf_counter() - started) * 1000.0 if started is not None else None
+    traffic_recorder.record(
+        digest, img_bytes,
+        filename=filename,
+        status=status,
+        latency_ms=latency_ms,
+        predicted_class=result["predicted_class"] if result else None
+    )
+
+def _ndjson(payload):
+    return json.dumps(payload, ensure_ascii=False) + "\n"
+
+def decode_chunk(chunk, buffer, guard=None):
+    """Vérifie et décode les images d'un lot dans `buffer` -> (valides, erreurs)
+
+    Sans métrique ni état global : exécutable dans un pool de processus, les
+    refus du garde-fou sont comptés par l'appelant (count_upload_rejections).
+    """
+    valid, errors = [], []
+    for index, (filename, img_bytes) in chunk:
+        try:
+            if guard is not None:
+                guard.check(img_bytes)
+            preprocessing.preprocess_into(img_bytes, buffer[len(valid)])
+            valid.append((index, filename))
+        except UploadRejected as e:
+            errors.append({"index": index, "filename": filename, "error": str(e),
+                           "reason": e.reason, "status": e.status})
+        except Exception as e:
+            errors.append({"index": index, "filename": filename, "error": f"Image illisible: {str(e)}"})
+    return valid, errors
+
+def count_upload_rejections(errors):
+    for error in errors:
+        if "reason" in error:
+            UPLOAD_REJECTED.inc(reason=error["reason"])
+
+def _preprocess_chunk(chunk):
+    """Prétraite un lot d'images dans un tampon préalloué, en isolant celles qui sont illisibles"""
+    buffer = model.input_buffer(len(chunk))
+    valid, errors = decode_chunk(chunk, buffer, upload_guard)
+    count_upload_rejections(errors)
+    if not valid:
+        model.release_buffer(buffer)
+    return valid, buffer[:len(valid)], errors
+
+BATCH_DEFAULTS = {
+    "top_k": None, "include_probs": True, "format": response_format.JSON
+}
+
+def _batch_record(options, payload, probs=None):
+    """Un enregistrement du flux /predict/batch dans le format négocié"""
+    fmt = options["format"]
+    if fmt == response_format.FLOAT32:
+        # Erreur globale du lot (sans index) : -1 ; image en erreur : probabilités NaN
+        return response_format.float32_record(payload.get("index", -1), probs, len(class_names))
+    if fmt == response_format.MSGPACK:
+        return response_format.encode(fmt, payload)
+    return _ndjson(payload)
+
+def batch_media_type(options):
+    """(type, en-têtes) de la réponse /predict/batch"""
+    fmt = options["format"]
+    if fmt == response_format.JSON:
+        return "application/x-ndjson", {}
+    if fmt == response_format.FLOAT32:
+        return fmt, {"X-Classes": response_format.class_header(class_names)}
+    return fmt, {}
+
+def _emit_results(valid, future, options=BATCH_DEFAULTS):
+    """Produit un enregistrement par image d'un lot termine"""
+    try:
+        predictions = future.result()
+    except Exception as e:
+        for index, filename in valid:
+            yield _batch_record(options, {"index": index, "filename": filename, "error": f"Erreur lors de la prédiction: {str(e)}"})
+        return
+    for (index, filename), probs in zip(valid, predictions):
+        result = format_prediction(probs, options["top_k"], options["include_probs"])
+        PREDICTIONS.inc(class_name=result["predicted_class"])
+        yield _batch_record(options, {"index": index, "filename": filename, **result}, probs)
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Prédiction multi-images : plusieurs fichiers ou une archive tar/zip.
+
+    Les images sont envoyées au modèle par lots et la réponse est diffusée
+    au fil de l'eau, une ligne JSON par image (application/x-ndjson), ou un
+    enregistrement MessagePack / float32 selon l'en-tête Accept.
+    """
+    if model is None:
+        return jsonify({"error": "Modèle non chargé"}), 503
+    
+    files = [f for key in request.files for f in request.files.getlist(key)]
+    if not files:
+        return jsonify({"error": "Aucun fichier envoyé"}), 400
+
+    options, error = prediction_options(request.values, request.headers.get("Accept"))
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    
+    logger.info(f"Réception d'un lot de {len(files)} fichier(s)")
+    
+    def generate():
+        pending = deque()
+        try:
+            images = enumerate(iter_uploaded_images(files, max_bytes=UPLOAD_MAX_BYTES))
+            for chunk in chunked(images, BATCH_MAX_SIZE):
+                valid, batch, errors = _preprocess_chunk(chunk)
+                for error in errors:
+                    yield _batch_record(options, error)
+                if valid:
+                    # Le lot part en inference pendant qu'on décode le suivant
+                    pending.append((valid, submit_batch(batch)))
+                while pending and pending[0][1].done():
+                    yield from _emit_results(*pending.popleft(), options)
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de la lecture du lot: {str(e)}")
+            yield _batch_record(options, {"error": f"Erreur lors de la lecture du lot: {str(e)}"})
+        while pending:
+            yield from _emit_results(*pending.popleft(), options)
+    
+    mimetype, headers = batch_media_type(options)
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
 # Gestion des erreurs
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    # Corps au-delà de MAX_CONTENT_LENGTH : refusé sans être lu en entier
+    payload, status = upload_rejected_payload(UploadRejected(
+        f"Requête trop volumineuse (> {REQUEST_MAX_BYTES // (1024 * 1024)} Mo)", 413, "request_too_large"
+    ))
+    return jsonify(payload), status
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({"error": "Route non trouvée"}), 404
@@ -0,0 +1,425 @@
+"""Backends d'inference interchangeables : Keras, TFLite ou ONNX Runtime
+
+Le backend est choisi par configuration (MODEL_BACKEND) ou deduit de
+l'extension du fichier modele. Seul le backend Keras importe TensorFlow :
+un artefact .tflite ou .onnx se charge sans lui, ce qui reduit la memoire
+par worker et le temps de demarrage.
+"""
+import hashlib
+import logging
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+
+from api.preprocessing import SCALE
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("keras", "tflite", "onnx", "remote")
+DEFAULT_BUCKETS = (1, 4, 8, 16, 32)
+
+_EXTENSIONS = {
+    ".keras": "keras",
+    ".h5": "keras",
+    ".tflite": "tflite",
+    ".onnx": "onnx",
+}
+
+
+def parse_buckets(value, default=DEFAULT_BUCKETS):
+    """'1,8,32' -> (1, 8, 32)"""
+    if not value:
+        return tuple(default)
+    return tuple(sorted({int(v) for v in value.split(",") if v.strip()}))
+
+
+def detect_backend(path):
+    """Deduit le backend de l'extension du fichier modele"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def normalize_buckets(bucket_sizes):
+    """Tailles de lot positives, uniques et triees"""
+    return tuple(sorted({int(b) for b in bucket_sizes if int(b) > 0}))
+
+
+def bucket_for(bucket_sizes, n):
+    """Plus petit bucket pouvant contenir n images (le plus grand sinon)"""
+    for size in bucket_sizes:
+        if size >= n:
+            return size
+    return bucket_sizes[-1]
+
+
+def _pad_to(batch, size):
+    """Complete un lot par des zeros jusqu'a `size` images"""
+    if len(batch) == size:
+        return batch
+    padded = np.zeros((size,) + batch.shape[1:], dtype=batch.dtype)
+    padded[:len(batch)] = batch
+    return padded
+
+
+def predict_in_buckets(batch, bucket_sizes, predict_padded):
+    """Appelle predict_padded sur des lots de taille fixe (buckets)
+
+    Un lot plus grand que le plus grand bucket est decoupe ; chaque morceau
+    est complete par des zeros jusqu'au bucket superieur, puis la sortie
+    est retronquee.
+    """
+    largest = bucket_sizes[-1]
+    if len(batch) > largest:
+        return np.concatenate(
+            [predict_in_buckets(batch[i:i + largest], bucket_sizes, predict_padded)
+             for i in range(0, len(batch), largest)],
+            axis=0
+        )
+    size = bucket_for(bucket_sizes, len(batch))
+    return predict_padded(_pad_to(batch, size))[:len(batch)]
+
+
+class InferenceBackend:
+    """Interface commune : predict(lot float32 (n, H, W, C)) -> softmax (n, classes)"""
+
+    name = None
+
+    # Faux si le runtime ne survit pas a un fork une fois initialise
+    # (pools de threads TensorFlow) : voir prepare_fork() / after_fork()
+    fork_safe = True
+
+    # Vrai si le modele prend directement des pixels uint8 (normalisation
+    # integree) : le pretraitement peut alors sauter la conversion float32
+    accepts_uint8 = False
+
+    def __init__(self, path, bucket_sizes=DEFAULT_BUCKETS):
+        self.path = path
+        self.bucket_sizes = normalize_buckets(bucket_sizes)
+        self.input_shape = (224, 224, 3)
+        self.warmed_up = False
+        self.warmup_seconds = None
+
+    @property
+    def input_dtype(self):
+        return np.uint8 if self.accepts_uint8 else np.float32
+
+    # Vrai si le backend regroupe lui-meme les requetes (processus dedie) :
+    # le micro-batching local est alors inutile
+    batches_remotely = False
+
+    # Vrai si predict_with_embedding() est disponible : softmax et embedding
+    # (avant-derniere couche, voir api.similarity) en une seule passe
+    embedding = False
+
+    def input_buffer(self, n):
+        """Tampon (n, H, W, C) ou ecrire les images pretraitees"""
+        return np.empty((n,) + self.input_shape, dtype=self.input_dtype)
+
+    def release_buffer(self, buffer):
+        """Rend un tampon obtenu par input_buffer() (erreur avant predict)"""
+
+    def _as_input(self, batch):
+        """Lot uint8 ou float -> type attendu par le backend"""
+        batch = np.asarray(batch)
+        if batch.dtype == np.uint8:
+            if self.accepts_uint8:
+                return batch
+            return np.multiply(batch, SCALE, dtype=np.float32)
+        return batch.astype(np.float32, copy=False)
+
+    def bucket_for(self, n):
+        """Plus petit bucket pouvant contenir n images"""
+        return bucket_for(self.bucket_sizes, n)
+
+    def predict(self, batch):
+        return predict_in_buckets(self._as_input(batch), self.bucket_sizes, self._predict_padded)
+
+    def _predict_padded(self, batch):
+        raise NotImplementedError
+
+    def predict_with_embedding(self, batch):
+        """Lot -> (n, classes + d) : softmax suivie de l'embedding de chaque image"""
+        raise NotImplementedError(f"Backend {self.name} sans sortie d'embedding")
+
+    def warmup(self):
+        """Execute chaque taille de lot une fois avant les vraies requetes"""
+        start = time.perf_counter()
+        for size in self.bucket_sizes:
+            self.predict(np.zeros((size,) + self.input_shape, dtype=self.input_dtype))
+        self.warmup_seconds = time.perf_counter() - start
+        self.warmed_up = True
+        logger.info(
+            f"Backend {self.name} prechauffe (buckets {list(self.bucket_sizes)}) "
+            f"en {self.warmup_seconds:.2f}s"
+        )
+        return self.warmup_seconds
+
+    def prepare_fork(self):
+        """Libere les ressources non fork-safe avant le fork des workers"""
+
+    def after_fork(self):
+        """Recree les ressources dans le worker et rechauffe"""
+        self.warmup()
+
+    def describe(self):
+        return {
+            "backend": self.name,
+            "path": os.path.basename(self.path),
+            "input_shape": list(self.input_shape),
+            "buckets": list(self.bucket_sizes),
+        }
+
+
+class KerasBackend(InferenceBackend):
+    """Modele .keras via une fonction compilee (voir api.inference)"""
+
+    name = "keras"
+    fork_safe = False
+    embedding = True
+
+    def __init__(self, path, bucket_sizes=DEFAULT_BUCKETS, num_threads=None):
+        super().__init__(path, bucket_sizes)
+        import tensorflow as tf
+        from api.inference import CompiledPredictor
+
+        if num_threads:
+            # A regler avant la premiere operation TF, sinon RuntimeError
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError as e:
+                logger.warning(f"Pools de threads TF deja initialises: {e}")
+
+        self.model = tf.keras.models.load_model(path)
+        self._predictor = CompiledPredictor(self.model, bucket_sizes=self.bucket_sizes)
+        self.input_shape = self._predictor.input_shape
+        self._joint = None
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        return self._predictor.predict(self._as_input(batch))
+
+    def _joint_predictor(self):
+        """Sorties softmax et avant-derniere couche concatenees (cree au premier appel)"""
+        if self._joint is None:
+            with self._lock:
+                if self._joint is None:
+                    import tensorflow as tf
+                    from api.inference import CompiledPredictor
+                    from api.similarity import penultimate_output
+
+                    outputs = tf.keras.layers.Concatenate()(
+                        [self.model.output, penultimate_output(self.model)]
+                    )
+                    joint = tf.keras.Model(self.model.input, outputs)
+                    predictor = CompiledPredictor(joint, bucket_sizes=self.bucket_sizes)
+                    predictor.warmup()
+                    self._joint = predictor
+        return self._joint
+
+    def predict_with_embedding(self, batch):
+        return self._joint_predictor().predict(self._as_input(batch))
+
+    def warmup(self):
+        self.warmup_seconds = self._predictor.warmup()
+        self.warmed_up = True
+        return self.warmup_seconds
+
+
+def _tflite_interpreter_class():
+    """Interpreteur TFLite le plus leger disponible"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def _quantize(batch, details):
+    """float32 -> type d'entree du modele (uint8/int8 si quantifie)"""
+    dtype = details["dtype"]
+    if batch.dtype == dtype:
+        return batch
+    scale, zero_point = details["quantization"]
+    info = np.iinfo(dtype)
+    values = np.round(batch / scale + zero_point)
+    return np.clip(values, info.min, info.max).astype(dtype)
+
+
+def _dequantize(output, details):
+    if output.dtype == np.float32:
+        return output
+    scale, zero_point = details["quantization"]
+    return (output.astype(np.float32) - zero_point) * scale
+
+
+class TFLiteBackend(InferenceBackend):
+    """Artefact .tflite (float, float16 ou INT8)
+
+    Un interpreteur par taille de lot : on evite de reallouer les tenseurs
+    a chaque changement de taille. Les poids sont mmap depuis le fichier.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path, bucket_sizes=DEFAULT_BUCKETS, num_threads=None):
+        super().__init__(path, bucket_sizes)
+        self._interpreter_class = _tflite_interpreter_class()
+        self.num_threads = num_threads
+        self._interpreters = {}
+        self._lock = threading.Lock()
+
+        probe = self._interpreter_class(model_path=path)
+        self.input_shape = tuple(int(d) for d in probe.get_input_details()[0]["shape"][1:])
+        details = probe.get_input_details()[0]
+        self.quantized = details["dtype"] != np.float32
+
+        # Entree uint8 d'echelle 1/255 : les pixels bruts sont deja quantifies
+        scale, zero_point = details["quantization"]
+        self.accepts_uint8 = (
+            details["dtype"] == np.uint8
+            and zero_point == 0
+            and abs(scale - SCALE) < 1e-6
+        )
+
+    def _get_interpreter(self, size):
+        with self._lock:
+            entry = self._interpreters.get(size)
+            if entry is None:
+                interpreter = self._interpreter_class(
+                    model_path=self.path, num_threads=self.num_threads
+                )
+                index = interpreter.get_input_details()[0]["index"]
+                interpreter.resize_tensor_input(index, (size,) + self.input_shape)
+                interpreter.allocate_tensors()
+                entry = (interpreter, threading.Lock())
+                self._interpreters[size] = entry
+        return entry
+
+    def _predict_padded(self, batch):
+        interpreter, lock = self._get_interpreter(len(batch))
+        with lock:
+            input_details = interpreter.get_input_details()[0]
+            output_details = interpreter.get_output_details()[0]
+            interpreter.set_tensor(input_details["index"], _quantize(batch, input_details))
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_details["index"])
+        return _dequantize(output, output_details)
+
+    def prepare_fork(self):
+        # Les poids sont mmap depuis le fichier et restent partages ; seuls
+        # les interpreteurs (et leurs threads) sont recrees dans les workers
+        with self._lock:
+            self._interpreters.clear()
+        self.warmed_up = False
+
+
+class OnnxBackend(InferenceBackend):
+    """Artefact .onnx via ONNX Runtime (CPU)
+
+    Avec cache_dir, le graphe optimise par ONNX Runtime est ecrit sur disque
+    au premier chargement ; les demarrages suivants le relisent sans refaire
+    les optimisations. La cle depend du fichier source, de la version du
+    runtime et de la machine (le graphe optimise peut utiliser des noeuds
+    specifiques au CPU).
+    """
+
+    name = "onnx"
+
+    def __init__(self, path, bucket_sizes=DEFAULT_BUCKETS, num_threads=None, cache_dir=None):
+        super().__init__(path, bucket_sizes)
+        self.num_threads = num_threads
+        self.cache_dir = cache_dir
+        self.cache_hit = None
+        self._session = self._create_session()
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        dims = model_input.shape[1:]
+        if all(isinstance(d, int) for d in dims):
+            self.input_shape = tuple(dims)
+
+    def _cache_path(self, ort):
+        stat = os.stat(self.path)
+        key = f"{os.path.abspath(self.path)}|{stat.st_size}|{stat.st_mtime_ns}|{ort.__version__}|{platform.machine()}"
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        return os.path.join(self.cache_dir, f"{name}.{digest}.opt.onnx")
+
+    def _create_session(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+
+        path = self.path
+        tmp = None
+        if self.cache_dir:
+            cached = self._cache_path(ort)
+            self.cache_hit = os.path.exists(cached)
+            if self.cache_hit:
+                # Graphe deja optimise : pas de nouvelle passe d'optimisation
+                path = cached
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp = f"{cached}.{os.getpid()}.tmp"
+                options.optimized_model_filepath = tmp
+
+        session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        if tmp is not None and os.path.exists(tmp):
+            # Remplacement atomique : plusieurs workers peuvent remplir le cache en meme temps
+            os.replace(tmp, cached)
+            logger.info(f"Graphe ONNX optimise mis en cache: {cached}")
+        return session
+
+    def _predict_padded(self, batch):
+        return self._session.run(None, {self._input_name: batch})[0]
+
+    def prepare_fork(self):
+        # Le pool de threads de la session ne survit pas au fork
+        self._session = None
+        self.warmed_up = False
+
+    def after_fork(self):
+        self._session = self._create_session()
+        self.warmup()
+
+    def describe(self):
+        info = super().describe()
+        if self.cache_dir:
+            info["optimized_cache"] = "hit" if self.cache_hit else "miss"
+        return info
+
+
+def load_backend(path, kind=None, bucket_sizes=DEFAULT_BUCKETS, num_threads=None, cache_dir=None):
+    """Charge le modele avec le backend demande ('auto' = selon l'extension)
+
+    cache_dir : cache disque du modele optimise (backend onnx seulement)
+    """
+    if not kind or kind == "auto":
+        kind = detect_backend(path)
+    if kind not in BACKENDS:
+        raise ValueError(f"Backend inconnu pour {path}: {kind} (attendu: {', '.join(BACKENDS)})")
+
+    start = time.perf_counter()
+    if kind == "keras":
+        backend = KerasBackend(path, bucket_sizes=bucket_sizes, num_threads=num_threads)
+    elif kind == "tflite":
+        backend = TFLiteBackend(path, bucket_sizes=bucket_sizes, num_threads=num_threads)
+    elif kind == "onnx":
+        backend = OnnxBackend(path, bucket_sizes=bucket_sizes, num_threads=num_threads, cache_dir=cache_dir)
+    else:
+        # path = socket Unix du processus d'inference dedie
+        from api.inference_server import RemoteBackend
+        backend = RemoteBackend(path, bucket_sizes=bucket_sizes)
+    backend.load_seconds = time.perf_counter() - start
+    logger.info(f"Backend {kind} charge en {backend.load_seconds:.2f}s")
+    return backend
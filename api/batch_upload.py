@@ -0,0 +1,72 @@
+"""Lecture des envois multi-images (plusieurs fichiers ou archive tar/zip)"""
+import os
+import tarfile
+import zipfile
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+def is_image_name(name):
+    """Vrai pour un fichier image (hors fichiers caches et metadonnees macOS)"""
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX" in name:
+        return False
+    return base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_archive_name(name):
+    return (name or "").lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _read(stream, max_bytes=None):
+    """Lit un flux ; avec max_bytes, au plus max_bytes + 1 octets (depassement
+    detectable sans tout decompresser, voir api.upload_guard)"""
+    return stream.read(max_bytes + 1) if max_bytes else stream.read()
+
+
+def iter_archive(filename, stream, max_bytes=None):
+    """Parcourt les images d'une archive zip ou tar -> (nom, bytes)"""
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, _read(member, max_bytes)
+    else:
+        with tarfile.open(fileobj=stream, mode="r:*") as archive:
+            for member in archive:
+                if not member.isfile() or not is_image_name(member.name):
+                    continue
+                yield member.name, _read(archive.extractfile(member), max_bytes)
+
+
+def _file_stream(file):
+    """Flux binaire d'un fichier recu (FileStorage Flask ou UploadFile Starlette)"""
+    stream = getattr(file, "stream", None)
+    return stream if stream is not None else file.file
+
+
+def iter_uploaded_images(files, max_bytes=None):
+    """Parcourt les fichiers recus en depliant les archives"""
+    for file in files:
+        if not file.filename:
+            continue
+        stream = _file_stream(file)
+        if is_archive_name(file.filename):
+            yield from iter_archive(file.filename, stream, max_bytes)
+        else:
+            yield file.filename, _read(stream, max_bytes)
+
+
+def chunked(iterable, size):
+    """Decoupe un iterable en listes de `size` elements"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
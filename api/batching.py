@@ -0,0 +1,229 @@
+"""Micro-batching des requetes d'inference
+
+Les requetes concurrentes sont placees dans une file. Un thread unique
+les regroupe en lots (taille max ou attente max atteinte) et appelle le
+modele une seule fois par lot. Chaque appelant recupere sa propre tranche
+de la sortie softmax.
+
+Controle d'admission (submit(..., admit=True)) : la file est bornee
+(max_queue) et une requete avec une echeance est refusee tout de suite si
+l'attente estimee la depasse ; une requete dont l'echeance est passee au
+moment de former le lot est abandonnee sans inference. Sous surcharge,
+les requetes admises gardent une latence bornee au lieu de toutes expirer.
+"""
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """Requete refusee ou abandonnee avant inference (surcharge)
+
+    status : 429 (file pleine) ou 503 (echeance impossible / depassee)
+    retry_after : delai conseille au client, en secondes
+    """
+
+    def __init__(self, message, status=503, retry_after=1.0, reason="deadline"):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class _Request:
+    """Une requete en attente : images + future du resultat (+ echeance monotonic)"""
+
+    __slots__ = ("images", "future", "deadline")
+
+    def __init__(self, images, deadline=None):
+        self.images = images
+        self.future = Future()
+        self.deadline = deadline
+
+
+class MicroBatcher:
+    """Regroupe les requetes concurrentes pour un seul appel au modele"""
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, on_batch=None, max_queue=0):
+        self.predict_fn = predict_fn
+        # Rappel on_batch(nb_images, secondes) apres chaque lot (metriques)
+        self.on_batch = on_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        # Requetes en attente au-dela desquelles submit(admit=True) refuse (0 = illimite)
+        self.max_queue = max(0, int(max_queue))
+
+        # Duree moyenne d'un lot (moyenne glissante), pour estimer l'attente
+        self._batch_seconds = None
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._carry = None
+        self._buffer = None
+
+    def _ensure_started(self):
+        """Demarre la boucle d'inference (et la relance apres un fork)"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Processus fils : la file du parent n'est pas utilisable
+                self._queue = queue.Queue()
+                self._carry = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="micro-batcher", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, images, deadline=None, admit=False):
+        """Ajoute un tableau (n, H, W, C) a la file et retourne un Future
+
+        deadline : instant time.monotonic() au-dela duquel le resultat ne sert
+        plus. admit : applique le controle d'admission (peut lever Rejected).
+        """
+        if images.ndim == 3:
+            images = np.expand_dims(images, axis=0)
+        if admit:
+            self.check_admission(deadline)
+        self._ensure_started()
+        request = _Request(images, deadline)
+        self._queue.put(request)
+        return request.future
+
+    def queue_depth(self):
+        """Nombre de requetes en attente d'un lot"""
+        return self._queue.qsize() + (1 if self._carry is not None else 0)
+
+    def estimated_wait(self, depth=None):
+        """Attente estimee (s) d'une nouvelle requete : lots a passer avant elle"""
+        if self._batch_seconds is None:
+            return 0.0
+        depth = self.queue_depth() if depth is None else depth
+        return (depth // self.max_batch_size + 1) * self._batch_seconds
+
+    def check_admission(self, deadline=None):
+        """Leve Rejected si la file est pleine ou si l'echeance ne peut pas etre tenue"""
+        depth = self.queue_depth()
+        wait = self.estimated_wait(depth)
+        if self.max_queue and depth >= self.max_queue:
+            raise Rejected(
+                f"File d'inference pleine ({depth} requetes en attente)",
+                status=429, retry_after=wait, reason="queue_full"
+            )
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise Rejected(
+                f"Echeance impossible a tenir (attente estimee {wait * 1000:.0f} ms)",
+                status=503, retry_after=wait, reason="deadline"
+            )
+
+    def predict(self, images, timeout=None, deadline=None, admit=False):
+        """Version bloquante de submit()"""
+        return self.submit(images, deadline=deadline, admit=admit).result(timeout=timeout)
+
+    def _collect(self):
+        """Attend la premiere requete puis remplit le lot jusqu'a la limite"""
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = self._queue.get()
+
+        batch = [first]
+        size = len(first.images)
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if size + len(request.images) > self.max_batch_size:
+                # Trop gros pour ce lot : il ouvrira le suivant
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.images)
+
+        return batch
+
+    def _concatenate(self, batch):
+        """Copie les requetes du lot dans un tampon preallouee et reutilise"""
+        first = batch[0].images
+        size = sum(len(r.images) for r in batch)
+        buffer = self._buffer
+        if (
+            buffer is None
+            or buffer.dtype != first.dtype
+            or buffer.shape[1:] != first.shape[1:]
+            or len(buffer) < size
+        ):
+            buffer = np.empty(
+                (max(size, self.max_batch_size),) + first.shape[1:], dtype=first.dtype
+            )
+            self._buffer = buffer
+        return np.concatenate([r.images for r in batch], axis=0, out=buffer[:size])
+
+    def _drop_expired(self, batch):
+        """Retire du lot les requetes dont le client n'attend plus la reponse"""
+        now = time.monotonic()
+        live = []
+        for request in batch:
+            if request.deadline is not None and request.deadline <= now:
+                request.future.set_exception(Rejected(
+                    "Echeance depassee avant l'inference",
+                    status=503, retry_after=self.estimated_wait(), reason="expired"
+                ))
+            else:
+                live.append(request)
+        return live
+
+    def _run(self):
+        while True:
+            batch = self._drop_expired(self._collect())
+            if not batch:
+                continue
+            try:
+                if len(batch) == 1:
+                    inputs = batch[0].images
+                else:
+                    inputs = self._concatenate(batch)
+                start = time.perf_counter()
+                outputs = np.asarray(self.predict_fn(inputs))
+                elapsed = time.perf_counter() - start
+                self._batch_seconds = elapsed if self._batch_seconds is None else (
+                    0.8 * self._batch_seconds + 0.2 * elapsed
+                )
+                if self.on_batch is not None:
+                    self.on_batch(len(inputs), elapsed)
+            except Exception as e:
+                logger.error(f"Erreur lors de l'inference du lot: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            start = 0
+            for request in batch:
+                end = start + len(request.images)
+                request.future.set_result(outputs[start:end])
+                start = end
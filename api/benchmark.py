@@ -0,0 +1,185 @@
+"""Benchmark reproductible du chemin d'inference sur dataset/
+
+Mesure, sur les images de dataset/<classe>/ :
+- le debit de preprocess_image
+- la latence et le debit du modele pour des lots de 1/8/32/64 images
+- la latence de bout en bout de /predict (client de test Flask)
+
+Chaque mesure donne p50/p95/p99 et images/s. Le resultat est ecrit en JSON
+(par defaut app/data/benchmark.json, lu par l'onglet d'analyse de l'UI)
+pour pouvoir comparer deux versions.
+
+    python -m api.benchmark --per-class 20 --output app/data/benchmark.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+
+from api.dataset import BASE_DIR, DATASET_DIR, LABELS_PATH, MODEL_PATH, iter_labeled_images, load_class_indices
+from api.preprocessing import preprocess_image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = os.path.join(BASE_DIR, "app", "data", "benchmark.json")
+DEFAULT_BATCH_SIZES = (1, 8, 32, 64)
+
+
+def summarize(latencies, images_per_call=1):
+    """Percentiles (ms) et debit a partir de latences en secondes"""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    return {
+        "calls": int(len(latencies)),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
+        "mean_ms": round(float(latencies.mean()) * 1000, 3),
+        "images_per_second": round(len(latencies) * images_per_call / total, 2) if total else None,
+    }
+
+
+def load_samples(dataset_dir, per_class):
+    """(chemin, bytes) des images, lues une fois pour exclure le disque des mesures"""
+    samples = []
+    for path, _ in iter_labeled_images(dataset_dir, load_class_indices(LABELS_PATH), per_class):
+        with open(path, "rb") as f:
+            samples.append((path, f.read()))
+    return samples
+
+
+def bench_preprocess(samples, repeat=3):
+    latencies = []
+    for _ in range(repeat):
+        for _, content in samples:
+            start = time.perf_counter()
+            preprocess_image(content)
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def bench_inference(backend, images, batch_sizes, iterations):
+    results = {}
+    for batch_size in batch_sizes:
+        # Lot reel : on reprend les images du dataset en boucle
+        indices = np.arange(batch_size) % len(images)
+        batch = images[indices]
+        backend.predict(batch)
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            backend.predict(batch)
+            latencies.append(time.perf_counter() - start)
+        results[str(batch_size)] = summarize(latencies, images_per_call=batch_size)
+        logger.info(f"Lot {batch_size}: {results[str(batch_size)]}")
+    return results
+
+
+def bench_endpoint(samples, model_path, backend, repeat=1):
+    """Latence de bout en bout de /predict via le client de test Flask"""
+    # Sans cache : on mesure le vrai chemin decodage + inference
+    os.environ["CACHE_ENABLED"] = "0"
+    os.environ["MODEL_PATH"] = model_path
+    os.environ["MODEL_BACKEND"] = backend
+    # Chargement bloquant : sans modèle, /predict répondrait 503 en quelques µs
+    os.environ["BACKGROUND_LOAD"] = "0"
+    from api import app_prod
+
+    if not app_prod.startup.ready:
+        raise RuntimeError(f"Modele non charge pour /predict: {app_prod.startup.error}")
+
+    client = app_prod.app.test_client()
+    latencies, errors = [], 0
+    for _ in range(repeat):
+        for path, content in samples:
+            start = time.perf_counter()
+            response = client.post(
+                "/predict",
+                data={"file": (io.BytesIO(content), os.path.basename(path))},
+                content_type="multipart/form-data"
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+    summary = summarize(latencies)
+    summary["errors"] = errors
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark du chemin d'inference")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", MODEL_PATH))
+    parser.add_argument("--backend", default=os.environ.get("MODEL_BACKEND", "auto"))
+    parser.add_argument("--per-class", type=int, default=20, help="Images par classe (0 = toutes)")
+    parser.add_argument("--batch-sizes", default=",".join(map(str, DEFAULT_BATCH_SIZES)))
+    parser.add_argument("--iterations", type=int, default=20, help="Appels par taille de lot")
+    parser.add_argument("--skip-endpoint", action="store_true", help="Ne pas mesurer /predict")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    from api.backends import load_backend
+
+    batch_sizes = tuple(int(b) for b in args.batch_sizes.split(","))
+    samples = load_samples(args.dataset, args.per_class or None)
+    logger.info(f"{len(samples)} images chargees depuis {args.dataset}")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "num_images": len(samples),
+    }
+
+    report["preprocess"] = bench_preprocess(samples)
+    logger.info(f"Pretraitement: {report['preprocess']}")
+
+    backend = load_backend(args.model, kind=args.backend, bucket_sizes=batch_sizes)
+    backend.warmup()
+    report["model"] = {
+        **backend.describe(),
+        "load_seconds": round(backend.load_seconds, 3),
+        "warmup_seconds": round(backend.warmup_seconds, 3),
+    }
+    images = np.concatenate([preprocess_image(content, dtype=backend.input_dtype) for _, content in samples])
+    report["inference"] = bench_inference(backend, images, batch_sizes, args.iterations)
+
+    if not args.skip_endpoint:
+        endpoint = bench_endpoint(samples, args.model, args.backend)
+        logger.info(f"/predict: {endpoint}")
+        if endpoint["errors"]:
+            # Des reponses en erreur faussent les latences : mesure non publiee
+            logger.error(f"/predict: {endpoint['errors']} erreur(s), section endpoint ignoree")
+        else:
+            report["endpoint"] = endpoint
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"✅ Resultats ecrits dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Classification hors ligne d'une arborescence d'images (audits nocturnes)
+
+Reutilise le chargement du modele de l'API (load_backend, MODEL_BACKEND)
+et class_names.json. Les images sont decodees en parallele par un
+pipeline tf.data (map parallele + prefetch) pendant que le lot precedent
+passe dans le modele, par lots de taille fixe.
+
+Les predictions sont ecrites au fil de l'eau (CSV, JSONL ou Parquet) ;
+relancee avec la meme sortie, la commande reprend la ou elle s'etait
+arretee. Quand le dossier parent d'une image porte le nom d'une classe,
+il sert de verite terrain : matrice de confusion et precision par classe
+dans <sortie>.report.json.
+
+Exemples :
+    python -m api.bulk_classify dataset --output audits/riz.csv
+    python -m api.bulk_classify /data/lots --output audits/lots.parquet --batch-size 64
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from api.backends import BACKENDS, load_backend
+from api.batch_upload import chunked, is_image_name
+from api.dataset import DATASET_DIR, LABELS_PATH, MODEL_PATH, load_class_indices
+from api.export_model import per_class_accuracy
+from api.preprocessing import preprocess_into
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl", "parquet")
+PIPELINES = ("tfdata", "threads")
+
+
+def detect_format(output):
+    ext = os.path.splitext(output.rstrip("/"))[1].lower().lstrip(".")
+    return ext if ext in FORMATS else "csv"
+
+
+def iter_image_paths(root):
+    """Chemins relatifs des images sous root, dans un ordre stable"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if is_image_name(name):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def label_for(rel_path, class_indices):
+    """Nom du dossier parent s'il correspond a une classe, sinon None"""
+    parent = os.path.basename(os.path.dirname(rel_path))
+    return parent if parent in class_indices else None
+
+
+# ---------------------------------------------------------------------------
+# Pipelines de decodage : lots (chemins, pixels, ok)
+# ---------------------------------------------------------------------------
+
+def _load(root, rel_path, out):
+    """Decode une image dans `out` ; False si elle est illisible"""
+    try:
+        with open(os.path.join(root, rel_path), "rb") as f:
+            preprocess_into(f.read(), out)
+        return True
+    except Exception as e:
+        logger.warning(f"Image illisible {rel_path}: {e}")
+        out[...] = 0
+        return False
+
+
+def tfdata_batches(root, paths, batch_size, input_shape, dtype):
+    """Decodage parallele et prefetch via tf.data"""
+    import tensorflow as tf
+
+    def load(rel_path):
+        out = np.empty(input_shape, dtype=dtype)
+        ok = _load(root, rel_path.decode("utf-8"), out)
+        return out, np.bool_(ok)
+
+    def load_tf(rel_path):
+        pixels, ok = tf.numpy_function(load, [rel_path], [tf.as_dtype(dtype), tf.bool])
+        pixels.set_shape(input_shape)
+        ok.set_shape(())
+        return rel_path, pixels, ok
+
+    dataset = (
+        tf.data.Dataset.from_tensor_slices(tf.constant(paths, dtype=tf.string))
+        .map(load_tf, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+        .batch(batch_size)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+    for rel_paths, pixels, ok in dataset.as_numpy_iterator():
+        yield [p.decode("utf-8") for p in rel_paths], pixels, ok
+
+
+def thread_batches(root, paths, batch_size, input_shape, dtype, workers=None):
+    """Meme contrat sans TensorFlow (backends TFLite / ONNX seuls)"""
+    workers = workers or os.cpu_count() or 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = None
+        for chunk in chunked(paths, batch_size):
+            pixels = np.empty((len(chunk),) + input_shape, dtype=dtype)
+            futures = [executor.submit(_load, root, p, pixels[i]) for i, p in enumerate(chunk)]
+            # Le lot suivant se decode pendant que l'appelant traite celui-ci
+            if pending is not None:
+                yield pending[0], pending[1], np.array([f.result() for f in pending[2]])
+            pending = (chunk, pixels, futures)
+        if pending is not None:
+            yield pending[0], pending[1], np.array([f.result() for f in pending[2]])
+
+
+# ---------------------------------------------------------------------------
+# Sorties incrementales
+# ---------------------------------------------------------------------------
+
+def truncate_partial_line(path):
+    """Coupe le fichier apres sa derniere ligne complete (terminee par \\n)
+
+    Une interruption peut laisser une ligne tronquee en fin de fichier : sans
+    cela, l'ajout suivant s'y collerait. Renvoie le nombre d'octets retires.
+    """
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            step = min(end, 64 * 1024)
+            f.seek(end - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                end = end - step + newline + 1
+                break
+            end -= step
+        if end < size:
+            f.truncate(end)
+            logger.warning(f"Ligne tronquee retiree en fin de {path} ({size - end} octets)")
+        return size - end
+
+
+class CsvSink:
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+        truncate_partial_line(self.path)
+        with open(self.path, "r", newline="", encoding="utf-8") as f:
+            # Ligne incomplete ou en trop (None) : image a refaire
+            return [
+                row for row in csv.DictReader(f)
+                if None not in row and all(row.get(field) is not None for field in self.fields)
+            ]
+
+    def write(self, rows):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+class JsonlSink:
+    def __init__(self, path, fields):
+        self.path = path
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+        # Derniere ligne tronquee par une interruption : retiree, l'image est a refaire
+        truncate_partial_line(self.path)
+        rows = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Ligne illisible ignoree dans {self.path}")
+        return rows
+
+    def write(self, rows):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+class ParquetSink:
+    """Un fichier Parquet ne s'ouvre pas en ajout : la sortie est un dossier
+    de parts (part-00000.parquet, ...), lisible d'un bloc par pandas.read_parquet
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(n for n in os.listdir(self.path) if n.endswith(".parquet"))
+
+    def read(self):
+        import pandas as pd
+
+        rows = []
+        for name in self._parts():
+            rows.extend(pd.read_parquet(os.path.join(self.path, name)).to_dict("records"))
+        return rows
+
+    def write(self, rows):
+        import pandas as pd
+
+        os.makedirs(self.path, exist_ok=True)
+        part = os.path.join(self.path, f"part-{len(self._parts()):05d}.parquet")
+        tmp = part + ".tmp"
+        pd.DataFrame(rows, columns=self.fields).to_parquet(tmp, index=False)
+        os.replace(tmp, part)
+
+
+SINKS = {"csv": CsvSink, "jsonl": JsonlSink, "parquet": ParquetSink}
+
+
+# ---------------------------------------------------------------------------
+# Rapport
+# ---------------------------------------------------------------------------
+
+def build_report(rows, class_indices, images_per_second=None):
+    class_names = {v: k for k, v in class_indices.items()}
+    labeled = [r for r in rows if r.get("label") and r.get("predicted_class") in class_indices]
+    report = {
+        "num_images": len(rows),
+        "errors": sum(1 for r in rows if r.get("error")),
+        "images_per_second": images_per_second,
+        "predicted": {
+            name: sum(1 for r in rows if r.get("predicted_class") == name)
+            for name in class_names.values()
+        },
+    }
+    if not labeled:
+        return report
+
+    labels = np.array([class_indices[r["label"]] for r in labeled])
+    predicted = np.array([class_indices[r["predicted_class"]] for r in labeled])
+    num_classes = len(class_names)
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(confusion, (labels, predicted), 1)
+
+    report["num_labeled"] = len(labeled)
+    report["accuracy"] = float(np.mean(labels == predicted))
+    report["per_class"] = per_class_accuracy(labels, predicted, class_names)
+    report["confusion_matrix"] = {
+        "classes": [class_names[i] for i in range(num_classes)],
+        # lignes = verite terrain, colonnes = prediction
+        "counts": confusion.tolist(),
+    }
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['num_images']} images, {report['errors']} illisibles")
+    if report.get("images_per_second"):
+        print(f"Debit: {report['images_per_second']} images/s")
+    if "confusion_matrix" not in report:
+        return
+    classes = report["confusion_matrix"]["classes"]
+    width = max(10, max(len(c) for c in classes) + 2)
+    print(f"\nMatrice de confusion ({report['num_labeled']} images etiquetees, lignes = verite)")
+    print(" " * width + "".join(f"{c:>{width}}" for c in classes))
+    for name, counts in zip(classes, report["confusion_matrix"]["counts"]):
+        print(f"{name:<{width}}" + "".join(f"{n:>{width}}" for n in counts))
+    print(f"\n{'Classe':<{width}}{'Precision':>10}")
+    for name, accuracy in report["per_class"].items():
+        if accuracy is not None:
+            print(f"{name:<{width}}{accuracy:>10.2%}")
+    print(f"{'Global':<{width}}{report['accuracy']:>10.2%}")
+
+
+# ---------------------------------------------------------------------------
+# Classification
+# ---------------------------------------------------------------------------
+
+def classify(root, backend, class_indices, sink, batch_size=32, pipeline="tfdata",
+             flush_every=10, log_every=1000):
+    """Classe les images non encore presentes dans la sortie ; renvoie le rapport"""
+    class_names = {v: k for k, v in class_indices.items()}
+    done_rows = sink.read()
+    done = {row["path"] for row in done_rows}
+    paths = [p for p in iter_image_paths(root) if p not in done]
+    if done:
+        logger.info(f"Reprise : {len(done)} images deja classees, {len(paths)} restantes")
+    else:
+        logger.info(f"{len(paths)} images a classer sous {root}")
+
+    make_batches = tfdata_batches if pipeline == "tfdata" else thread_batches
+    batches = make_batches(root, paths, batch_size, backend.input_shape, backend.input_dtype)
+
+    new_rows = []
+    pending = []
+    processed = 0
+    next_log = log_every
+    start = time.perf_counter()
+    for index, (rel_paths, pixels, ok) in enumerate(batches, 1):
+        probs = backend.predict(pixels)
+        for rel_path, row_probs, readable in zip(rel_paths, probs, ok):
+            predicted = int(np.argmax(row_probs))
+            row = {
+                "path": rel_path,
+                "label": label_for(rel_path, class_indices) or "",
+                "predicted_class": class_names[predicted] if readable else "",
+                "confidence": round(float(row_probs[predicted]), 6) if readable else None,
+                "error": "" if readable else "illisible",
+            }
+            for i, name in class_names.items():
+                row[f"p_{name}"] = round(float(row_probs[i]), 6) if readable else None
+            pending.append(row)
+        processed += len(rel_paths)
+
+        if index % flush_every == 0:
+            sink.write(pending)
+            new_rows.extend(pending)
+            pending = []
+        if processed >= next_log:
+            rate = processed / (time.perf_counter() - start)
+            logger.info(f"{processed}/{len(paths)} images ({rate:.1f} images/s)")
+            next_log += log_every
+
+    if pending:
+        sink.write(pending)
+        new_rows.extend(pending)
+    elapsed = time.perf_counter() - start
+    rate = round(processed / elapsed, 2) if processed and elapsed else None
+    logger.info(f"✅ {processed} images classees en {elapsed:.1f}s ({rate} images/s)")
+    return build_report(done_rows + new_rows, class_indices, images_per_second=rate)
+
+
+def output_fields(class_indices):
+    names = [k for k, _ in sorted(class_indices.items(), key=lambda x: x[1])]
+    return ["path", "label", "predicted_class", "confidence", "error"] + [f"p_{n}" for n in names]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classification hors ligne d'un dossier d'images")
+    parser.add_argument("root", nargs="?", default=DATASET_DIR, help="Dossier a parcourir")
+    parser.add_argument("--output", required=True, help="Fichier .csv / .jsonl, ou dossier .parquet")
+    parser.add_argument("--format", choices=FORMATS, help="Defaut: selon l'extension de --output")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", MODEL_PATH))
+    parser.add_argument("--backend", choices=("auto",) + BACKENDS,
+                        default=os.environ.get("MODEL_BACKEND", "auto"))
+    parser.add_argument("--labels", default=os.environ.get("LABELS_PATH", LABELS_PATH))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--pipeline", choices=PIPELINES, default="tfdata")
+    parser.add_argument("--threads", type=int, help="Threads d'inference du backend")
+    parser.add_argument("--flush-every", type=int, default=10, help="Lots entre deux ecritures")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    class_indices = load_class_indices(args.labels)
+    fmt = args.format or detect_format(args.output)
+    sink = SINKS[fmt](args.output, output_fields(class_indices))
+
+    # Taille de lot fixe : un seul bucket, une seule forme compilee
+    backend = load_backend(args.model, kind=args.backend, bucket_sizes=(args.batch_size,),
+                           num_threads=args.threads)
+    backend.warmup()
+
+    report = classify(args.root, backend, class_indices, sink, batch_size=args.batch_size,
+                      pipeline=args.pipeline, flush_every=args.flush_every)
+    print_report(report)
+    with open(args.output.rstrip("/") + ".report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
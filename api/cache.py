@@ -0,0 +1,163 @@
+"""Cache des predictions adresse par le contenu de l'image
+
+La cle est le SHA-256 des bytes recus : une image renvoyee a l'identique
+(retry, image de camera dupliquee, rerun Streamlit) est servie sans
+decodage, pretraitement ni inference. On stocke le vecteur softmax.
+
+- cache local par processus : LRU borne + expiration (TTL)
+- backend partage optionnel (Redis) pour que tous les workers gunicorn
+  en profitent ; l'eviction y est geree par le TTL et maxmemory-policy
+- invalidation automatique quand le fichier modele change : la version
+  du modele fait partie de l'espace de noms des cles
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_fingerprint(path):
+    """Empreinte (mtime + taille) d'un fichier, None s'il n'existe pas"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+class PredictionCache:
+    """LRU + TTL local, avec un second niveau Redis optionnel"""
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600, redis_url=None,
+                 watch_path=None, check_interval=1.0, namespace="rice-cache"):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.namespace = namespace
+        self.watch_path = watch_path
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = file_fingerprint(watch_path) if watch_path else None
+        self._last_check = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.05)
+                self._redis.ping()
+                logger.info(f"Cache partagé Redis actif: {redis_url}")
+            except Exception as e:
+                logger.warning(f"Cache Redis indisponible ({e}), cache local seulement")
+                self._redis = None
+
+    # Version du modele
+    def _check_model(self):
+        """Vide le cache local si le fichier modele a change (verif. periodique)"""
+        if not self.watch_path:
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        version = file_fingerprint(self.watch_path)
+        if version != self._version:
+            logger.info("Fichier modele modifie : invalidation du cache des predictions")
+            self.set_version(version)
+
+    def set_version(self, version):
+        """Change la version du modele et vide le cache local"""
+        with self._lock:
+            self._version = version
+            self._entries.clear()
+            self.invalidations += 1
+
+    def _shared_key(self, digest):
+        return f"{self.namespace}:{self._version}:{digest}"
+
+    # Acces
+    def get(self, digest):
+        """Vecteur de probabilites en cache ou None"""
+        self._check_model()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                expires, probs = entry
+                if expires > now:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return probs
+                del self._entries[digest]
+
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self._shared_key(digest))
+            except Exception as e:
+                logger.warning(f"Lecture Redis impossible: {e}")
+                raw = None
+            if raw is not None:
+                probs = json.loads(raw)
+                self._store_local(digest, probs, now)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return probs
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, digest, probs):
+        probs = [float(p) for p in probs]
+        self._store_local(digest, probs, time.monotonic())
+        if self._redis is not None:
+            try:
+                self._redis.setex(self._shared_key(digest), int(self.ttl), json.dumps(probs))
+            except Exception as e:
+                logger.warning(f"Ecriture Redis impossible: {e}")
+
+    def _store_local(self, digest, probs, now):
+        with self._lock:
+            self._entries[digest] = (now + self.ttl, probs)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "shared_backend": "redis" if self._redis is not None else None,
+                "model_version": self._version,
+            }
@@ -0,0 +1,313 @@
+"""Cascade : classifieur de forme peu couteux avant le CNN
+
+Plusieurs varietes se distinguent par la seule forme du grain (Basmati et
+Jasmine longs et fins, Arborio court et rond...). Le premier etage calcule
+quelques descripteurs morphologiques et colorimetriques avec NumPy, sur
+l'image deja decodee en 224x224 pour le CNN (pas de second decodage) :
+
+- aire, grand et petit axe (moments d'ordre 2), allongement, excentricite
+- etendue (aire / boite englobante), circularite (4 pi aire / perimetre^2)
+- moyenne et ecart-type de R, G, B sur le grain
+
+Un classifieur gaussien (une gaussienne par classe, covariance regularisee)
+donne des probabilites ; au-dessus du seuil, la reponse est servie sans
+appeler le CNN, sinon la requete continue vers le modele.
+
+    python -m api.cascade train
+    python -m api.cascade benchmark --per-class 50
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from api import preprocessing
+from api.dataset import DATASET_DIR, LABELS_PATH, MODEL_DIR, MODEL_PATH, iter_labeled_images, load_class_indices
+from api.embeddings import split
+from api.segmentation import otsu_threshold
+
+logger = logging.getLogger(__name__)
+
+CASCADE_PATH = os.path.join(MODEL_DIR, "shape_classifier.npz")
+FEATURES = (
+    "area", "major_axis", "minor_axis", "aspect_ratio", "eccentricity", "extent", "circularity",
+    "mean_r", "mean_g", "mean_b", "std_r", "std_g", "std_b",
+)
+THRESHOLDS = (0.8, 0.9, 0.95, 0.98, 0.99)
+
+
+def shape_features(pixels):
+    """Image RGB uint8 (H, W, 3) d'un grain sur fond sombre -> vecteur de FEATURES"""
+    pixels = np.asarray(pixels)
+    gray = pixels.mean(axis=2).astype(np.uint8)
+    mask = gray > otsu_threshold(gray)
+    area = int(mask.sum())
+    if area < 3:
+        return np.zeros(len(FEATURES), dtype=np.float64)
+
+    ys, xs = np.nonzero(mask)
+    l2, l1 = np.linalg.eigvalsh(np.cov(np.stack([xs, ys]).astype(np.float64)))
+    l1, l2 = max(l1, 1e-9), max(l2, 1e-9)
+    major, minor = 4.0 * np.sqrt(l1), 4.0 * np.sqrt(l2)
+    extent = area / float((xs.max() - xs.min() + 1) * (ys.max() - ys.min() + 1))
+
+    # Contour : pixels du masque dont un voisin (4-connexite) est du fond
+    interior = mask.copy()
+    interior[1:] &= mask[:-1]
+    interior[:-1] &= mask[1:]
+    interior[:, 1:] &= mask[:, :-1]
+    interior[:, :-1] &= mask[:, 1:]
+    perimeter = max(1, int(mask.sum() - interior.sum()))
+
+    colours = pixels[mask].astype(np.float64)
+    return np.concatenate([
+        [area, major, minor, major / minor, np.sqrt(1.0 - l2 / l1), extent,
+         4.0 * np.pi * area / perimeter ** 2],
+        colours.mean(axis=0),
+        colours.std(axis=0),
+    ])
+
+
+class ShapeClassifier:
+    """Une gaussienne par classe sur les descripteurs standardises"""
+
+    def __init__(self, classes, mean, std, centers, precisions, log_norms):
+        self.classes = list(classes)
+        self.mean = mean
+        self.std = std
+        self.centers = centers
+        self.precisions = precisions
+        self.log_norms = log_norms
+
+    @classmethod
+    def fit(cls, X, y, classes, regularization=1e-2):
+        mean, std = X.mean(axis=0), X.std(axis=0) + 1e-9
+        Z = (X - mean) / std
+        d = Z.shape[1]
+        centers, precisions, log_norms = [], [], []
+        for label in range(len(classes)):
+            members = Z[y == label]
+            cov = np.cov(members, rowvar=False) + regularization * np.eye(d)
+            _, logdet = np.linalg.slogdet(cov)
+            centers.append(members.mean(axis=0))
+            precisions.append(np.linalg.inv(cov))
+            log_norms.append(np.log(len(members) / len(Z)) - 0.5 * logdet)
+        return cls(classes, mean, std, np.array(centers), np.array(precisions), np.array(log_norms))
+
+    def predict_proba(self, X):
+        """(n, d) -> (n, classes) ; une ligne par image"""
+        Z = (np.atleast_2d(X) - self.mean) / self.std
+        diff = Z[:, None, :] - self.centers[None]
+        mahalanobis = np.einsum("ncd,cde,nce->nc", diff, self.precisions, diff)
+        logits = self.log_norms - 0.5 * mahalanobis
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def save(self, path):
+        np.savez(path, classes=np.array(self.classes), mean=self.mean, std=self.std,
+                 centers=self.centers, precisions=self.precisions, log_norms=self.log_norms)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls([str(c) for c in data["classes"]], data["mean"], data["std"],
+                       data["centers"], data["precisions"], data["log_norms"])
+
+
+class ShapeCascade:
+    """Premier etage de /predict : probabilites si confiant, None sinon"""
+
+    def __init__(self, path=CASCADE_PATH, threshold=0.95):
+        self.classifier = ShapeClassifier.load(path)
+        self.threshold = threshold
+
+    @property
+    def classes(self):
+        return self.classifier.classes
+
+    def predict_proba(self, image):
+        """Image PIL decodee (224x224) -> probabilites (classes,)"""
+        return self.classifier.predict_proba(shape_features(np.asarray(image)))[0]
+
+    def answer(self, image):
+        probs = self.predict_proba(image)
+        return probs if probs.max() >= self.threshold else None
+
+    def describe(self):
+        return {"threshold": self.threshold, "features": list(FEATURES)}
+
+
+# ---------------------------------------------------------------------------
+# Entrainement et benchmark hors ligne
+# ---------------------------------------------------------------------------
+
+def _decode(path):
+    with open(path, "rb") as f:
+        return preprocessing.decode_image(f.read())
+
+
+def coverage_table(probs, predicted, labels, thresholds=THRESHOLDS):
+    """Par seuil : part des images servies par la forme et leur precision"""
+    confidence = probs.max(axis=1)
+    rows = {}
+    for threshold in thresholds:
+        answered = confidence >= threshold
+        rows[str(threshold)] = {
+            "coverage": float(answered.mean()),
+            "accuracy": float(np.mean(predicted[answered] == labels[answered])) if answered.any() else None,
+        }
+    return rows
+
+
+def train(dataset_dir, class_indices, output, per_class=None, val_fraction=0.2, seed=42):
+    samples = list(iter_labeled_images(dataset_dir, class_indices, per_class))
+    start = time.perf_counter()
+    X = np.stack([shape_features(np.asarray(_decode(path))) for path, _ in samples])
+    y = np.array([label for _, label in samples])
+    logger.info(f"Descripteurs de {len(samples)} images en {time.perf_counter() - start:.1f}s")
+
+    train_idx, val_idx = split(y, val_fraction, seed)
+    classes = [k for k, _ in sorted(class_indices.items(), key=lambda x: x[1])]
+    classifier = ShapeClassifier.fit(X[train_idx], y[train_idx], classes)
+    classifier.save(output)
+
+    probs = classifier.predict_proba(X[val_idx])
+    predicted = probs.argmax(axis=1)
+    report = {
+        "num_train": int(len(train_idx)),
+        "num_val": int(len(val_idx)),
+        "val_accuracy": float(np.mean(predicted == y[val_idx])),
+        "thresholds": coverage_table(probs, predicted, y[val_idx]),
+        # Relues par `benchmark` : on mesure sur des images non vues
+        "validation_paths": [os.path.relpath(samples[i][0], dataset_dir) for i in val_idx],
+    }
+    with open(output + ".report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def benchmark(dataset_dir, class_indices, cascade_path, model_path, backend_kind=None):
+    """Precision et debit : CNN seul, forme seule, cascade a chaque seuil
+
+    Chaque image est mesuree une fois par etage (decodage, forme, CNN a
+    l'unite) ; le cout de la cascade a un seuil est la somme des etages
+    reellement executes pour chaque image.
+    """
+    from api.backends import load_backend
+
+    report_path = cascade_path + ".report.json"
+    if os.path.exists(report_path):
+        with open(report_path, "r") as f:
+            paths = json.load(f)["validation_paths"]
+        samples = [(os.path.join(dataset_dir, p), class_indices[os.path.dirname(p)]) for p in paths]
+    else:
+        logger.warning("Pas de rapport d'entrainement : mesure sur tout le dataset (images vues)")
+        samples = list(iter_labeled_images(dataset_dir, class_indices))
+
+    cascade = ShapeCascade(cascade_path, threshold=1.0)
+    backend = load_backend(model_path, kind=backend_kind, bucket_sizes=(1,))
+    backend.warmup()
+    buffer = backend.input_buffer(1)
+
+    labels, shape_probs, cnn_pred = [], [], []
+    t_decode, t_shape, t_cnn = [], [], []
+    for path, label in samples:
+        with open(path, "rb") as f:
+            content = f.read()
+        start = time.perf_counter()
+        image = preprocessing.decode_image(content)
+        t_decode.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        shape_probs.append(cascade.predict_proba(image))
+        t_shape.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        preprocessing.to_array(image, buffer[0])
+        cnn_pred.append(int(np.argmax(backend.predict(buffer)[0])))
+        t_cnn.append(time.perf_counter() - start)
+        labels.append(label)
+
+    labels, cnn_pred = np.array(labels), np.array(cnn_pred)
+    shape_probs = np.array(shape_probs)
+    shape_pred = shape_probs.argmax(axis=1)
+    t_decode, t_shape, t_cnn = map(np.array, (t_decode, t_shape, t_cnn))
+
+    def row(answered):
+        predicted = np.where(answered, shape_pred, cnn_pred)
+        seconds = t_decode + np.where(answered, t_shape, t_shape + t_cnn)
+        return {
+            "coverage": float(answered.mean()),
+            "accuracy": float(np.mean(predicted == labels)),
+            "images_per_second": round(len(labels) / seconds.sum(), 2),
+        }
+
+    report = {
+        "num_images": len(labels),
+        "cnn_only": {
+            "accuracy": float(np.mean(cnn_pred == labels)),
+            "images_per_second": round(len(labels) / (t_decode + t_cnn).sum(), 2),
+        },
+        "shape_only": {
+            "accuracy": float(np.mean(shape_pred == labels)),
+            "images_per_second": round(len(labels) / (t_decode + t_shape).sum(), 2),
+        },
+        "cascade": {
+            str(threshold): row(shape_probs.max(axis=1) >= threshold) for threshold in THRESHOLDS
+        },
+    }
+    return report
+
+
+def print_benchmark(report):
+    print(f"\n{report['num_images']} images de validation")
+    print(f"{'Configuration':<18}{'Couverture':>12}{'Precision':>12}{'Images/s':>12}")
+    for name in ("cnn_only", "shape_only"):
+        row = report[name]
+        print(f"{name:<18}{'':>12}{row['accuracy']:>12.2%}{row['images_per_second']:>12}")
+    for threshold, row in report["cascade"].items():
+        print(f"{'cascade ' + threshold:<18}{row['coverage']:>12.2%}{row['accuracy']:>12.2%}"
+              f"{row['images_per_second']:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classifieur de forme (premier etage de la cascade)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "benchmark"):
+        p = sub.add_parser(name)
+        p.add_argument("--dataset", default=DATASET_DIR)
+        p.add_argument("--labels", default=LABELS_PATH)
+        p.add_argument("--cascade", default=CASCADE_PATH, help="Fichier .npz du classifieur")
+    sub.choices["train"].add_argument("--per-class", type=int, default=0)
+    sub.choices["train"].add_argument("--val-fraction", type=float, default=0.2)
+    bench = sub.choices["benchmark"]
+    bench.add_argument("--model", default=MODEL_PATH)
+    bench.add_argument("--backend", default=None)
+    bench.add_argument("--output", help="Fichier JSON du rapport")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    class_indices = load_class_indices(args.labels)
+
+    if args.command == "train":
+        report = train(args.dataset, class_indices, args.cascade,
+                       per_class=args.per_class or None, val_fraction=args.val_fraction)
+        print(f"Precision validation: {report['val_accuracy']:.2%}")
+        for threshold, row in report["thresholds"].items():
+            accuracy = f"{row['accuracy']:.2%}" if row["accuracy"] is not None else "-"
+            print(f"  seuil {threshold}: {row['coverage']:.2%} servies par la forme, precision {accuracy}")
+        return
+
+    report = benchmark(args.dataset, class_indices, args.cascade, args.model, args.backend)
+    print_benchmark(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Acces au dataset local (dataset/<classe>/*.jpg) et aux labels"""
+import json
+import os
+
+import numpy as np
+
+from api.batch_upload import is_image_name
+from api.preprocessing import preprocess_image
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_DIR = os.path.join(BASE_DIR, "dataset")
+MODEL_DIR = os.path.join(BASE_DIR, "modele")
+MODEL_PATH = os.path.join(MODEL_DIR, "classification_type_riz.keras")
+LABELS_PATH = os.path.join(MODEL_DIR, "class_names.json")
+
+
+def load_class_indices(path=LABELS_PATH):
+    """class_names.json -> {"Arborio": 0, ...}"""
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def iter_labeled_images(root=DATASET_DIR, class_indices=None, per_class=None):
+    """Parcourt root/<classe>/ -> (chemin, index de classe)
+
+    Les fichiers sont tries pour que les echantillons soient reproductibles ;
+    avec per_class, on prend des images regulierement espacees.
+    """
+    if class_indices is None:
+        class_indices = load_class_indices()
+    for class_name, label in sorted(class_indices.items(), key=lambda x: x[1]):
+        class_dir = os.path.join(root, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        names = sorted(n for n in os.listdir(class_dir) if is_image_name(n))
+        if per_class and len(names) > per_class:
+            step = len(names) / per_class
+            names = [names[int(i * step)] for i in range(per_class)]
+        for name in names:
+            yield os.path.join(class_dir, name), label
+
+
+def load_image(path, dtype=np.float32):
+    """Charge une image du disque comme l'API : RGB, 224x224, float32 dans [0, 1]"""
+    with open(path, "rb") as f:
+        return preprocess_image(f.read(), dtype=dtype)[0]
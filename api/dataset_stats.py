@@ -0,0 +1,162 @@
+"""Statistiques du dataset pour l'onglet d'analyse de l'UI
+
+Parcourt dataset/<classe>/ et ecrit app/data/dataset_stats.json
+(repartition des classes, nombre d'images, dimensions, volume).
+
+Un manifeste (chemin, taille, mtime, dimensions de chaque image) evite de
+tout relire a chaque passage : seules les images nouvelles ou modifiees
+sont rouvertes, et seulement pour lire leur en-tete. Les images supprimees
+disparaissent du manifeste.
+
+    python -m api.dataset_stats
+    python -m api.dataset_stats --dataset /data/riz --workers 16
+
+Les metriques qui ne viennent pas du dataset (accuracy, temps par image)
+sont reprises du fichier existant.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import Image
+
+from api.batch_upload import is_image_name
+from api.dataset import BASE_DIR, DATASET_DIR, MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.path.join(MODEL_DIR, "dataset_manifest.json")
+OUTPUT_PATH = os.path.join(BASE_DIR, "app", "data", "dataset_stats.json")
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json(path, payload, **kwargs):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, **kwargs)
+    os.replace(tmp, path)
+
+
+def image_size(path):
+    """(largeur, hauteur) lues dans l'en-tete, sans decoder les pixels"""
+    with Image.open(path) as image:
+        return image.size
+
+
+def _list_files(root):
+    """Images de root/<classe>/ -> [(chemin relatif, classe, chemin, stat)]"""
+    files = []
+    for class_name in sorted(os.listdir(root)):
+        class_dir = os.path.join(root, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        with os.scandir(class_dir) as it:
+            for entry in it:
+                if entry.is_file() and is_image_name(entry.name):
+                    files.append((f"{class_name}/{entry.name}", class_name, entry.path, entry.stat()))
+    return files
+
+
+def scan(root=DATASET_DIR, manifest=None, workers=8):
+    """Met a jour le manifeste -> (entrees, nombre d'images relues)"""
+    previous = (manifest or {}).get("entries", {})
+    entries = {}
+    changed = []
+    for rel, class_name, path, stat in _list_files(root):
+        known = previous.get(rel)
+        if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            entries[rel] = known
+        else:
+            changed.append((rel, class_name, path, stat))
+
+    def read(item):
+        rel, class_name, path, stat = item
+        try:
+            width, height = image_size(path)
+        except Exception as e:
+            logger.warning(f"Image illisible, ignoree: {rel} ({e})")
+            return rel, None
+        return rel, {
+            "class": class_name, "size": stat.st_size, "mtime": stat.st_mtime,
+            "width": width, "height": height,
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for rel, entry in executor.map(read, changed):
+            if entry is not None:
+                entries[rel] = entry
+    return entries, len(changed)
+
+
+def build_stats(entries, previous=None):
+    """Manifeste -> contenu de dataset_stats.json (format lu par l'UI)"""
+    previous_metrics = (previous or {}).get("metrics", {})
+    counts = Counter(entry["class"] for entry in entries.values())
+    total = sum(counts.values())
+    widths = [entry["width"] for entry in entries.values()]
+    heights = [entry["height"] for entry in entries.values()]
+    return {
+        "metrics": {
+            "total_images": str(total),
+            "classes": str(len(counts)),
+            "accuracy": previous_metrics.get("accuracy", "-"),
+            "time_per_image": previous_metrics.get("time_per_image", "-"),
+        },
+        "class_distribution": [
+            {"Type de Riz": name, "Nombre": n, "Pourcentage": round(100.0 * n / total, 1)}
+            for name, n in sorted(counts.items())
+        ],
+        "images": {
+            "mean_width": round(sum(widths) / total, 1) if total else None,
+            "mean_height": round(sum(heights) / total, 1) if total else None,
+            "min_side": min(min(widths), min(heights)) if total else None,
+            "max_side": max(max(widths), max(heights)) if total else None,
+            "total_mb": round(sum(entry["size"] for entry in entries.values()) / 1e6, 1),
+        },
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def update(dataset_dir=DATASET_DIR, manifest_path=MANIFEST_PATH, output_path=OUTPUT_PATH, workers=8):
+    start = time.perf_counter()
+    manifest = _read_json(manifest_path, {})
+    if manifest.get("root") != os.path.abspath(dataset_dir):
+        manifest = {}
+    entries, rescanned = scan(dataset_dir, manifest, workers=workers)
+    _write_json(manifest_path, {"root": os.path.abspath(dataset_dir), "entries": entries})
+
+    stats = build_stats(entries, _read_json(output_path, {}))
+    _write_json(output_path, stats, indent=2)
+    logger.info(f"✅ {output_path}: {len(entries)} images, {rescanned} relue(s) "
+                f"({time.perf_counter() - start:.2f}s)")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Statistiques du dataset pour l'UI")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Threads de lecture des en-tetes des images modifiees")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    update(args.dataset, args.manifest, args.output, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""Embeddings precalcules du dataset et re-entrainement rapide de la tete
+
+Le backbone MobileNetV2 est gele : seule la tete GAP -> Dense(128) ->
+Dense(5) s'entraine. On fait donc passer chaque image une seule fois dans
+le backbone et on garde les vecteurs poolés (1280 valeurs, float16) dans un
+tableau .npy ouvert en memmap, indexe par chemin et empreinte SHA-256.
+Une nouvelle extraction ne recalcule que les images nouvelles ou modifiees.
+
+Le backbone est pris dans le modele .keras existant (jusqu'au
+GlobalAveragePooling2D), ou MobileNetV2 ImageNet s'il n'y en a pas. Ses
+poids sont hashes : si le backbone change, tout le magasin est recalcule.
+
+    python -m api.embeddings extract
+    python -m api.embeddings train --output modele/classification_type_riz_v2.keras
+
+Note : sans passer par le backbone a chaque epoque, il n'y a pas
+d'augmentation de donnees (rotations, flips...) comme dans le notebook.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from api.batch_upload import is_image_name
+from api.bulk_classify import thread_batches
+from api.cache import content_hash
+from api.dataset import DATASET_DIR, LABELS_PATH, MODEL_DIR, MODEL_PATH, load_class_indices
+from api.export_model import per_class_accuracy
+from api.preprocessing import IMG_SIZE
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = os.path.join(MODEL_DIR, "embeddings")
+STORE_DTYPE = np.float16
+INPUT_SHAPE = (IMG_SIZE[1], IMG_SIZE[0], 3)
+
+
+# ---------------------------------------------------------------------------
+# Backbone
+# ---------------------------------------------------------------------------
+
+def load_backbone(model_path=MODEL_PATH):
+    """Modele image -> embedding poolé, depuis le .keras s'il existe"""
+    import tensorflow as tf
+
+    if model_path and os.path.exists(model_path):
+        model = tf.keras.models.load_model(model_path)
+        for layer in model.layers:
+            if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+                logger.info(f"Backbone extrait de {os.path.basename(model_path)} ({layer.name})")
+                return tf.keras.Model(model.input, layer.output, name="backbone")
+        raise ValueError(f"Pas de GlobalAveragePooling2D dans {model_path}")
+
+    logger.info("Modele absent : backbone MobileNetV2 ImageNet")
+    return tf.keras.applications.MobileNetV2(
+        weights="imagenet", include_top=False, input_shape=INPUT_SHAPE, pooling="avg"
+    )
+
+
+def backbone_id(backbone):
+    """Empreinte des poids : change seulement si le backbone change"""
+    digest = hashlib.sha256()
+    for weight in backbone.get_weights():
+        digest.update(np.ascontiguousarray(weight).tobytes())
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Magasin d'embeddings
+# ---------------------------------------------------------------------------
+
+class EmbeddingStore:
+    """index.json (chemin -> ligne, sha256, label) + embeddings.npy en memmap
+
+    Les lignes des images supprimees sont reutilisees ; le tableau double
+    de capacite quand il est plein.
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.array_path = os.path.join(directory, "embeddings.npy")
+        self.backbone = None
+        self.dim = None
+        self.entries = {}
+        self.free = []
+        self.size = 0
+        self.array = None
+        if os.path.exists(self.index_path):
+            self._load()
+
+    def _load(self):
+        with open(self.index_path, "r") as f:
+            index = json.load(f)
+        self.backbone = index["backbone"]
+        self.dim = index["dim"]
+        self.entries = index["entries"]
+        self.free = index.get("free", [])
+        self.size = index["size"]
+        self.array = np.load(self.array_path, mmap_mode="r+")
+
+    def reset(self, backbone, dim):
+        """Magasin vide pour un nouveau backbone"""
+        self.backbone = backbone
+        self.dim = int(dim)
+        self.entries = {}
+        self.free = []
+        self.size = 0
+        self.array = None
+        self._allocate(1024)
+
+    def _allocate(self, capacity):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.array_path + ".tmp"
+        array = np.lib.format.open_memmap(tmp, mode="w+", dtype=STORE_DTYPE, shape=(capacity, self.dim))
+        if self.array is not None:
+            array[:self.size] = self.array[:self.size]
+        array.flush()
+        del array
+        os.replace(tmp, self.array_path)
+        self.array = np.load(self.array_path, mmap_mode="r+")
+
+    def _next_row(self):
+        if self.free:
+            return self.free.pop()
+        if self.size >= len(self.array):
+            self._allocate(len(self.array) * 2)
+        self.size += 1
+        return self.size - 1
+
+    def get(self, path):
+        return self.entries.get(path)
+
+    def put(self, path, digest, label, stat, vector):
+        entry = self.entries.get(path)
+        row = entry["row"] if entry else self._next_row()
+        self.array[row] = vector
+        self.entries[path] = {
+            "row": row, "sha256": digest, "label": label,
+            "mtime_ns": stat.st_mtime_ns, "bytes": stat.st_size,
+        }
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.free.append(entry["row"])
+
+    def save(self):
+        """Vide le memmap puis remplace l'index (ecriture atomique)"""
+        self.array.flush()
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "backbone": self.backbone, "dim": self.dim, "dtype": np.dtype(STORE_DTYPE).name,
+                "size": self.size, "free": self.free, "entries": self.entries,
+            }, f)
+        os.replace(tmp, self.index_path)
+
+    def arrays(self, class_indices):
+        """(chemins, X float32, y) des images dont le label est une classe"""
+        paths = sorted(p for p, e in self.entries.items() if e["label"] in class_indices)
+        rows = np.array([self.entries[p]["row"] for p in paths], dtype=np.int64)
+        if not len(rows):
+            return paths, np.empty((0, self.dim or 0), np.float32), np.empty(0, np.int64)
+        X = np.asarray(self.array[rows], dtype=np.float32)
+        y = np.array([class_indices[self.entries[p]["label"]] for p in paths], dtype=np.int64)
+        return paths, X, y
+
+
+def extract(store, backbone, dataset_dir=DATASET_DIR, batch_size=64, save_every=20):
+    """Met le magasin a jour : n'envoie au backbone que les images nouvelles ou modifiees"""
+    digest_backbone = backbone_id(backbone)
+    if store.backbone != digest_backbone:
+        if store.entries:
+            logger.info("Backbone different : recalcul complet des embeddings")
+        store.reset(digest_backbone, backbone.output_shape[-1])
+
+    seen = set()
+    todo = []
+    hashes = {}
+    for dirpath, dirnames, filenames in os.walk(dataset_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not is_image_name(name):
+                continue
+            rel_path = os.path.relpath(os.path.join(dirpath, name), dataset_dir)
+            seen.add(rel_path)
+            stat = os.stat(os.path.join(dataset_dir, rel_path))
+            entry = store.get(rel_path)
+            # mtime + taille inchanges : inutile de relire le fichier
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["bytes"] == stat.st_size:
+                continue
+            with open(os.path.join(dataset_dir, rel_path), "rb") as f:
+                digest = content_hash(f.read())
+            if entry and entry["sha256"] == digest:
+                entry["mtime_ns"], entry["bytes"] = stat.st_mtime_ns, stat.st_size
+                continue
+            hashes[rel_path] = (digest, stat)
+            todo.append(rel_path)
+
+    removed = [p for p in store.entries if p not in seen]
+    for path in removed:
+        store.remove(path)
+    logger.info(f"{len(todo)} images a encoder, {len(removed)} supprimees, "
+                f"{len(store.entries)} deja a jour")
+
+    start = time.perf_counter()
+    done = 0
+    batches = thread_batches(dataset_dir, todo, batch_size, INPUT_SHAPE, np.float32)
+    for index, (rel_paths, pixels, ok) in enumerate(batches, 1):
+        vectors = backbone(pixels, training=False).numpy()
+        for rel_path, vector, readable in zip(rel_paths, vectors, ok):
+            if not readable:
+                continue
+            digest, stat = hashes[rel_path]
+            label = os.path.basename(os.path.dirname(rel_path))
+            store.put(rel_path, digest, label, stat, vector)
+        done += len(rel_paths)
+        if index % save_every == 0:
+            store.save()
+            logger.info(f"{done}/{len(todo)} images ({done / (time.perf_counter() - start):.1f} images/s)")
+    store.save()
+    if done:
+        logger.info(f"✅ {done} embeddings calcules en {time.perf_counter() - start:.1f}s")
+    return store
+
+
+# ---------------------------------------------------------------------------
+# Entrainement de la tete
+# ---------------------------------------------------------------------------
+
+def build_head(dim, num_classes):
+    """Meme tete que le notebook : Dense(128) -> Dropout(0.5) -> Dense(classes)"""
+    import tensorflow as tf
+
+    inputs = tf.keras.Input(shape=(dim,), name="embedding")
+    x = tf.keras.layers.Dense(128, activation="relu")(inputs)
+    x = tf.keras.layers.Dropout(0.5)(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation="softmax")(x)
+    return tf.keras.Model(inputs, outputs, name="head")
+
+
+def split(y, val_fraction, seed):
+    """Separation train / validation stratifiee par classe"""
+    rng = np.random.default_rng(seed)
+    val = []
+    for label in np.unique(y):
+        indices = np.flatnonzero(y == label)
+        rng.shuffle(indices)
+        val.extend(indices[:int(round(len(indices) * val_fraction))])
+    mask = np.zeros(len(y), dtype=bool)
+    mask[val] = True
+    return np.flatnonzero(~mask), np.flatnonzero(mask)
+
+
+def train_head(store, class_indices, epochs=50, batch_size=256, learning_rate=1e-3,
+               val_fraction=0.2, seed=42):
+    import tensorflow as tf
+
+    _, X, y = store.arrays(class_indices)
+    if not len(y):
+        raise SystemExit("Magasin vide : lancer d'abord `python -m api.embeddings extract`")
+    train_idx, val_idx = split(y, val_fraction, seed)
+    logger.info(f"Entrainement de la tete : {len(train_idx)} train / {len(val_idx)} validation")
+
+    tf.keras.utils.set_random_seed(seed)
+    head = build_head(X.shape[1], len(class_indices))
+    head.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss="sparse_categorical_crossentropy",
+        metrics=["accuracy"],
+    )
+    validation = (X[val_idx], y[val_idx]) if len(val_idx) else None
+    callbacks = []
+    if validation is not None:
+        callbacks.append(tf.keras.callbacks.EarlyStopping(
+            monitor="val_accuracy", patience=8, restore_best_weights=True
+        ))
+
+    start = time.perf_counter()
+    head.fit(X[train_idx], y[train_idx], validation_data=validation, epochs=epochs,
+             batch_size=batch_size, callbacks=callbacks, verbose=2)
+    logger.info(f"✅ Tete entrainee en {time.perf_counter() - start:.1f}s")
+
+    report = {"num_train": int(len(train_idx)), "num_val": int(len(val_idx))}
+    if validation is not None:
+        predicted = np.argmax(head.predict(validation[0], verbose=0), axis=1)
+        class_names = {v: k for k, v in class_indices.items()}
+        report["val_accuracy"] = float(np.mean(predicted == validation[1]))
+        report["per_class"] = per_class_accuracy(validation[1], predicted, class_names)
+    return head, report
+
+
+def assemble(backbone, head):
+    """Backbone + tete -> modele complet chargeable par l'API"""
+    import tensorflow as tf
+
+    return tf.keras.Model(backbone.input, head(backbone.output), name="classification_type_riz")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embeddings du dataset et re-entrainement de la tete")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("extract", "train"):
+        p = sub.add_parser(name)
+        p.add_argument("--model", default=MODEL_PATH, help="Modele dont on reprend le backbone")
+        p.add_argument("--labels", default=LABELS_PATH)
+        p.add_argument("--dataset", default=DATASET_DIR)
+        p.add_argument("--store", default=STORE_DIR)
+        p.add_argument("--batch-size", type=int, default=64)
+
+    train = sub.choices["train"]
+    train.add_argument("--output", required=True, help="Nouveau modele .keras")
+    train.add_argument("--epochs", type=int, default=50)
+    train.add_argument("--learning-rate", type=float, default=1e-3)
+    train.add_argument("--val-fraction", type=float, default=0.2)
+    train.add_argument("--seed", type=int, default=42)
+    train.add_argument("--no-extract", action="store_true", help="Ne pas mettre le magasin a jour")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    class_indices = load_class_indices(args.labels)
+    store = EmbeddingStore(args.store)
+    backbone = load_backbone(args.model)
+    if args.command == "extract" or not args.no_extract:
+        extract(store, backbone, args.dataset, batch_size=args.batch_size)
+    if args.command == "extract":
+        return
+
+    head, report = train_head(store, class_indices, epochs=args.epochs,
+                              learning_rate=args.learning_rate,
+                              val_fraction=args.val_fraction, seed=args.seed)
+    model = assemble(backbone, head)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    model.save(args.output)
+    labels_out = os.path.join(os.path.dirname(os.path.abspath(args.output)), "class_names.json")
+    with open(labels_out, "w") as f:
+        json.dump(class_indices, f, indent=2)
+    with open(args.output + ".report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"✅ Modele ecrit: {args.output} (+ {os.path.basename(labels_out)})")
+    if "val_accuracy" in report:
+        logger.info(f"Precision validation: {report['val_accuracy']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
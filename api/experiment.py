@@ -0,0 +1,192 @@
+"""Comparaison de deux versions du modele sur le trafic reel
+
+Un modele candidat (quantifie, re-entraine...) est charge a cote du modele
+principal, avec son propre micro-batcher :
+
+- mode "shadow" : chaque requete /predict est aussi envoyee au candidat,
+  hors du chemin de la reponse (file + thread d'inference du candidat).
+  La reponse part sans l'attendre ; la comparaison est faite a l'arrivee
+  du resultat. Si la file du candidat deborde, la requete n'est pas
+  dupliquee (le client n'attend jamais le candidat).
+- mode "split" : une fraction du trafic est servie par le candidat (A/B).
+
+Les statistiques (accord, divergence par classe, latences des deux
+modeles) sont exposees par /experiment.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from api.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+MODES = ("shadow", "split")
+PRIMARY, CANDIDATE = "primary", "candidate"
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64) * 1000.0
+    return {
+        "count": int(len(values)),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+
+
+class ExperimentStats:
+    """Compteurs partages entre threads ; latences sur une fenetre glissante"""
+
+    def __init__(self, class_names, window=5000):
+        self.class_names = class_names
+        self._lock = threading.Lock()
+        self.served = {PRIMARY: 0, CANDIDATE: 0}
+        self.latencies = {PRIMARY: deque(maxlen=window), CANDIDATE: deque(maxlen=window)}
+        self.compared = 0
+        self.agreed = 0
+        self.dropped = 0
+        self.errors = 0
+        # confusion[classe principale][classe candidate] = nombre de requetes
+        self.confusion = {}
+        self.prob_delta = 0.0
+
+    def observe_latency(self, arm, seconds, served=False):
+        with self._lock:
+            self.latencies[arm].append(seconds)
+            if served:
+                self.served[arm] += 1
+
+    def record_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def compare(self, primary, candidate):
+        primary_class = self.class_names[int(np.argmax(primary))]
+        candidate_class = self.class_names[int(np.argmax(candidate))]
+        delta = float(np.abs(np.asarray(primary) - np.asarray(candidate)).max())
+        with self._lock:
+            self.compared += 1
+            self.agreed += primary_class == candidate_class
+            row = self.confusion.setdefault(primary_class, {})
+            row[candidate_class] = row.get(candidate_class, 0) + 1
+            self.prob_delta += delta
+
+    def snapshot(self):
+        with self._lock:
+            confusion = {k: dict(v) for k, v in self.confusion.items()}
+            latencies = {arm: list(values) for arm, values in self.latencies.items()}
+            compared, agreed, prob_delta = self.compared, self.agreed, self.prob_delta
+            served, dropped, errors = dict(self.served), self.dropped, self.errors
+
+        per_class = {}
+        for name, row in confusion.items():
+            total = sum(row.values())
+            per_class[name] = {
+                "requests": total,
+                "divergence": round(1.0 - row.get(name, 0) / total, 4),
+                "candidate_classes": row,
+            }
+        return {
+            "served": served,
+            "compared": compared,
+            "agreement_rate": round(agreed / compared, 4) if compared else None,
+            "mean_max_prob_delta": round(prob_delta / compared, 6) if compared else None,
+            "dropped": dropped,
+            "errors": errors,
+            "per_class": per_class,
+            "latency": {arm: _percentiles(values) for arm, values in latencies.items()},
+        }
+
+
+class Experiment:
+    """Modele candidat + son micro-batcher + statistiques de comparaison"""
+
+    def __init__(self, backend, class_names, mode="shadow", fraction=0.1,
+                 max_batch_size=16, max_wait_ms=5.0, max_pending=256, name=None):
+        if mode not in MODES:
+            raise ValueError(f"Mode d'experience inconnu: {mode} (attendu: {', '.join(MODES)})")
+        self.backend = backend
+        self.mode = mode
+        self.fraction = float(fraction)
+        self.max_pending = max_pending
+        self.name = name
+        self.stats = ExperimentStats(class_names)
+        self.batcher = MicroBatcher(
+            lambda batch: self.backend.predict(batch),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms
+        )
+
+    def reset_stats(self, class_names):
+        """Nouvelle version principale : la comparaison repart de zero avec ses labels"""
+        self.stats = ExperimentStats(class_names)
+
+    def route(self):
+        """Mode split : vrai si cette requete doit etre servie par le candidat"""
+        return self.mode == "split" and random.random() < self.fraction
+
+    def submit(self, batch):
+        """Requete servie par le candidat -> Future (latence enregistree)"""
+        start = time.perf_counter()
+        future = self.batcher.submit(batch)
+        future.add_done_callback(
+            lambda f: self.stats.observe_latency(CANDIDATE, time.perf_counter() - start, served=True)
+        )
+        return future
+
+    def predict(self, batch):
+        return self.submit(batch).result()
+
+    def observe_primary(self, seconds):
+        self.stats.observe_latency(PRIMARY, seconds, served=True)
+
+    def shadow_input(self, batch):
+        """Copie du lot pour le candidat, prise avant l'inference principale
+
+        (le tampon d'entree peut etre rendu au backend des la fin de
+        l'inference). None si pas de shadow ou si la file du candidat deborde.
+        """
+        if self.mode != "shadow":
+            return None
+        if self.batcher.queue_depth() >= self.max_pending:
+            self.stats.record_drop()
+            return None
+        return np.array(batch, copy=True)
+
+    def shadow(self, inputs, primary):
+        """Envoie le lot au candidat sans attendre ; compare a l'arrivee"""
+        start = time.perf_counter()
+        future = self.batcher.submit(inputs)
+
+        def done(f):
+            try:
+                candidate = f.result()
+            except Exception as e:
+                logger.warning(f"Inference du modele candidat en erreur: {e}")
+                self.stats.record_error()
+                return
+            self.stats.observe_latency(CANDIDATE, time.perf_counter() - start)
+            for p, c in zip(primary, candidate):
+                self.stats.compare(p, c)
+
+        future.add_done_callback(done)
+
+    def describe(self):
+        return {
+            "mode": self.mode,
+            "fraction": self.fraction if self.mode == "split" else None,
+            "candidate": self.name,
+            "backend": self.backend.describe(),
+        }
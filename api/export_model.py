@@ -0,0 +1,241 @@
+"""Export du modele Keras vers TFLite / ONNX avec quantification optionnelle
+
+La quantification INT8 post-entrainement est calibree sur des images de
+dataset/. Apres l'export, l'artefact est compare au modele Keras : la
+precision par classe (class_names.json) et l'ecart sont affiches et
+enregistres dans <artefact>.report.json.
+
+Exemples :
+    python -m api.export_model --format tflite --quantize int8
+    python -m api.export_model --format onnx --quantize dynamic
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from api.backends import load_backend
+from api.dataset import (
+    DATASET_DIR,
+    LABELS_PATH,
+    MODEL_PATH,
+    iter_labeled_images,
+    load_class_indices,
+    load_image,
+)
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = ("none", "float16", "dynamic", "int8")
+
+
+def default_output(model_path, fmt, quantize):
+    stem = os.path.splitext(model_path)[0]
+    suffix = "" if quantize == "none" else f"_{quantize}"
+    return f"{stem}{suffix}.{fmt}"
+
+
+def calibration_images(dataset_dir, class_indices, count):
+    """Images de calibration reparties equitablement entre les classes"""
+    per_class = max(1, count // max(1, len(class_indices)))
+    return [load_image(path) for path, _ in iter_labeled_images(dataset_dir, class_indices, per_class)]
+
+
+def export_tflite(model, output, quantize, calibration):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ("float16", "dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        # Quantification entiere : entree uint8 (pixels/255 -> echelle 1/255)
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+
+    with open(output, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output, quantize, calibration):
+    if quantize == "float16":
+        raise ValueError("float16 n'est pas supporte pour l'export ONNX")
+
+    if quantize == "none":
+        model.export(output, format="onnx")
+        return
+
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fp32_path = os.path.join(tmp, "model_fp32.onnx")
+        model.export(fp32_path, format="onnx")
+
+        if quantize == "dynamic":
+            quantize_dynamic(fp32_path, output, weight_type=QuantType.QInt8)
+            return
+
+        import onnxruntime as ort
+        input_name = ort.InferenceSession(
+            fp32_path, providers=["CPUExecutionProvider"]
+        ).get_inputs()[0].name
+
+        class _Reader(CalibrationDataReader):
+            def __init__(self):
+                self._images = iter(calibration)
+
+            def get_next(self):
+                image = next(self._images, None)
+                if image is None:
+                    return None
+                return {input_name: image[np.newaxis].astype(np.float32)}
+
+        quantize_static(
+            fp32_path,
+            output,
+            _Reader(),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+
+
+def evaluate(backend, samples, batch_size=32):
+    """Predictions + latence moyenne par image sur les echantillons"""
+    predicted = []
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        batch = np.stack([load_image(path) for path, _ in samples[i:i + batch_size]])
+        predicted.append(np.argmax(backend.predict(batch), axis=1))
+    elapsed = time.perf_counter() - start
+    return np.concatenate(predicted), elapsed / max(1, len(samples))
+
+
+def per_class_accuracy(labels, predicted, class_names):
+    return {
+        name: float(np.mean(predicted[labels == index] == index)) if np.any(labels == index) else None
+        for index, name in class_names.items()
+    }
+
+
+def compare(model_path, artifact_path, dataset_dir, class_indices, per_class):
+    """Compare la precision par classe du modele Keras et de l'artefact"""
+    class_names = {v: k for k, v in class_indices.items()}
+    samples = list(iter_labeled_images(dataset_dir, class_indices, per_class))
+    labels = np.array([label for _, label in samples])
+
+    reference = load_backend(model_path, kind="keras")
+    candidate = load_backend(artifact_path)
+    ref_pred, ref_latency = evaluate(reference, samples)
+    cand_pred, cand_latency = evaluate(candidate, samples)
+
+    ref_acc = per_class_accuracy(labels, ref_pred, class_names)
+    cand_acc = per_class_accuracy(labels, cand_pred, class_names)
+
+    report = {
+        "model": os.path.basename(model_path),
+        "artifact": os.path.basename(artifact_path),
+        "num_images": len(samples),
+        "size_bytes": {
+            "model": os.path.getsize(model_path),
+            "artifact": os.path.getsize(artifact_path),
+        },
+        "latency_ms_per_image": {
+            "model": round(ref_latency * 1000, 2),
+            "artifact": round(cand_latency * 1000, 2),
+        },
+        "accuracy": {
+            "model": float(np.mean(ref_pred == labels)),
+            "artifact": float(np.mean(cand_pred == labels)),
+        },
+        "agreement": float(np.mean(ref_pred == cand_pred)),
+        "per_class": {
+            name: {
+                "model": ref_acc[name],
+                "artifact": cand_acc[name],
+                "delta": None if ref_acc[name] is None else cand_acc[name] - ref_acc[name],
+            }
+            for name in class_names.values()
+        },
+    }
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['model']} -> {report['artifact']} ({report['num_images']} images)")
+    print(f"{'Classe':<12}{'Keras':>10}{'Artefact':>10}{'Delta':>10}")
+    for name, row in report["per_class"].items():
+        if row["model"] is None:
+            continue
+        print(f"{name:<12}{row['model']:>10.2%}{row['artifact']:>10.2%}{row['delta']:>+10.2%}")
+    acc = report["accuracy"]
+    print(f"{'Global':<12}{acc['model']:>10.2%}{acc['artifact']:>10.2%}{acc['artifact'] - acc['model']:>+10.2%}")
+    print(f"Accord des predictions: {report['agreement']:.2%}")
+    size = report["size_bytes"]
+    print(f"Taille: {size['model'] / 1e6:.1f} Mo -> {size['artifact'] / 1e6:.1f} Mo")
+    latency = report["latency_ms_per_image"]
+    print(f"Latence: {latency['model']} ms/image -> {latency['artifact']} ms/image")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export TFLite/ONNX du modele de classification")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--labels", default=LABELS_PATH)
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--format", choices=("tflite", "onnx"), default="tflite")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS, default="none")
+    parser.add_argument("--output", help="Chemin de l'artefact (defaut: a cote du modele)")
+    parser.add_argument("--calibration-images", type=int, default=200,
+                        help="Nombre d'images de calibration INT8")
+    parser.add_argument("--eval-per-class", type=int, default=0,
+                        help="Images par classe pour la comparaison (0 = toutes)")
+    parser.add_argument("--no-eval", action="store_true", help="Ne pas comparer au modele Keras")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    import tensorflow as tf
+
+    class_indices = load_class_indices(args.labels)
+    output = args.output or default_output(args.model, args.format, args.quantize)
+    model = tf.keras.models.load_model(args.model)
+
+    calibration = []
+    if args.quantize == "int8":
+        calibration = calibration_images(args.dataset, class_indices, args.calibration_images)
+        logger.info(f"{len(calibration)} images de calibration chargees")
+
+    logger.info(f"Export {args.format} ({args.quantize}) -> {output}")
+    if args.format == "tflite":
+        export_tflite(model, output, args.quantize, calibration)
+    else:
+        export_onnx(model, output, args.quantize, calibration)
+    logger.info(f"✅ Artefact ecrit: {output} ({os.path.getsize(output) / 1e6:.1f} Mo)")
+
+    if not args.no_eval:
+        report = compare(args.model, output, args.dataset, class_indices, args.eval_per_class or None)
+        print_report(report)
+        with open(output + ".report.json", "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
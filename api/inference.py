@@ -0,0 +1,78 @@
+"""Fonction d'inference compilee et prechauffee
+
+model.predict() reconstruit un adaptateur de donnees et une boucle
+d'execution a chaque appel. Ici le graphe est trace une seule fois par
+taille de lot fixe (buckets) ; un lot de n images est complete par des
+zeros jusqu'au bucket superieur, puis la sortie est retronquee (meme
+decoupage que les autres backends : api.backends.predict_in_buckets).
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from api.backends import DEFAULT_BUCKETS, bucket_for, normalize_buckets, predict_in_buckets
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledPredictor:
+    """Inference par fonctions concretes a signature statique"""
+
+    def __init__(self, model, bucket_sizes=DEFAULT_BUCKETS):
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self.bucket_sizes = normalize_buckets(bucket_sizes)
+        if not self.bucket_sizes:
+            raise ValueError("Au moins une taille de lot est requise")
+
+        self.warmed_up = False
+        self.warmup_seconds = None
+
+        @tf.function
+        def _forward(x):
+            return model(x, training=False)
+
+        self._forward = _forward
+        self._concrete = {}
+        self._lock = threading.Lock()
+
+    def _get_function(self, size):
+        """Fonction concrete pour un lot de `size` images (tracee au besoin)"""
+        fn = self._concrete.get(size)
+        if fn is None:
+            with self._lock:
+                fn = self._concrete.get(size)
+                if fn is None:
+                    spec = tf.TensorSpec((size,) + self.input_shape, tf.float32)
+                    fn = self._forward.get_concrete_function(spec)
+                    self._concrete[size] = fn
+        return fn
+
+    def bucket_for(self, n):
+        """Plus petit bucket pouvant contenir n images"""
+        return bucket_for(self.bucket_sizes, n)
+
+    def warmup(self):
+        """Trace et execute chaque bucket une fois avant les vraies requetes"""
+        start = time.perf_counter()
+        for size in self.bucket_sizes:
+            dummy = tf.zeros((size,) + self.input_shape, tf.float32)
+            self._get_function(size)(dummy)
+        self.warmup_seconds = time.perf_counter() - start
+        self.warmed_up = True
+        logger.info(
+            f"Inference prechauffee (buckets {list(self.bucket_sizes)}) "
+            f"en {self.warmup_seconds:.2f}s"
+        )
+        return self.warmup_seconds
+
+    def _predict_padded(self, batch):
+        return self._get_function(len(batch))(tf.constant(batch)).numpy()
+
+    def predict(self, batch):
+        """Sortie softmax (n, num_classes) pour un lot (n, H, W, C)"""
+        batch = np.asarray(batch, dtype=np.float32)
+        return predict_in_buckets(batch, self.bucket_sizes, self._predict_padded)
@@ -0,0 +1,373 @@
+"""Processus d'inference dedie, joint par les workers HTTP via un socket Unix
+
+Un seul processus possede le modele (une seule copie des poids, un seul
+pool de threads TensorFlow) et le micro-batching : les lots de tous les
+workers gunicorn sont regroupes ensemble. Les workers utilisent
+RemoteBackend (MODEL_BACKEND=remote) a la place d'un modele local.
+
+    python -m api.inference_server --socket /tmp/rice-inference.sock
+
+Les pixels passent par un anneau de cases en memoire partagee
+(api.shm_ring) : le worker decode directement dans les cases et n'envoie
+que leurs indices. Si l'anneau est plein, les pixels sont envoyes dans
+le message.
+
+Protocole (messages encadres par multiprocessing.connection, sans pickle) :
+    requete  b"I"                                  -> b"O" + JSON (infos)
+    requete  b"S" + (case de depart, n)            -> b"O" + entete + float32
+    requete  b"P" + entete + pixels bruts          -> b"O" + entete + float32
+    requete  b"V" + requete S ou P                 -> idem, softmax suivie de l'embedding
+    erreur                                         -> b"E" + message
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from api.backends import DEFAULT_BUCKETS, InferenceBackend, load_backend, parse_buckets
+from api.batching import MicroBatcher
+from api.shm_ring import SlotRing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/rice-inference.sock"
+
+DTYPES = {0: np.float32, 1: np.uint8}
+DTYPE_CODES = {np.dtype(v): k for k, v in DTYPES.items()}
+
+# dtype, n, hauteur, largeur, canaux
+BATCH_HEADER = struct.Struct("<BIIII")
+# n, nombre de classes
+OUTPUT_HEADER = struct.Struct("<II")
+# case de depart, n
+SLOT_HEADER = struct.Struct("<II")
+
+
+def encode_batch(batch):
+    header = BATCH_HEADER.pack(DTYPE_CODES[batch.dtype], *batch.shape)
+    return b"P" + header + np.ascontiguousarray(batch).tobytes()
+
+
+def decode_batch(message):
+    code, n, h, w, c = BATCH_HEADER.unpack_from(message, 1)
+    offset = 1 + BATCH_HEADER.size
+    return np.frombuffer(message, dtype=DTYPES[code], offset=offset).reshape(n, h, w, c)
+
+
+def encode_output(outputs):
+    outputs = np.ascontiguousarray(outputs, dtype=np.float32)
+    return b"O" + OUTPUT_HEADER.pack(*outputs.shape) + outputs.tobytes()
+
+
+def decode_output(message):
+    n, k = OUTPUT_HEADER.unpack_from(message, 1)
+    offset = 1 + OUTPUT_HEADER.size
+    return np.frombuffer(message, dtype=np.float32, offset=offset).reshape(n, k)
+
+
+class SlotBatcher(MicroBatcher):
+    """Micro-batcher qui lit les cases consecutives de l'anneau sans les copier"""
+
+    def __init__(self, predict_fn, ring, **kwargs):
+        super().__init__(predict_fn, **kwargs)
+        self.ring = ring
+
+    def _concatenate(self, batch):
+        starts = [self.ring.locate(r.images) for r in batch]
+        if None not in starts:
+            # Tri par case : les sorties sont redistribuees dans le meme ordre
+            order = sorted(range(len(batch)), key=starts.__getitem__)
+            batch[:] = [batch[i] for i in order]
+            starts = [starts[i] for i in order]
+            first, expected = starts[0], starts[0]
+            for start, request in zip(starts, batch):
+                if start != expected:
+                    break
+                expected += len(request.images)
+            else:
+                return self.ring.view(first, expected - first)
+        return super()._concatenate(batch)
+
+
+class InferenceServer:
+    """Accepte les connexions des workers et alimente le micro-batcher"""
+
+    def __init__(self, backend, socket_path=DEFAULT_SOCKET,
+                 max_batch_size=32, max_wait_ms=5.0, ring_slots=128):
+        self.backend = backend
+        self.socket_path = socket_path
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.ring = None
+        if ring_slots:
+            self.ring = SlotRing.create(
+                n_slots=ring_slots,
+                slot_shape=backend.input_shape,
+                dtype=backend.input_dtype
+            )
+        self.batcher = self._new_batcher(backend.predict)
+        # Requetes /predict?similar=k : softmax et embedding dans la meme passe
+        self.embedder = self._new_batcher(backend.predict_with_embedding)
+
+    def _new_batcher(self, predict_fn):
+        if self.ring is not None:
+            return SlotBatcher(
+                predict_fn, self.ring,
+                max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms
+            )
+        return MicroBatcher(
+            predict_fn, max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms
+        )
+
+    def check_compatible(self, backend):
+        """Une nouvelle version doit garder la forme et le type d'entree :
+        les workers et l'anneau partage en dependent"""
+        current = (tuple(self.backend.input_shape), np.dtype(self.backend.input_dtype))
+        candidate = (tuple(backend.input_shape), np.dtype(backend.input_dtype))
+        if candidate != current:
+            raise ValueError(f"Entree incompatible: {candidate} au lieu de {current}")
+
+    def swap_backend(self, backend):
+        """Bascule a chaud : le lot en cours finit sur l'ancien modele"""
+        self.check_compatible(backend)
+        self.batcher.predict_fn = backend.predict
+        self.embedder.predict_fn = backend.predict_with_embedding
+        self.backend = backend
+
+    def info(self):
+        return {
+            **self.backend.describe(),
+            "accepts_uint8": self.backend.accepts_uint8,
+            "embedding": self.backend.embedding,
+            "warmed_up": self.backend.warmed_up,
+            "warmup_seconds": self.backend.warmup_seconds,
+            "ring": self.ring.describe() if self.ring is not None else None,
+            "pid": os.getpid(),
+        }
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv_bytes()
+                except (EOFError, OSError):
+                    return
+                try:
+                    op = message[:1]
+                    batcher = self.batcher
+                    if op == b"V":
+                        # Meme requete (S ou P), sortie suivie de l'embedding
+                        message, batcher = message[1:], self.embedder
+                        op = message[:1]
+                    if op == b"S":
+                        start, n = SLOT_HEADER.unpack_from(message, 1)
+                        reply = encode_output(batcher.predict(self.ring.view(start, n)))
+                    elif op == b"P":
+                        reply = encode_output(batcher.predict(decode_batch(message)))
+                    elif op == b"I":
+                        reply = b"O" + json.dumps(self.info()).encode()
+                    else:
+                        raise ValueError(f"Operation inconnue: {op!r}")
+                except Exception as e:
+                    logger.error(f"Erreur d'inference: {e}")
+                    reply = b"E" + str(e).encode()
+                try:
+                    conn.send_bytes(reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        try:
+            with Listener(self.socket_path, family="AF_UNIX") as listener:
+                os.chmod(self.socket_path, 0o600)
+                logger.info(f"✅ Serveur d'inference en ecoute sur {self.socket_path}")
+                while True:
+                    conn = listener.accept()
+                    threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            if self.ring is not None:
+                self.ring.close()
+                self.ring.unlink()
+
+
+class RemoteBackend(InferenceBackend):
+    """Backend client : delegue l'inference au processus dedie
+
+    Une connexion par thread (et par processus : reconnexion apres fork).
+    """
+
+    name = "remote"
+    batches_remotely = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, bucket_sizes=DEFAULT_BUCKETS,
+                 connect_timeout=300.0):
+        super().__init__(socket_path, bucket_sizes)
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+        self.remote = self._info()
+        self.input_shape = tuple(self.remote["input_shape"])
+        self.accepts_uint8 = self.remote["accepts_uint8"]
+        self.embedding = bool(self.remote.get("embedding"))
+
+        self.ring = None
+        self._allocations = {}
+        ring = self.remote.get("ring")
+        if ring:
+            try:
+                self.ring = SlotRing.attach(
+                    ring["name"], ring["slots"], ring["slot_shape"], ring["dtype"]
+                )
+            except Exception as e:
+                logger.warning(f"Memoire partagee indisponible ({e}), envoi des pixels par socket")
+
+    def input_buffer(self, n):
+        """Cases de l'anneau partage si possible, tampon local sinon"""
+        if self.ring is not None:
+            start = self.ring.acquire(n)
+            if start is not None:
+                self._allocations[start] = n
+                return self.ring.view(start, n)
+        return super().input_buffer(n)
+
+    def release_buffer(self, buffer):
+        if self.ring is None:
+            return
+        start = self.ring.locate(buffer)
+        n = self._allocations.pop(start, None) if start is not None else None
+        if n is not None:
+            self.ring.release(start, n)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                conn = Client(self.path, family="AF_UNIX")
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Le serveur charge encore le modele
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _call(self, message):
+        conn = self._connection()
+        try:
+            conn.send_bytes(message)
+            reply = conn.recv_bytes()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if reply[:1] == b"E":
+            raise RuntimeError(reply[1:].decode())
+        return reply
+
+    def _info(self):
+        return json.loads(self._call(b"I")[1:])
+
+    def _request(self, batch, prefix=b""):
+        # Le serveur regroupe deja les lots : pas de bucket cote client
+        start = self.ring.locate(batch) if self.ring is not None else None
+        if start is not None and start in self._allocations:
+            try:
+                return decode_output(self._call(prefix + b"S" + SLOT_HEADER.pack(start, len(batch))))
+            finally:
+                self.release_buffer(batch)
+        return decode_output(self._call(prefix + encode_batch(self._as_input(batch))))
+
+    def predict(self, batch):
+        return self._request(batch)
+
+    def predict_with_embedding(self, batch):
+        return self._request(batch, prefix=b"V")
+
+    def warmup(self):
+        start = time.perf_counter()
+        self.remote = self._info()
+        self.embedding = bool(self.remote.get("embedding"))
+        self.predict(np.zeros((1,) + self.input_shape, dtype=self.input_dtype))
+        self.warmup_seconds = time.perf_counter() - start
+        self.warmed_up = bool(self.remote["warmed_up"])
+        return self.warmup_seconds
+
+    def prepare_fork(self):
+        self._local = threading.local()
+
+    def describe(self):
+        return {**self.remote, "backend": f"remote ({self.remote['backend']})", "socket": self.path}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Processus d'inference dedie")
+    parser.add_argument("--socket", default=os.environ.get("INFERENCE_SOCKET", DEFAULT_SOCKET))
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH"))
+    parser.add_argument("--backend", default=os.environ.get("MODEL_BACKEND", "auto"))
+    parser.add_argument("--max-batch-size", type=int, default=int(os.environ.get("BATCH_MAX_SIZE", "32")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.environ.get("BATCH_MAX_WAIT_MS", "5")))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("INFERENCE_THREADS", "0")))
+    parser.add_argument("--ring-slots", type=int, default=int(os.environ.get("RING_SLOTS", "128")),
+                        help="Cases de l'anneau en memoire partagee (0 = desactive)")
+    parser.add_argument("--registry", default=os.environ.get("MODEL_REGISTRY_DIR"),
+                        help="Registre de modeles versionnes (rechargement a chaud)")
+    parser.add_argument("--poll-seconds", type=float, default=float(os.environ.get("MODEL_POLL_SECONDS", "5")))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    from api.dataset import MODEL_PATH
+    from api.model_registry import ModelRegistry, ModelWatcher
+
+    def load(path):
+        backend = load_backend(
+            path,
+            kind=args.backend,
+            bucket_sizes=parse_buckets(os.environ.get("INFERENCE_BUCKETS")),
+            num_threads=args.threads or None,
+            cache_dir=os.environ.get("MODEL_CACHE_DIR")
+        )
+        backend.warmup()
+        return backend
+
+    registry = ModelRegistry(args.registry) if args.registry else None
+    version = registry.get(registry.current()) if registry is not None and registry.current() else None
+    server = InferenceServer(
+        load(version.model_path if version else args.model or MODEL_PATH), args.socket,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        ring_slots=args.ring_slots
+    )
+
+    if registry is not None:
+        def load_version(v):
+            backend = load(v.model_path)
+            server.check_compatible(backend)
+            return backend
+
+        ModelWatcher(
+            registry,
+            load=load_version,
+            activate=lambda backend, v: server.swap_backend(backend),
+            interval=args.poll_seconds,
+            active=version.name if version else None
+        ).start()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Registre de modeles versionnes et rechargement a chaud
+
+Arborescence (montee dans le conteneur avec ./modele) :
+
+    modele/registry/
+        CURRENT           <- nom de la version servie (une ligne)
+        PREVIOUS          <- version precedente, pour le retour arriere
+        v1/classification_type_riz.keras
+        v1/class_names.json
+        v2/classification_type_riz_int8.tflite
+        v2/class_names.json
+
+Changer de version = reecrire CURRENT (remplacement atomique). Chaque
+processus qui sert le modele sonde ce fichier : la nouvelle version est
+chargee et prechauffee dans un thread de fond pendant que l'ancienne
+continue de servir, puis la bascule se fait par simple changement de
+reference, entre deux lots d'inference.
+
+    python -m api.model_registry list
+    python -m api.model_registry publish modele/classification_type_riz_v2.keras --activate
+    python -m api.model_registry activate v1
+    python -m api.model_registry rollback
+"""
+import argparse
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from api.dataset import LABELS_PATH, MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = os.path.join(MODEL_DIR, "registry")
+MODEL_EXTENSIONS = (".keras", ".tflite", ".onnx")
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+class ModelVersion:
+    __slots__ = ("name", "model_path", "labels_path")
+
+    def __init__(self, name, model_path, labels_path):
+        self.name = name
+        self.model_path = model_path
+        self.labels_path = labels_path
+
+
+class ModelRegistry:
+    """Versions = sous-dossiers ; CURRENT designe la version active"""
+
+    def __init__(self, root=REGISTRY_DIR, extensions=MODEL_EXTENSIONS):
+        self.root = root
+        self.extensions = extensions
+        self.pointer_path = os.path.join(root, "CURRENT")
+        self.previous_path = os.path.join(root, "PREVIOUS")
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        names = [n for n in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, n))]
+        return sorted(names, key=_natural_key)
+
+    def _read(self, path):
+        try:
+            with open(path, "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, value):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(value + "\n")
+        os.replace(tmp, path)
+
+    def current(self):
+        """Version pointee par CURRENT, sinon la plus recente"""
+        name = self._read(self.pointer_path)
+        if name:
+            return name
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def get(self, name):
+        directory = os.path.join(self.root, name)
+        if not os.path.isdir(directory):
+            raise KeyError(f"Version inconnue: {name}")
+        candidates = sorted(
+            n for n in os.listdir(directory) if os.path.splitext(n)[1] in self.extensions
+        )
+        if not candidates:
+            raise FileNotFoundError(f"Aucun modele ({', '.join(self.extensions)}) dans {directory}")
+        # Un seul modele attendu par version ; sinon ordre de preference des extensions
+        candidates.sort(key=lambda n: self.extensions.index(os.path.splitext(n)[1]))
+        return ModelVersion(
+            name,
+            os.path.join(directory, candidates[0]),
+            os.path.join(directory, "class_names.json"),
+        )
+
+    def activate(self, name):
+        self.get(name)
+        current = self.current()
+        if current and current != name:
+            self._write(self.previous_path, current)
+        self._write(self.pointer_path, name)
+        logger.info(f"Version active: {name}")
+
+    def rollback(self):
+        previous = self._read(self.previous_path)
+        if not previous:
+            raise RuntimeError("Aucune version precedente enregistree")
+        self.activate(previous)
+        return previous
+
+    def publish(self, model_path, labels_path=LABELS_PATH, name=None):
+        """Copie un modele (+ labels) dans une nouvelle version"""
+        if name is None:
+            numbers = [int(n[1:]) for n in self.versions() if re.fullmatch(r"v\d+", n)]
+            name = f"v{max(numbers, default=0) + 1}"
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory)
+        shutil.copy2(model_path, os.path.join(directory, os.path.basename(model_path)))
+        shutil.copy2(labels_path, os.path.join(directory, "class_names.json"))
+        logger.info(f"Version {name} publiee depuis {model_path}")
+        return name
+
+
+class ModelWatcher:
+    """Sonde le registre et bascule vers la version pointee
+
+    load(version) charge et prechauffe (thread de fond, l'ancienne version
+    sert toujours) ; activate(loaded, version) fait la bascule. Un echec de
+    chargement laisse la version courante en place.
+    """
+
+    def __init__(self, registry, load, activate, interval=5.0, active=None):
+        self.registry = registry
+        self.load = load
+        self.activate = activate
+        self.interval = interval
+        self.active = active
+        self.loading = None
+        self.last_error = None
+        self.failed = None
+        self.switched_at = None
+        self.history = []
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Demarre la sonde dans ce processus (a rappeler apres un fork)"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Sonde du registre de modeles: {e}")
+
+    def check(self):
+        """Charge et active la version pointee si elle a change ; True si bascule"""
+        with self._lock:
+            name = self.registry.current()
+            if not name or name in (self.active, self.failed):
+                return False
+            version = self.registry.get(name)
+            self.loading = name
+            start = time.perf_counter()
+            try:
+                loaded = self.load(version)
+            except Exception as e:
+                self.last_error = f"{name}: {e}"
+                logger.error(f"Chargement de la version {name} impossible, "
+                             f"{self.active} reste active: {e}")
+                # Pas de nouvel essai tant que CURRENT ne change pas
+                self.failed = name
+                return False
+            finally:
+                self.loading = None
+            seconds = time.perf_counter() - start
+            self.activate(loaded, version)
+            previous, self.active = self.active, name
+            self.switched_at = time.time()
+            self.last_error = None
+            self.failed = None
+            self.history.append({"version": name, "ready_seconds": round(seconds, 3), "at": self.switched_at})
+            del self.history[:-10]
+            logger.info(f"✅ Bascule {previous} -> {name} (chargement + prechauffage {seconds:.2f}s)")
+            return True
+
+    def status(self):
+        return {
+            "active": self.active,
+            "pointer": self.registry.current(),
+            "loading": self.loading,
+            "last_error": self.last_error,
+            "switched_at": self.switched_at,
+            "versions": self.registry.versions(),
+            "history": list(self.history),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registre de modeles versionnes")
+    parser.add_argument("--root", default=os.environ.get("MODEL_REGISTRY_DIR", REGISTRY_DIR))
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    publish = sub.add_parser("publish")
+    publish.add_argument("model")
+    publish.add_argument("--labels", default=LABELS_PATH)
+    publish.add_argument("--name")
+    publish.add_argument("--activate", action="store_true")
+    activate = sub.add_parser("activate")
+    activate.add_argument("version")
+    sub.add_parser("rollback")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    registry = ModelRegistry(args.root)
+
+    if args.command == "list":
+        current = registry.current()
+        for name in registry.versions():
+            marker = "*" if name == current else " "
+            try:
+                path = os.path.basename(registry.get(name).model_path)
+            except (KeyError, FileNotFoundError) as e:
+                path = f"invalide ({e})"
+            print(f"{marker} {name:<10} {path}")
+    elif args.command == "publish":
+        name = registry.publish(args.model, args.labels, args.name)
+        if args.activate:
+            registry.activate(name)
+    elif args.command == "activate":
+        registry.activate(args.version)
+    else:
+        print(f"Retour a {registry.rollback()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Pretraitement rapide des images pour le modele
+
+- decodage JPEG en mode draft (mise a l'echelle DCT) quand la source est
+  bien plus grande que 224x224 : on ne decode pas la pleine resolution
+- redimensionnement bilineaire avec reducing_gap
+- normalisation directement en float32 (ou uint8 brut si le modele integre
+  la normalisation) dans un tampon fourni par l'appelant, sans copie float64
+- mesure du temps de chaque etape (timings en millisecondes)
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = (224, 224)
+RESAMPLE = Image.BILINEAR
+SCALE = np.float32(1.0 / 255.0)
+
+STAGES = ("open", "decode", "resize", "normalize")
+
+
+def _elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000.0
+
+
+def decode_image(image_content, size=IMG_SIZE, timings=None):
+    """bytes -> image PIL RGB de taille `size`"""
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(image_content))
+    if image.format == "JPEG":
+        # Le decodeur choisit la plus forte reduction 1/2, 1/4, 1/8 qui
+        # reste >= size : sans effet pour une image deja proche de 224x224
+        image.draft("RGB", size)
+    if timings is not None:
+        timings["open"] = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    image.load()
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if timings is not None:
+        timings["decode"] = _elapsed_ms(start)
+
+    start = time.perf_counter()
+    if image.size != size:
+        image = image.resize(size, RESAMPLE, reducing_gap=2.0)
+    if timings is not None:
+        timings["resize"] = _elapsed_ms(start)
+    return image
+
+
+def to_array(image, out, timings=None):
+    """Ecrit les pixels dans `out` (H, W, 3) : float32 normalise ou uint8 brut"""
+    start = time.perf_counter()
+    pixels = np.asarray(image)
+    if out.dtype == np.uint8:
+        out[...] = pixels
+    else:
+        np.multiply(pixels, SCALE, out=out, casting="unsafe")
+    if timings is not None:
+        timings["normalize"] = _elapsed_ms(start)
+    return out
+
+
+def preprocess_into(image_content, out, timings=None):
+    """Decode `image_content` directement dans une case d'un tampon de lot"""
+    image = decode_image(image_content, size=(out.shape[1], out.shape[0]), timings=timings)
+    return to_array(image, out, timings=timings)
+
+
+def preprocess_image(image_content, dtype=np.float32, timings=None):
+    """bytes -> tableau (1, 224, 224, 3) pret pour le modele"""
+    out = np.empty((1, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=dtype)
+    preprocess_into(image_content, out[0], timings=timings)
+    return out
+
+
+def new_batch_buffer(batch_size, dtype=np.float32, size=IMG_SIZE):
+    """Tampon de lot preallouee (n, H, W, 3)"""
+    return np.empty((batch_size, size[1], size[0], 3), dtype=dtype)
+
+
+def format_timings(timings):
+    """{'decode': 1.23, ...} -> 'decode=1.2ms ...' pour les logs"""
+    return " ".join(f"{name}={value:.1f}ms" for name, value in timings.items())
@@ -0,0 +1,224 @@
+"""Rejeu de trafic et generateur de charge pour /predict
+
+Sources :
+- un journal JSONL enregistre par l'API (TRAFFIC_LOG_PATH) ; les entrees
+  sans image sauvegardee sont remplacees par une image de dataset/, la
+  meme pour une meme empreinte (le taux de doublons, donc de cache, est
+  conserve)
+- ou un trafic synthetique tire de dataset/ (--duplicates pour simuler
+  des renvois d'images)
+
+Modes :
+- ferme (--concurrency N) : N clients envoient en boucle
+- ouvert (--rate R) : arrivees de Poisson a R req/s ; la latence est
+  comptee depuis l'heure d'arrivee prevue (file d'attente cote client
+  incluse), pour ne pas masquer la saturation
+- chronologique (--preserve-timing) : intervalles du journal, acceleres
+  par --speed
+
+    python -m api.replay --log logs/traffic.jsonl --rate 50 --duration 60
+    python -m api.replay --dataset dataset --concurrency 16 --requests 2000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from api.benchmark import summarize
+from api.dataset import DATASET_DIR, iter_labeled_images
+
+logger = logging.getLogger(__name__)
+
+# Images du dataset gardees en memoire pour le trafic synthetique
+POOL_PER_CLASS = 200
+
+
+class Item:
+    __slots__ = ("name", "content", "ts")
+
+    def __init__(self, name, content, ts=None):
+        self.name = name
+        self.content = content
+        self.ts = ts
+
+
+def _dataset_pool(dataset_dir, per_class=POOL_PER_CLASS):
+    pool = []
+    for path, _ in iter_labeled_images(dataset_dir, per_class=per_class):
+        with open(path, "rb") as f:
+            pool.append(Item(os.path.basename(path), f.read()))
+    if not pool:
+        raise SystemExit(f"Aucune image dans {dataset_dir}")
+    return pool
+
+
+def load_log(log_path, dataset_dir):
+    """Entrees du journal -> images a envoyer (dans l'ordre du journal)"""
+    base = os.path.dirname(os.path.abspath(log_path))
+    pool = None
+    substitutes = {}
+    items = []
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            image = entry.get("image")
+            if image and os.path.exists(os.path.join(base, image)):
+                with open(os.path.join(base, image), "rb") as img:
+                    items.append(Item(entry.get("filename") or image, img.read(), entry.get("ts")))
+                continue
+            if pool is None:
+                pool = _dataset_pool(dataset_dir)
+            digest = entry.get("sha256")
+            if digest not in substitutes:
+                substitutes[digest] = random.choice(pool)
+            substitute = substitutes[digest]
+            items.append(Item(substitute.name, substitute.content, entry.get("ts")))
+    return items
+
+
+def synthesize(dataset_dir, count, duplicates=0.0):
+    """Trafic synthetique : images du dataset, avec une part de renvois"""
+    pool = _dataset_pool(dataset_dir)
+    items = []
+    for _ in range(count):
+        if items and random.random() < duplicates:
+            items.append(random.choice(items))
+        else:
+            items.append(random.choice(pool))
+    return items
+
+
+class LoadGenerator:
+    def __init__(self, url, timeout=30.0):
+        self.url = url.rstrip("/") + "/predict"
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.statuses = Counter()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, item, scheduled=None):
+        start = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            response = self._session().post(
+                self.url, files={"file": (item.name, item.content)}, timeout=self.timeout
+            )
+            status = str(response.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.latencies.append(latency)
+            self.statuses[status] += 1
+
+    def run_closed(self, items, concurrency, duration=None):
+        """N clients en boucle fermee"""
+        position = iter(range(len(items)))
+        deadline = time.perf_counter() + duration if duration else None
+        lock = threading.Lock()
+
+        def client():
+            while deadline is None or time.perf_counter() < deadline:
+                with lock:
+                    index = next(position, None)
+                if index is None:
+                    return
+                self.send(items[index])
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self, items, rate=None, speed=1.0, duration=None, max_in_flight=1000):
+        """Arrivees planifiees (Poisson a `rate`, ou horodatages du journal)"""
+        start = time.perf_counter()
+        first_ts = items[0].ts if items and items[0].ts is not None else None
+        offset = 0.0
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for item in items:
+                if rate:
+                    offset += random.expovariate(rate)
+                elif first_ts is not None and item.ts is not None:
+                    offset = (item.ts - first_ts) / speed
+                if duration and offset > duration:
+                    break
+                scheduled = start + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.send, item, scheduled)
+
+    def report(self, elapsed):
+        total = sum(self.statuses.values())
+        errors = total - self.statuses.get("200", 0)
+        summary = summarize(self.latencies) if self.latencies else {}
+        summary.pop("images_per_second", None)
+        return {
+            "requests": total,
+            "duration_seconds": round(elapsed, 2),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "latency": {**summary, "max_ms": round(max(self.latencies) * 1000, 3) if self.latencies else None},
+            "error_rate": round(errors / total, 4) if total else None,
+            "statuses": dict(self.statuses),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rejeu de trafic / test de charge de /predict")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--log", help="Journal JSONL enregistre par l'API")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--requests", type=int, default=1000, help="Requetes synthetiques")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Part de renvois (synthetique)")
+    parser.add_argument("--concurrency", type=int, help="Mode ferme : nombre de clients")
+    parser.add_argument("--rate", type=float, help="Mode ouvert : requetes par seconde")
+    parser.add_argument("--preserve-timing", action="store_true", help="Rejouer les intervalles du journal")
+    parser.add_argument("--speed", type=float, default=1.0, help="Acceleration du rejeu chronologique")
+    parser.add_argument("--duration", type=float, help="Duree maximale (s)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Fichier JSON du rapport")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    random.seed(args.seed)
+
+    if args.log:
+        items = load_log(args.log, args.dataset)
+    else:
+        items = synthesize(args.dataset, args.requests, args.duplicates)
+    logger.info(f"{len(items)} requetes a envoyer vers {args.url}")
+
+    generator = LoadGenerator(args.url, timeout=args.timeout)
+    start = time.perf_counter()
+    if args.rate or args.preserve_timing:
+        generator.run_open(items, rate=args.rate, speed=args.speed, duration=args.duration)
+    else:
+        generator.run_closed(items, args.concurrency or 8, duration=args.duration)
+    report = generator.report(time.perf_counter() - start)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
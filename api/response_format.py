@@ -0,0 +1,154 @@
+"""Formats de reponse de /predict et /predict/batch
+
+Parametres (query string ou champs du formulaire) :
+- top_k : nombre de classes du classement `top_predictions` (0 = aucun
+  classement). Sans top_k (ou avec 3), la reponse garde sa forme historique :
+  les 3 meilleures classes sous `top_3_predictions`, sans `top_predictions`
+- include_probs : 0 pour omettre la distribution complete
+
+Negociation par l'en-tete Accept :
+- application/json (defaut, utilise par l'interface Streamlit)
+- application/msgpack : le meme contenu en MessagePack (paquet `msgpack`) ;
+  /predict/batch renvoie un flux d'objets MessagePack concatenes
+- application/x-float32 : sortie softmax brute, float32 little-endian ;
+  l'ordre des classes est donne par l'en-tete X-Classes. Pour /predict/batch,
+  un enregistrement par image : index int32 puis les probabilites
+  (NaN si l'image n'a pas pu etre classee)
+"""
+import json
+import struct
+
+import numpy as np
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FLOAT32 = "application/x-float32"
+
+_ALIASES = {
+    "application/json": JSON,
+    "application/x-ndjson": JSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/x-float32": FLOAT32,
+    "application/octet-stream": FLOAT32,
+}
+
+DEFAULT_TOP_K = 3
+_INDEX = struct.Struct("<i")
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def available():
+    return [JSON, FLOAT32] + ([MSGPACK] if _msgpack() is not None else [])
+
+
+def negotiate(accept):
+    """En-tete Accept -> format servi, JSON par defaut ; None si rien d'acceptable"""
+    if not accept:
+        return JSON
+    offered = available()
+    ranked = []
+    for position, part in enumerate(accept.split(",")):
+        fields = part.strip().split(";")
+        media = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranked.append((-quality, position, media))
+    for _, _, media in sorted(ranked):
+        if media in ("*/*", "application/*"):
+            return JSON
+        fmt = _ALIASES.get(media)
+        if fmt in offered:
+            return fmt
+    return None
+
+
+def parse_top_k(value, num_classes):
+    """top_k borne a [0, nombre de classes] ; None pour le classement par defaut
+
+    (absent ou egal a DEFAULT_TOP_K : forme historique) ; ValueError si invalide
+    """
+    if value in (None, ""):
+        return None
+    k = int(value)
+    if k < 0:
+        raise ValueError("top_k doit etre positif")
+    if k == DEFAULT_TOP_K:
+        return None
+    return min(k, num_classes)
+
+
+def parse_flag(value, default=True):
+    if value in (None, ""):
+        return default
+    return str(value).lower() not in ("0", "false", "no", "non")
+
+
+def top_k_indices(probs, k):
+    """Indices des k plus grandes probabilites, par ordre decroissant (sans tri complet)"""
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(probs):
+        top = np.argpartition(-probs, k - 1)[:k]
+    else:
+        top = np.arange(len(probs))
+    return top[np.argsort(-probs[top], kind="stable")]
+
+
+def prediction_payload(probs, class_names, top_k=None, include_probs=True):
+    """Reponse JSON/MessagePack pour la sortie softmax d'une image
+
+    top_k=None : forme historique (top_3_predictions), sinon top_predictions
+    """
+    probs = np.asarray(probs, dtype=np.float32)
+    size = DEFAULT_TOP_K if top_k is None else top_k
+    top = top_k_indices(probs, max(size, 1))
+    best = int(top[0])
+    result = {
+        "predicted_class": class_names[best],
+        "confidence": float(probs[best])
+    }
+    if size:
+        ranking = [{"class": class_names[int(i)], "confidence": float(probs[i])} for i in top[:size]]
+        # Cle historique par defaut : les clients existants (interface Streamlit) la lisent
+        result["top_3_predictions" if top_k is None else "top_predictions"] = ranking
+    if include_probs:
+        result["all_probabilities"] = {class_names[i]: value for i, value in enumerate(probs.tolist())}
+    return result
+
+
+def class_header(class_names):
+    """Ordre des classes pour le format float32 (en-tete X-Classes)"""
+    return ",".join(class_names[i] for i in range(len(class_names)))
+
+
+def encode(fmt, payload):
+    """Contenu JSON/MessagePack d'une reponse (dict)"""
+    if fmt == MSGPACK:
+        return _msgpack().packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def float32_bytes(probs):
+    return np.asarray(probs, dtype="<f4").tobytes()
+
+
+def float32_record(index, probs=None, num_classes=None):
+    """Enregistrement de /predict/batch : index int32 + probabilites (NaN si absentes)"""
+    if probs is None:
+        probs = np.full(num_classes, np.nan, dtype="<f4")
+    return _INDEX.pack(index) + float32_bytes(probs)
@@ -0,0 +1,150 @@
+"""Segmentation des grains d'une photo de plateau (mode multi-grains)
+
+Les images du dataset montrent un grain isole sur fond noir. Sur une photo
+de plateau, on separe le fond par un seuil d'Otsu (fond sombre ou clair,
+detecte sur les bords), on etiquette les composantes connexes, puis chaque
+grain est recadre comme dans le dataset : pixels hors du grain mis a noir,
+grain centre dans un carre avec une marge, redimensionne en 224x224.
+
+La segmentation se fait sur une copie reduite (max_side) ; les recadrages
+sont pris dans l'image pleine resolution. Deux grains qui se touchent
+forment une seule composante : elle est signalee (possibly_merged) quand
+son aire depasse nettement l'aire mediane.
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+from api.preprocessing import RESAMPLE, to_array
+
+MAX_SIDE = 1600
+# Marge autour du grain, en fraction de son plus grand cote
+MARGIN = 0.2
+# Composantes plus petites que cette fraction de l'aire mediane : poussieres
+MIN_AREA_FRACTION = 0.2
+MIN_AREA_PIXELS = 20
+MERGED_AREA_FACTOR = 1.8
+
+
+class Grain:
+    __slots__ = ("label", "slices", "box", "area", "possibly_merged")
+
+    def __init__(self, label, slices, box, area):
+        self.label = label
+        self.slices = slices
+        self.box = box
+        self.area = area
+        self.possibly_merged = False
+
+
+def otsu_threshold(gray):
+    """Seuil maximisant la variance inter-classes d'une image uint8"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(variance))
+
+
+def foreground_mask(gray, background="auto"):
+    """Masque des grains ; fond 'dark', 'light' ou 'auto' (selon les bords)"""
+    threshold = otsu_threshold(gray)
+    if background == "auto":
+        border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+        background = "light" if np.median(border) > threshold else "dark"
+    # Otsu : niveaux <= seuil d'un cote, > seuil de l'autre
+    mask = gray <= threshold if background == "light" else gray > threshold
+    mask = ndimage.binary_opening(mask, iterations=1)
+    return ndimage.binary_fill_holes(mask)
+
+
+class Segmentation:
+    """Grains d'une photo : etiquettes sur la copie reduite + image pleine"""
+
+    def __init__(self, image, max_side=MAX_SIDE, background="auto"):
+        self.image = image
+        small = image
+        if max(image.size) > max_side:
+            small = image.copy()
+            small.thumbnail((max_side, max_side), RESAMPLE)
+        self.scale = small.width / image.width
+
+        gray = np.asarray(small.convert("L"))
+        self.labels, count = ndimage.label(foreground_mask(gray, background))
+        areas = ndimage.sum_labels(np.ones_like(gray), self.labels, index=np.arange(1, count + 1))
+        slices = ndimage.find_objects(self.labels)
+
+        median = float(np.median(areas)) if count else 0.0
+        min_area = max(MIN_AREA_PIXELS, MIN_AREA_FRACTION * median)
+        self.grains = []
+        for label, (area, sl) in enumerate(zip(areas, slices), 1):
+            if sl is None or area < min_area:
+                continue
+            box = [
+                int(sl[1].start / self.scale), int(sl[0].start / self.scale),
+                min(image.width, int(np.ceil(sl[1].stop / self.scale))),
+                min(image.height, int(np.ceil(sl[0].stop / self.scale))),
+            ]
+            grain = Grain(label, sl, box, int(round(area / self.scale ** 2)))
+            grain.possibly_merged = area > MERGED_AREA_FACTOR * median
+            self.grains.append(grain)
+
+    def __len__(self):
+        return len(self.grains)
+
+    def crop_into(self, grain, out, margin=MARGIN):
+        """Ecrit le grain, isole sur fond noir et centre, dans `out` (H, W, 3)"""
+        x0, y0, x1, y1 = grain.box
+        width, height = x1 - x0, y1 - y0
+        pixels = np.asarray(self.image.crop((x0, y0, x1, y1)))
+
+        # Masque de la composante, dilate d'un pixel puis agrandi a la pleine resolution
+        mask = ndimage.binary_dilation(self.labels[grain.slices] == grain.label)
+        mask = Image.fromarray(mask.astype(np.uint8) * 255).resize((width, height), Image.NEAREST)
+        pixels = pixels * (np.asarray(mask) > 0)[..., None]
+
+        side = int(max(width, height) * (1 + 2 * margin))
+        canvas = np.zeros((side, side, 3), dtype=np.uint8)
+        top, left = (side - height) // 2, (side - width) // 2
+        canvas[top:top + height, left:left + width] = pixels
+        size = (out.shape[1], out.shape[0])
+        return to_array(Image.fromarray(canvas).resize(size, RESAMPLE, reducing_gap=2.0), out)
+
+
+def open_image(content):
+    image = Image.open(io.BytesIO(content))
+    image.load()
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+def segment(content, max_side=MAX_SIDE, background="auto", timings=None):
+    """bytes -> Segmentation (timings en millisecondes)"""
+    start = time.perf_counter()
+    image = open_image(content)
+    if timings is not None:
+        timings["decode"] = (time.perf_counter() - start) * 1000.0
+    start = time.perf_counter()
+    segmentation = Segmentation(image, max_side=max_side, background=background)
+    if timings is not None:
+        timings["segment"] = (time.perf_counter() - start) * 1000.0
+    return segmentation
+
+
+def composition(classes, class_names):
+    """Comptes et proportions par classe"""
+    counts = {name: 0 for name in class_names}
+    for name in classes:
+        counts[name] += 1
+    total = len(classes)
+    return {
+        "counts": counts,
+        "proportions": {name: (n / total if total else 0.0) for name, n in counts.items()},
+    }
+
@@ -0,0 +1,124 @@
+"""Comparaison memoire / demarrage a froid des modes gunicorn (SERVE_MODE)
+
+Pour chaque mode, lance gunicorn, mesure le temps jusqu'au premier
+/health en 200 puis la memoire de tous les processus (maitre, workers,
+serveur d'inference). Le PSS repartit les pages partagees entre les
+processus : c'est la bonne mesure de la memoire reellement consommee
+avec le copy-on-write. Linux uniquement (/proc).
+
+    python -m api.serving_report --modes workers preload inference-server
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+MODES = ("workers", "preload", "inference-server")
+
+
+def _children(pid):
+    """Descendants d'un processus (d'apres /proc/<pid>/stat)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    result, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        result.append(current)
+        stack.extend(parents.get(current, []))
+    return result
+
+
+def _memory_kb(pid):
+    """RSS et PSS d'un processus en Ko"""
+    values = {"Rss": 0, "Pss": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key = line.split(":")[0]
+                if key in values:
+                    values[key] = int(line.split()[1])
+    except OSError:
+        pass
+    return values["Rss"], values["Pss"]
+
+
+def _wait_ready(url, timeout, process):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            # gunicorn arrete (ex. preload refuse avec le backend keras)
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def measure(mode, workers, port, timeout):
+    env = dict(os.environ, SERVE_MODE=mode, WORKERS=str(workers), BIND=f"127.0.0.1:{port}")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "api.app_prod:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        ready = _wait_ready(f"http://127.0.0.1:{port}/health", timeout, process)
+        cold_start = time.perf_counter() - start
+        # Laisser tous les workers finir leur chargement
+        time.sleep(2)
+        pids = _children(process.pid)
+        rss, pss = zip(*(_memory_kb(pid) for pid in pids))
+        return {
+            "mode": mode,
+            "ready": ready,
+            "cold_start_seconds": round(cold_start, 2),
+            "processes": len(pids),
+            "rss_mb": round(sum(rss) / 1024, 1),
+            "pss_mb": round(sum(pss) / 1024, 1),
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare les modes de service gunicorn")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="Fichier JSON de resultats")
+    args = parser.parse_args(argv)
+
+    results = [measure(mode, args.workers, args.port, args.timeout) for mode in args.modes]
+
+    print(f"{'Mode':<18}{'Pret':>6}{'Demarrage (s)':>15}{'Proc.':>7}{'RSS (Mo)':>10}{'PSS (Mo)':>10}")
+    for r in results:
+        print(f"{r['mode']:<18}{str(r['ready']):>6}{r['cold_start_seconds']:>15}"
+              f"{r['processes']:>7}{r['rss_mb']:>10}{r['pss_mb']:>10}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
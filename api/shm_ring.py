@@ -0,0 +1,144 @@
+"""Anneau de cases preallouees en memoire partagee (workers HTTP -> inference)
+
+Le processus d'inference cree un segment partage de N cases 224x224x3.
+Un worker HTTP reserve n cases consecutives, y decode directement les
+pixels, puis n'envoie que l'indice de la premiere case : aucun tableau
+n'est serialise. Le serveur lit les cases comme un tenseur (n, H, W, C)
+contigu, sans copie.
+
+Reservation : tete de lecture partagee protegee par un verrou fichier
+(flock, entre processus) et un verrou de thread (flock ne distingue pas
+les threads d'un meme processus). Chaque case porte un etat : libre ou
+occupee ; le worker la libere apres avoir recu la reponse.
+"""
+import fcntl
+import os
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+FREE = 0
+BUSY = 1
+
+_HEADER_ALIGN = 64
+
+
+def _header_size(n_slots):
+    # etats des cases + tete (int64), aligne pour les donnees
+    size = n_slots + 8
+    return (size + _HEADER_ALIGN - 1) // _HEADER_ALIGN * _HEADER_ALIGN
+
+
+class SlotRing:
+    """Cases (n_slots, H, W, C) dans un segment de memoire partagee"""
+
+    def __init__(self, shm, n_slots, slot_shape, dtype, owner=False):
+        self._shm = shm
+        self.name = shm.name
+        self.n_slots = n_slots
+        self.slot_shape = tuple(slot_shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+
+        header = _header_size(n_slots)
+        head_offset = header - 8
+        self.states = np.ndarray((n_slots,), dtype=np.uint8, buffer=shm.buf, offset=0)
+        self._head = np.ndarray((1,), dtype=np.int64, buffer=shm.buf, offset=head_offset)
+        self.slots = np.ndarray(
+            (n_slots,) + self.slot_shape, dtype=self.dtype, buffer=shm.buf, offset=header
+        )
+        self._base = self.slots.__array_interface__["data"][0]
+        self.slot_nbytes = self.slots[0].nbytes
+
+        self.lock_path = os.path.join("/tmp", f"{self.name.lstrip('/')}.lock")
+        self._thread_lock = threading.Lock()
+        self._lock_file = None
+        self._lock_pid = None
+
+    @classmethod
+    def create(cls, n_slots=128, slot_shape=(224, 224, 3), dtype=np.float32, name=None):
+        dtype = np.dtype(dtype)
+        size = _header_size(n_slots) + n_slots * int(np.prod(slot_shape)) * dtype.itemsize
+        shm = SharedMemory(name=name, create=True, size=size)
+        ring = cls(shm, n_slots, slot_shape, dtype, owner=True)
+        ring.states[:] = FREE
+        ring._head[0] = 0
+        open(ring.lock_path, "a").close()
+        return ring
+
+    @classmethod
+    def attach(cls, name, n_slots, slot_shape, dtype):
+        shm = SharedMemory(name=name)
+        # Sans cela, le resource_tracker du worker detruirait le segment a sa sortie
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return cls(shm, n_slots, slot_shape, dtype)
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "slots": self.n_slots,
+            "slot_shape": list(self.slot_shape),
+            "dtype": self.dtype.name,
+        }
+
+    def _file_lock(self):
+        # Descripteur rouvert apres un fork : flock est lie a la description de fichier
+        if self._lock_file is None or self._lock_pid != os.getpid():
+            self._lock_file = open(self.lock_path, "a")
+            self._lock_pid = os.getpid()
+        return self._lock_file
+
+    def acquire(self, n):
+        """Reserve n cases consecutives -> indice de depart, ou None si plein"""
+        if n > self.n_slots:
+            return None
+        with self._thread_lock:
+            lock_file = self._file_lock()
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                start = int(self._head[0])
+                if start + n > self.n_slots:
+                    # Le lot doit rester contigu : on repart au debut
+                    start = 0
+                if self.states[start:start + n].any():
+                    return None
+                self.states[start:start + n] = BUSY
+                self._head[0] = (start + n) % self.n_slots
+                return start
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def release(self, start, n):
+        self.states[start:start + n] = FREE
+
+    def view(self, start, n):
+        """Tenseur (n, H, W, C) sur les cases, sans copie"""
+        return self.slots[start:start + n]
+
+    def locate(self, array):
+        """Indice de la premiere case si `array` est une vue de l'anneau, sinon None"""
+        if not isinstance(array, np.ndarray) or array.dtype != self.dtype:
+            return None
+        offset = array.__array_interface__["data"][0] - self._base
+        if offset < 0 or offset % self.slot_nbytes:
+            return None
+        start = offset // self.slot_nbytes
+        return start if start < self.n_slots else None
+
+    def close(self):
+        self.states = self._head = self.slots = None
+        self._shm.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+    def unlink(self):
+        self._shm.unlink()
+        try:
+            os.unlink(self.lock_path)
+        except OSError:
+            pass
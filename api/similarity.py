@@ -0,0 +1,301 @@
+"""Recherche des grains de reference les plus proches (/similar)
+
+L'embedding d'une image est la sortie de l'avant-derniere couche du
+modele (Dense(128) de la tete), normalisee L2 : le score est le cosinus.
+
+L'index est construit hors ligne a partir du magasin d'embeddings
+(api.embeddings) : les vecteurs du backbone deja calcules passent dans les
+couches de la tete jusqu'a l'avant-derniere, sans relire les images.
+
+    python -m api.similarity build
+
+Fichiers produits (modele/similarity/) :
+- vectors.npy : (n, d) float32, ouvert en memmap par l'API ; les pages
+  sont partagees entre workers par le cache du systeme
+- meta.json : chemins relatifs a dataset/ et labels, dans l'ordre des lignes
+- centroids.npy : seulement pour la recherche approchee (IVF). Les vecteurs
+  sont alors ranges par liste ; une requete ne compare que les `nprobe`
+  listes les plus proches au lieu de tout l'index.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from api.dataset import DATASET_DIR, MODEL_DIR, MODEL_PATH
+from api.embeddings import STORE_DIR, EmbeddingStore, extract, load_backbone
+from api.preprocessing import SCALE, preprocess_image
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.path.join(MODEL_DIR, "similarity")
+
+# Au-dela, l'index est partitionne (IVF) pour une recherche approchee
+IVF_MIN_SIZE = 20000
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def head_layers(model):
+    """Couches entre le GlobalAveragePooling2D et l'avant-derniere couche
+
+    Les Dropout sont ignores (identite a l'inference).
+    """
+    import tensorflow as tf
+
+    layers = model.layers
+    start = None
+    for i, layer in enumerate(layers):
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            start = i + 1
+    if start is None:
+        raise ValueError("Pas de GlobalAveragePooling2D dans le modele")
+    return [l for l in layers[start:-1] if not isinstance(l, tf.keras.layers.Dropout)]
+
+
+def penultimate_output(model):
+    """Sortie de l'avant-derniere couche utile (avant la couche softmax)"""
+    layers = head_layers(model)
+    if not layers:
+        raise ValueError("Le modele n'a pas de couche entre le pooling et la sortie")
+    return layers[-1].output
+
+
+# ---------------------------------------------------------------------------
+# Index
+# ---------------------------------------------------------------------------
+
+def spherical_kmeans(vectors, num_lists, iterations=20, seed=0):
+    """Centroides normalises (k-means sur le cosinus)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for j in range(num_lists):
+            members = vectors[assignment == j]
+            if len(members):
+                centroids[j] = members.sum(axis=0)
+            else:
+                # Liste vide : on la relance sur un point au hasard
+                centroids[j] = vectors[rng.integers(len(vectors))]
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def write_index(directory, vectors, paths, labels, num_lists=0):
+    """Ecrit vectors.npy / meta.json (et centroids.npy en mode IVF)"""
+    os.makedirs(directory, exist_ok=True)
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    meta = {"dim": int(vectors.shape[1]), "count": len(paths), "ivf": None}
+
+    if num_lists:
+        centroids, assignment = spherical_kmeans(vectors, num_lists)
+        order = np.argsort(assignment, kind="stable")
+        vectors, assignment = vectors[order], assignment[order]
+        paths = [paths[i] for i in order]
+        labels = [labels[i] for i in order]
+        counts = np.bincount(assignment, minlength=num_lists)
+        meta["ivf"] = {"lists": int(num_lists), "offsets": np.concatenate([[0], np.cumsum(counts)]).tolist()}
+        np.save(os.path.join(directory, "centroids.npy"), centroids)
+
+    meta["paths"] = paths
+    meta["labels"] = labels
+    np.save(os.path.join(directory, "vectors.npy"), vectors)
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+class SimilarityIndex:
+    """Index en lecture seule, vecteurs en memmap"""
+
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.paths = meta["paths"]
+        self.labels = meta["labels"]
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.ivf = meta.get("ivf")
+        self.centroids = np.load(os.path.join(directory, "centroids.npy")) if self.ivf else None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _candidates(self, query, nprobe):
+        """Lignes a comparer : tout l'index, ou les listes IVF les plus proches"""
+        if self.ivf is None or nprobe >= self.ivf["lists"]:
+            return None
+        # nprobe <= 0 : au moins la liste la plus proche
+        nprobe = max(1, int(nprobe))
+        offsets = self.ivf["offsets"]
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([np.arange(offsets[p], offsets[p + 1]) for p in probes])
+
+    def search(self, query, k=5, nprobe=8):
+        """Embedding (d,) -> [(ligne, score)] par score decroissant"""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        rows = self._candidates(query, nprobe)
+        scores = self.vectors @ query if rows is None else self.vectors[rows] @ query
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def neighbors(self, query, k=5, nprobe=8):
+        return [
+            {"path": self.paths[row], "label": self.labels[row], "similarity": round(score, 6)}
+            for row, score in self.search(query, k, nprobe)
+        ]
+
+    def describe(self):
+        return {
+            "size": len(self),
+            "dim": self.dim,
+            "approximate": self.ivf is not None,
+            "lists": self.ivf["lists"] if self.ivf else None,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Service : index + sous-modele d'embedding
+# ---------------------------------------------------------------------------
+
+class SimilaritySearch:
+    """Embedding d'une image pretraitee et recherche de ses voisins
+
+    L'API prend l'embedding dans la passe du backend actif quand il sait le
+    produire (keras, remote : predict_with_embedding). Le sous-modele
+    (entree -> avant-derniere couche) charge depuis model_path ne sert
+    qu'aux autres backends (tflite, onnx) ; il est cree au premier appel,
+    donc dans le worker apres le fork.
+    """
+
+    def __init__(self, index, model_path=MODEL_PATH, nprobe=8):
+        self.index = index
+        self.model_path = model_path
+        self.nprobe = nprobe
+        self._predictor = None
+        self._lock = threading.Lock()
+
+    def _get_predictor(self):
+        if self._predictor is None:
+            with self._lock:
+                if self._predictor is None:
+                    import tensorflow as tf
+                    from api.inference import CompiledPredictor
+
+                    logger.info(f"Chargement du modele d'embedding: {self.model_path}")
+                    model = tf.keras.models.load_model(self.model_path)
+                    embedder = tf.keras.Model(model.input, penultimate_output(model))
+                    predictor = CompiledPredictor(embedder, bucket_sizes=(1,))
+                    predictor.warmup()
+                    self._predictor = predictor
+        return self._predictor
+
+    def reset(self):
+        """Oublie le sous-modele : il sera recharge depuis model_path au prochain appel"""
+        with self._lock:
+            self._predictor = None
+
+    def embed(self, batch):
+        """Lot pretraite (n, H, W, C) -> embeddings (n, d)"""
+        batch = np.asarray(batch)
+        if batch.dtype == np.uint8:
+            # Pixels bruts (backend a normalisation integree)
+            batch = np.multiply(batch, SCALE, dtype=np.float32)
+        return self._get_predictor().predict(batch)
+
+    def neighbors(self, embedding, k=5):
+        return self.index.neighbors(embedding, k, self.nprobe)
+
+    def search(self, batch, k=5):
+        return self.neighbors(self.embed(batch)[0], k)
+
+
+def load_search(directory=INDEX_DIR, **kwargs):
+    """SimilaritySearch si l'index a ete construit, sinon None"""
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+    start = time.perf_counter()
+    index = SimilarityIndex(directory)
+    logger.info(f"Index de similarite charge: {len(index)} images "
+                f"({time.perf_counter() - start:.3f}s)")
+    return SimilaritySearch(index, **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# Construction hors ligne
+# ---------------------------------------------------------------------------
+
+def build(model_path, dataset_dir, store_dir, output_dir, num_lists=None, batch_size=64):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    store = EmbeddingStore(store_dir)
+    extract(store, load_backbone(model_path), dataset_dir, batch_size=batch_size)
+
+    paths = sorted(store.entries)
+    rows = np.array([store.entries[p]["row"] for p in paths], dtype=np.int64)
+    labels = [store.entries[p]["label"] for p in paths]
+    x = np.asarray(store.array[rows], dtype=np.float32)
+    for layer in head_layers(model):
+        x = np.asarray(layer(x))
+
+    if num_lists is None:
+        num_lists = int(round(np.sqrt(len(paths)))) if len(paths) >= IVF_MIN_SIZE else 0
+    meta = write_index(output_dir, x, paths, labels, num_lists=num_lists)
+    logger.info(f"✅ Index ecrit dans {output_dir}: {meta['count']} images, dim {meta['dim']}"
+                + (f", {num_lists} listes IVF" if num_lists else ""))
+    return meta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index de similarite des grains de reference")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build")
+    p.add_argument("--model", default=MODEL_PATH)
+    p.add_argument("--dataset", default=DATASET_DIR)
+    p.add_argument("--store", default=STORE_DIR)
+    p.add_argument("--output", default=INDEX_DIR)
+    p.add_argument("--ivf-lists", type=int,
+                   help=f"Listes IVF (0 = recherche exacte ; defaut: auto au-dela de {IVF_MIN_SIZE} images)")
+    p.add_argument("--batch-size", type=int, default=64)
+
+    q = sub.add_parser("query", help="Voisins d'une image (verification de l'index)")
+    q.add_argument("image")
+    q.add_argument("--model", default=MODEL_PATH)
+    q.add_argument("--index", default=INDEX_DIR)
+    q.add_argument("-k", type=int, default=5)
+    q.add_argument("--nprobe", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command == "build":
+        build(args.model, args.dataset, args.store, args.output,
+              num_lists=args.ivf_lists, batch_size=args.batch_size)
+        return
+
+    search = load_search(args.index, model_path=args.model, nprobe=args.nprobe)
+    if search is None:
+        raise SystemExit(f"Index absent: {args.index} (lancer `python -m api.similarity build`)")
+    with open(args.image, "rb") as f:
+        print(json.dumps(search.search(preprocess_image(f.read()), args.k), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
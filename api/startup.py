@@ -0,0 +1,108 @@
+"""Demarrage rapide : chargement du modele en arriere-plan
+
+Le serveur HTTP ecoute des l'import de l'application : / et la sonde de
+vivacite (/health/live) repondent tout de suite, pendant qu'un thread
+importe le runtime (TensorFlow, ONNX Runtime, TFLite), charge le modele et
+le prechauffe. La sonde de disponibilite (/health/ready) ne passe a 200
+qu'une fois l'inference prete.
+
+Chaque phase est chronometree et journalisee ; describe() les expose pour
+/health/live, /health/ready et /info.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Module lourd importe par chaque backend avant le chargement du modele
+RUNTIME_MODULES = {
+    "keras": ("tensorflow",),
+    "onnx": ("onnxruntime",),
+    "tflite": ("ai_edge_litert.interpreter", "tflite_runtime.interpreter", "tensorflow"),
+}
+
+STARTING, LOADING, READY, FAILED = "starting", "loading", "ready", "failed"
+
+
+def import_runtime(kind):
+    """Importe le runtime du backend (le premier disponible) -> nom du module"""
+    candidates = RUNTIME_MODULES.get(kind, ())
+    for name in candidates:
+        try:
+            importlib.import_module(name)
+            return name
+        except ImportError:
+            continue
+    if candidates:
+        raise ImportError(f"Aucun runtime disponible pour le backend {kind}: {', '.join(candidates)}")
+    return None
+
+
+class Startup:
+    """Etat du demarrage de ce processus et duree de chaque phase"""
+
+    def __init__(self):
+        self.state = STARTING
+        self.error = None
+        self.phases = {}
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.ready_seconds = None
+        self._thread = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Phase chronometree ailleurs (ex. load_seconds du backend)"""
+        if seconds is None:
+            return
+        self.phases[name] = round(seconds, 3)
+        logger.info(f"⏱️ Démarrage - {name}: {seconds:.2f}s")
+
+    def run(self, load):
+        """load() -> vrai si l'inference est prete ; appel bloquant"""
+        self.state = LOADING
+        try:
+            ok = load()
+        except Exception as e:
+            ok = False
+            self.error = str(e)
+            logger.error(f"Échec du démarrage: {e}")
+        if not ok:
+            self.state = FAILED
+            return False
+        self.ready_seconds = time.perf_counter() - self._start
+        self.state = READY
+        logger.info(f"✅ Prêt en {self.ready_seconds:.2f}s (pid {os.getpid()}, phases: "
+                    + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()) + ")")
+        return True
+
+    def run_in_background(self, load):
+        """Lance run(load) dans un thread : l'appelant (le serveur HTTP) n'attend pas"""
+        self._thread = threading.Thread(target=self.run, args=(load,), name="model-startup", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def describe(self):
+        return {
+            "state": self.state,
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.perf_counter() - self._start, 3),
+            "ready_seconds": round(self.ready_seconds, 3) if self.ready_seconds is not None else None,
+            "phases_seconds": dict(self.phases),
+            "error": self.error,
+        }
@@ -0,0 +1,87 @@
+"""Enregistrement optionnel et echantillonne du trafic /predict (JSONL)
+
+Chaque requete retenue ajoute une ligne au journal : horodatage, empreinte
+SHA-256, taille, nom de fichier, statut, latence et classe predite ; si
+demande, l'image elle-meme est copiee (une fois par empreinte) dans un
+dossier. Le journal alimente api.replay pour rejouer un trafic realiste.
+
+L'ecriture se fait dans un thread separe : le disque n'ajoute rien a la
+latence des requetes.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficRecorder:
+    def __init__(self, path, sample_rate=1.0, image_dir=None, max_pending=10000):
+        self.path = path
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.image_dir = image_dir
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if image_dir:
+            os.makedirs(image_dir, exist_ok=True)
+
+    def sampled(self):
+        """Tirage de l'echantillonnage, a faire avant de preparer l'entree"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, digest, content, filename=None, status=200, latency_ms=None,
+               predicted_class=None, endpoint="/predict"):
+        entry = {
+            "ts": time.time(),
+            "endpoint": endpoint,
+            "sha256": digest,
+            "size": len(content),
+            "filename": filename,
+            "status": status,
+            "latency_ms": round(latency_ms, 3) if latency_ms is not None else None,
+            "predicted_class": predicted_class,
+        }
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((entry, content if self.image_dir else None))
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+            self._thread.start()
+
+    def _image_path(self, entry):
+        ext = os.path.splitext(entry["filename"] or "")[1].lower() or ".bin"
+        return os.path.join(self.image_dir, entry["sha256"] + ext)
+
+    def _run(self):
+        while True:
+            entry, content = self._queue.get()
+            try:
+                if content is not None:
+                    image_path = self._image_path(entry)
+                    if not os.path.exists(image_path):
+                        with open(image_path, "wb") as f:
+                            f.write(content)
+                    entry["image"] = os.path.relpath(image_path, os.path.dirname(os.path.abspath(self.path)))
+                # Une seule ecriture en mode ajout par ligne : pas de melange entre workers
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except Exception as e:
+                logger.warning(f"Enregistrement du trafic impossible: {e}")
@@ -0,0 +1,102 @@
+"""Garde-fou des envois d'images, avant tout decodage
+
+Un envoi geant ou une image forgee (quelques Ko de PNG qui se decompressent
+en centaines de megapixels) peut occuper un worker et sa memoire. Chaque
+image est donc verifiee dans cet ordre, du moins cher au plus cher :
+
+1. taille : lecture limitee a max_bytes + 1 octets (413 au-dela)
+2. format : signature (magic bytes) parmi les formats autorises (415)
+3. dimensions : lues dans l'en-tete (PIL n'y decode aucun pixel) et
+   comparees au budget de pixels (422)
+
+Le cout d'une requete acceptee est ainsi borne par max_bytes et max_pixels.
+"""
+import io
+
+from PIL import Image
+
+# Signature -> format PIL
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"BM", "BMP"),
+    (b"RIFF", "WEBP"),
+)
+DEFAULT_FORMATS = ("JPEG", "PNG", "BMP", "WEBP")
+
+
+class UploadRejected(Exception):
+    """Image refusee avant decodage ; reason sert d'etiquette de metrique"""
+
+    def __init__(self, message, status, reason):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+def parse_formats(value, default=DEFAULT_FORMATS):
+    """'jpeg,png' -> ('JPEG', 'PNG')"""
+    if not value:
+        return tuple(default)
+    return tuple(v.strip().upper() for v in value.split(",") if v.strip())
+
+
+def read_limited(stream, max_bytes):
+    """Lit au plus max_bytes + 1 octets : assez pour savoir si la limite est depassee"""
+    data = stream.read(max_bytes + 1) if max_bytes else stream.read()
+    if max_bytes and len(data) > max_bytes:
+        raise UploadRejected(
+            f"Image trop volumineuse (> {max_bytes // (1024 * 1024)} Mo)", 413, "too_large"
+        )
+    return data
+
+
+def sniff(data):
+    """Format d'apres les premiers octets, None si inconnu"""
+    for signature, fmt in SIGNATURES:
+        if data.startswith(signature):
+            if fmt == "WEBP" and data[8:12] != b"WEBP":
+                return None
+            return fmt
+    return None
+
+
+class UploadGuard:
+    """Limites d'un envoi : octets, formats, pixels"""
+
+    def __init__(self, max_bytes=0, max_pixels=0, formats=DEFAULT_FORMATS):
+        self.max_bytes = int(max_bytes)
+        self.max_pixels = int(max_pixels)
+        self.formats = tuple(formats)
+
+    def read(self, stream):
+        return read_limited(stream, self.max_bytes)
+
+    def check(self, data):
+        """bytes -> (format, (largeur, hauteur)) ; UploadRejected sinon"""
+        if self.max_bytes and len(data) > self.max_bytes:
+            raise UploadRejected(
+                f"Image trop volumineuse (> {self.max_bytes // (1024 * 1024)} Mo)", 413, "too_large"
+            )
+        if not data:
+            raise UploadRejected("Fichier vide", 400, "empty")
+        fmt = sniff(data[:16])
+        if fmt is None or fmt not in self.formats:
+            raise UploadRejected(
+                f"Format non supporté (attendu: {', '.join(self.formats)})", 415, "format"
+            )
+        try:
+            # Lecture de l'en-tete seulement, avec le seul decodeur du format detecte
+            with Image.open(io.BytesIO(data), formats=[fmt]) as image:
+                size = image.size
+        except Image.DecompressionBombError as e:
+            raise UploadRejected(f"Image trop grande: {e}", 422, "too_many_pixels")
+        except Exception as e:
+            raise UploadRejected(f"En-tête d'image illisible: {e}", 400, "unreadable")
+        width, height = size
+        if self.max_pixels and width * height > self.max_pixels:
+            raise UploadRejected(
+                f"Image trop grande ({width}x{height} = {width * height / 1e6:.1f} Mpx, "
+                f"budget {self.max_pixels / 1e6:.1f} Mpx)", 422, "too_many_pixels"
+            )
+        return fmt, size
@@ -17,7 +17,7 @@ def main():
     load_css(css_path)
 
     #Affichage de la sidebar et recuperation des configurations
-    api_url, show_probabilities, show_top3, show_confidence_gauge = render_sidebar()
+    api_url, show_probabilities, show_top3, show_confidence_gauge, upload_mode = render_sidebar()
 
     #Header principal
     st.markdown("""
@@ -30,7 +30,7 @@ def main():
     """, unsafe_allow_html=True)
 
     # Affichage des onglets
-    render_tabs(api_url, show_probabilities, show_top3, show_confidence_gauge)
+    render_tabs(api_url, show_probabilities, show_top3, show_confidence_gauge, upload_mode)
 
     # Footer
     st.markdown("<br><br>", unsafe_allow_html=True)
@@ -1,5 +1,5 @@
 import streamlit as st
-import requests
+from src.utils.api import api_status
 
 def render_sidebar():
     with st.sidebar:
@@ -30,26 +30,39 @@ def render_sidebar():
         
         st.markdown("---")
         
+        st.markdown("## 📦 Plusieurs Images")
+        upload_mode = st.radio(
+            "Envoi",
+            ["batch", "concurrent"],
+            format_func=lambda mode: {
+                "batch": "Un seul lot (/predict/batch)",
+                "concurrent": "Requêtes parallèles (/predict)"
+            }[mode],
+            index=0,
+            help="Un seul lot : un appel, les images passent ensemble dans le modèle"
+        )
+        
+        st.markdown("---")
+        
         st.markdown("## 🔌 Etat de l'API")
-        try:
-            response = requests.get(f"{api_url}/", timeout=5)
-            if response.status_code == 200:
-                health_data = response.json()
-                st.markdown("""
-                    <div class="success-box" style="padding:10px; border-radius:5px;">
-                        <strong style="color: black !important;">API Connectée</strong>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                with st.expander("📋 Détails"):
-                    st.json(health_data)
-            else:
-                st.markdown("""
-                    <div class="warning-box" style="padding:10px; border-radius:5px;">
-                        <strong style="color: black !important;">⚠️ API Inaccessible</strong>
-                    </div>
-                """, unsafe_allow_html=True)
-        except:
+        # Vérification mise en cache quelques secondes : pas d'appel réseau à chaque interaction
+        status_code, health_data = api_status(api_url)
+        if status_code == 200:
+            st.markdown("""
+                <div class="success-box" style="padding:10px; border-radius:5px;">
+                    <strong style="color: black !important;">API Connectée</strong>
+                </div>
+            """, unsafe_allow_html=True)
+            
+            with st.expander("📋 Détails"):
+                st.json(health_data)
+        elif status_code is not None:
+            st.markdown("""
+                <div class="warning-box" style="padding:10px; border-radius:5px;">
+                    <strong style="color: black !important;">⚠️ API Inaccessible</strong>
+                </div>
+            """, unsafe_allow_html=True)
+        else:
             # Pour l'erreur, on garde le rouge pour le contraste
             st.markdown("""
                 <div class="error-box" style="padding:10px; border-radius:5px;">
@@ -68,4 +81,4 @@ def render_sidebar():
         
 
 
-    return api_url, show_probabilities, show_top3, show_confidence_gauge
+    return api_url, show_probabilities, show_top3, show_confidence_gauge, upload_mode
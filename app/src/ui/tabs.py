@@ -3,33 +3,183 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import requests
-import io
-import os
-import time
-from PIL import Image
-import json
-from src.utils.api import predict_image
+from src.utils.api import predict_images
+from src.utils.data import load_benchmark, load_dataset_stats, load_rice_types
 
-def render_classification_tab(api_url, show_probabilities, show_top3, show_confidence_gauge):
+def render_prediction(result, show_probabilities, show_top3, show_confidence_gauge, key=""):
+    """Carte de résultat, jauge, top 3 et distribution des probabilités d'une image"""
+    # Résultat principal
+    predicted_class = result['predicted_class']
+    confidence = result['confidence'] * 100
+    
+    # Déterminer l'emoji selon la confiance
+    if confidence >= 85:
+        emoji = "✅"
+    elif confidence >= 70:
+        emoji = "⚠️"
+    else:
+        emoji = "❓"
+    
+    # Affichage du résultat
+    st.markdown(f"""
+        <div class="result-card">
+            <div style="font-size: 3.5rem; margin-bottom: 1rem;">{emoji}</div>
+            <h3 style="color: #6B6B6B; font-family: 'Inter', sans-serif; font-weight: 600; margin-bottom: 0.5rem;">
+                TYPE DÉTECTÉ
+            </h3>
+            <div class="result-title">{predicted_class}</div>
+            <div style="color: #6B6B6B; margin: 1rem 0; font-weight: 500;">CONFIANCE</div>
+            <div class="confidence-score">{confidence:.2f}%</div>
+        </div>
+    """, unsafe_allow_html=True)
+    
+    # Jauge de confiance
+    if show_confidence_gauge:
+        fig_gauge = go.Figure(go.Indicator(
+            mode="gauge+number",
+            value=confidence,
+            domain={'x': [0, 1], 'y': [0, 1]},
+            title={'text': "Score de Confiance", 
+                   'font': {'size': 20, 'color': '#19124B', 'family': 'Inter'}},
+            number={'font': {'size': 36, 'color': '#19124B', 'family': 'Playfair Display'}},
+            gauge={
+                'axis': {'range': [None, 100], 'tickcolor': "#19124B"},
+                'bar': {'color': "#19124B"},
+                'bgcolor': "#F8F9FA",
+                'borderwidth': 2,
+                'bordercolor': "#FEE2E7",
+                'steps': [
+                    {'range': [0, 50], 'color': '#FEE2E7'},
+                    {'range': [50, 75], 'color': '#FED7E0'},
+                    {'range': [75, 100], 'color': '#FECDD6'}
+                ],
+                'threshold': {
+                    'line': {'color': "#19124B", 'width': 3},
+                    'thickness': 0.75,
+                    'value': 85
+                }
+            }
+        ))
+        
+        fig_gauge.update_layout(
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font={'color': "#2D2D2D", 'family': "Inter"},
+            height=300
+        )
+        
+        st.plotly_chart(fig_gauge, use_container_width=True, key=f"gauge_{key}")
+    
+    # Top 3 predictions
+    if show_top3:
+        st.markdown("""
+            <div class="modern-card">
+                <h3>🏆 Top 3 Predictions</h3>
+            </div>
+        """, unsafe_allow_html=True)
+        
+        for i, pred in enumerate(result.get('top_predictions') or result.get('top_3_predictions', []), 1):
+            conf_pct = pred['confidence'] * 100
+            
+            # Icône selon le rang
+            medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+            medal = medals.get(i, "")
+            
+            st.markdown(f"""
+                <div style="margin: 1rem 0;">
+                    <div style="color: #6B6B6B; font-size: 0.95rem; font-weight: 500; margin-bottom: 0.5rem;">
+                        {medal} {i}. {pred['class']}
+                    </div>
+                </div>
+            """, unsafe_allow_html=True)
+            
+            st.progress(pred['confidence'], 
+                      text=f"{conf_pct:.2f}%")
+    
+    # Graphique de toutes les probabilités
+    if show_probabilities:
+        st.markdown("""
+            <div class="modern-card">
+                <h3>📊 Distribution des Probabilites</h3>
+            </div>
+        """, unsafe_allow_html=True)
+        
+        probs_df = pd.DataFrame([
+            {"Type": k, "Probabilite": v*100}
+            for k, v in result['all_probabilities'].items()
+        ]).sort_values('Probabilite', ascending=False)
+        
+        fig_bar = px.bar(
+            probs_df,
+            x='Type',
+            y='Probabilite',
+            color='Probabilite',
+            color_continuous_scale=['#FEE2E7', '#19124B'],
+            text='Probabilite'
+        )
+        
+        fig_bar.update_traces(
+            texttemplate='%{text:.2f}%',
+            textposition='outside',
+            marker_line_color='#19124B',
+            marker_line_width=1.5
+        )
+        
+        fig_bar.update_layout(
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font={'color': "#2D2D2D", 'family': "Inter"},
+            xaxis={'title': None, 'gridcolor': '#E5E5E5'},
+            yaxis={'title': 'Probabilité (%)', 'gridcolor': '#E5E5E5'},
+            showlegend=False,
+            height=400
+        )
+        
+        st.plotly_chart(fig_bar, use_container_width=True, key=f"probs_{key}")
+
+def render_result(filename, result, single, show_probabilities, show_top3, show_confidence_gauge, key=""):
+    """Résultat d'une image : détaillé si elle est seule, sinon replié sous son nom"""
+    prefix = "" if single else f"{filename} : "
+    if isinstance(result, requests.exceptions.RequestException):
+        st.error(f"{prefix}Erreur de connexion à l'API: {result}")
+    elif isinstance(result, Exception):
+        st.error(f"{prefix}Une erreur inattendue est survenue: {result}")
+    elif "error" in result:
+        st.error(f"{prefix}{result['error']}")
+    elif single:
+        render_prediction(result, show_probabilities, show_top3, show_confidence_gauge, key)
+    else:
+        label = f"{filename} — {result['predicted_class']} ({result['confidence'] * 100:.2f}%)"
+        with st.expander(label):
+            render_prediction(result, show_probabilities, show_top3, show_confidence_gauge, key)
+
+def render_classification_tab(api_url, show_probabilities, show_top3, show_confidence_gauge, upload_mode="batch"):
     col_left, col_right = st.columns([1, 1], gap="large")
     
     with col_left:
         st.markdown("""
             <div class="modern-card">
-                <h2>📤 Telechargement d'Image</h2>
+                <h2>📤 Telechargement d'Images</h2>
             </div>
         """, unsafe_allow_html=True)
         
-        uploaded_file = st.file_uploader(
-            "Glissez votre image ici ou cliquez pour parcourir",
+        uploaded_files = st.file_uploader(
+            "Glissez vos images ici ou cliquez pour parcourir",
             type=['jpg', 'jpeg', 'png'],
-            help="Format accepte: JPG, PNG"
+            accept_multiple_files=True,
+            help="Format accepte: JPG, PNG — une ou plusieurs images"
         )
         
-        if uploaded_file is not None:
-            #Afficher l'image
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Image téléchargee", use_container_width=True)
+        if uploaded_files:
+            #Afficher les images (fichiers envoyés tels quels, sans décodage ici)
+            if len(uploaded_files) == 1:
+                st.image(uploaded_files[0], caption="Image téléchargee", use_container_width=True)
+            else:
+                st.image(
+                    uploaded_files,
+                    caption=[f.name for f in uploaded_files],
+                    width=110
+                )
             
             #Bouton d'analyse
             st.markdown("""
@@ -39,152 +189,26 @@ def render_classification_tab(api_url, show_probabilities, show_top3, show_confi
                  }
                  </style>
              """, unsafe_allow_html=True)
-            analyze_button = st.button("🚀 ANALYSER CETTE IMAGE", type="primary")
+            label = "🚀 ANALYSER CETTE IMAGE" if len(uploaded_files) == 1 else f"🚀 ANALYSER LES {len(uploaded_files)} IMAGES"
+            analyze_button = st.button(label, type="primary")
             
             if analyze_button:
+                # Octets d'origine : pas de ré-encodage avant l'envoi
+                files = [(f.name, f.getvalue()) for f in uploaded_files]
+                single = len(files) == 1
                 with col_right:
-                    with st.spinner("🔄 Analyse en cours..."):
-                        progress_bar = st.progress(0)
-                        for percent in range(100):
-                            time.sleep(0.01)
-                            progress_bar.progress(percent + 1)
-                        
-                        try:
-                            result = predict_image(api_url, image)
-                            
-                            # Résultat principal
-                            predicted_class = result['predicted_class']
-                            confidence = result['confidence'] * 100
-                            
-                            # Déterminer l'emoji selon la confiance
-                            if confidence >= 85:
-                                emoji = "✅"
-                            elif confidence >= 70:
-                                emoji = "⚠️"
-                            else:
-                                emoji = "❓"
-                            
-                            # Affichage du résultat
-                            st.markdown(f"""
-                                <div class="result-card">
-                                    <div style="font-size: 3.5rem; margin-bottom: 1rem;">{emoji}</div>
-                                    <h3 style="color: #6B6B6B; font-family: 'Inter', sans-serif; font-weight: 600; margin-bottom: 0.5rem;">
-                                        TYPE DÉTECTÉ
-                                    </h3>
-                                    <div class="result-title">{predicted_class}</div>
-                                    <div style="color: #6B6B6B; margin: 1rem 0; font-weight: 500;">CONFIANCE</div>
-                                    <div class="confidence-score">{confidence:.2f}%</div>
-                                </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Jauge de confiance
-                            if show_confidence_gauge:
-                                fig_gauge = go.Figure(go.Indicator(
-                                    mode="gauge+number",
-                                    value=confidence,
-                                    domain={'x': [0, 1], 'y': [0, 1]},
-                                    title={'text': "Score de Confiance", 
-                                           'font': {'size': 20, 'color': '#19124B', 'family': 'Inter'}},
-                                    number={'font': {'size': 36, 'color': '#19124B', 'family': 'Playfair Display'}},
-                                    gauge={
-                                        'axis': {'range': [None, 100], 'tickcolor': "#19124B"},
-                                        'bar': {'color': "#19124B"},
-                                        'bgcolor': "#F8F9FA",
-                                        'borderwidth': 2,
-                                        'bordercolor': "#FEE2E7",
-                                        'steps': [
-                                            {'range': [0, 50], 'color': '#FEE2E7'},
-                                            {'range': [50, 75], 'color': '#FED7E0'},
-                                            {'range': [75, 100], 'color': '#FECDD6'}
-                                        ],
-                                        'threshold': {
-                                            'line': {'color': "#19124B", 'width': 3},
-                                            'thickness': 0.75,
-                                            'value': 85
-                                        }
-                                    }
-                                ))
-                                
-                                fig_gauge.update_layout(
-                                    paper_bgcolor='rgba(0,0,0,0)',
-                                    plot_bgcolor='rgba(0,0,0,0)',
-                                    font={'color': "#2D2D2D", 'family': "Inter"},
-                                    height=300
-                                )
-                                
-                                st.plotly_chart(fig_gauge, use_container_width=True)
-                            
-                            # Top 3 predictions
-                            if show_top3:
-                                st.markdown("""
-                                    <div class="modern-card">
-                                        <h3>🏆 Top 3 Predictions</h3>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                
-                                for i, pred in enumerate(result['top_3_predictions'], 1):
-                                    conf_pct = pred['confidence'] * 100
-                                    
-                                    # Icône selon le rang
-                                    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
-                                    medal = medals.get(i, "")
-                                    
-                                    st.markdown(f"""
-                                        <div style="margin: 1rem 0;">
-                                            <div style="color: #6B6B6B; font-size: 0.95rem; font-weight: 500; margin-bottom: 0.5rem;">
-                                                {medal} {i}. {pred['class']}
-                                            </div>
-                                        </div>
-                                    """, unsafe_allow_html=True)
-                                    
-                                    st.progress(pred['confidence'], 
-                                              text=f"{conf_pct:.2f}%")
-                            
-                            # Graphique de toutes les probabilités
-                            if show_probabilities:
-                                st.markdown("""
-                                    <div class="modern-card">
-                                        <h3>📊 Distribution des Probabilites</h3>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                                
-                                probs_df = pd.DataFrame([
-                                    {"Type": k, "Probabilite": v*100}
-                                    for k, v in result['all_probabilities'].items()
-                                ]).sort_values('Probabilite', ascending=False)
-                                
-                                fig_bar = px.bar(
-                                    probs_df,
-                                    x='Type',
-                                    y='Probabilite',
-                                    color='Probabilite',
-                                    color_continuous_scale=['#FEE2E7', '#19124B'],
-                                    text='Probabilite'
-                                )
-                                
-                                fig_bar.update_traces(
-                                    texttemplate='%{text:.2f}%',
-                                    textposition='outside',
-                                    marker_line_color='#19124B',
-                                    marker_line_width=1.5
-                                )
-                                
-                                fig_bar.update_layout(
-                                    paper_bgcolor='rgba(0,0,0,0)',
-                                    plot_bgcolor='rgba(0,0,0,0)',
-                                    font={'color': "#2D2D2D", 'family': "Inter"},
-                                    xaxis={'title': None, 'gridcolor': '#E5E5E5'},
-                                    yaxis={'title': 'Probabilité (%)', 'gridcolor': '#E5E5E5'},
-                                    showlegend=False,
-                                    height=400
-                                )
-                                
-                                st.plotly_chart(fig_bar, use_container_width=True)
-                        
-                        except requests.exceptions.RequestException as e:
-                            st.error(f"Erreur de connexion à l'API: {e}")
-                        except Exception as e:
-                            st.error(f"Une erreur inattendue est survenue: {e}")
+                    progress_bar = st.progress(0, text="🔄 Analyse en cours...")
+                    # Un emplacement par image, dans l'ordre d'envoi : chaque résultat
+                    # s'affiche dès qu'il arrive
+                    slots = [st.container() for _ in files]
+                    for done, (index, result) in enumerate(predict_images(api_url, files, upload_mode), 1):
+                        progress_bar.progress(done / len(files), text=f"{done}/{len(files)} image(s) analysee(s)")
+                        with slots[index]:
+                            render_result(
+                                files[index][0], result, single,
+                                show_probabilities, show_top3, show_confidence_gauge, key=str(index)
+                            )
+                    progress_bar.empty()
         
         else:
             with col_right:
@@ -195,13 +219,13 @@ def render_classification_tab(api_url, show_probabilities, show_top3, show_confi
                             En Attente d'Image
                         </h3>
                         <p style="color: #6B6B6B; margin-top: 1rem;">
-                            Téléchargez une image de grain de riz pour commencer l'analyse
+                            Téléchargez une ou plusieurs images de grains de riz pour commencer l'analyse
                         </p>
                         <div class="info-box" style="margin-top: 2rem; text-align: left;">
                             <strong>📝 Instructions:</strong><br>
                             1. Cliquez sur "Browse files" ou glissez une image<br>
-                            2. Sélectionnez une image de grain de riz<br>
-                            3. Cliquez sur "ANALYSER LE TYPE DE RIZ"<br>
+                            2. Sélectionnez une ou plusieurs images de grains de riz<br>
+                            3. Cliquez sur "ANALYSER"<br>
                             4. Consultez les resultats détailles<br><br>
                             <strong> Formats acceptes:</strong> JPG, PNG
                         </div>
@@ -209,17 +233,26 @@ def render_classification_tab(api_url, show_probabilities, show_top3, show_confi
                 """, unsafe_allow_html=True)
 
 def render_data_analysis_tab():
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    
-    
-    with open(os.path.join(BASE_DIR, 'data', 'dataset_stats.json'), 'r', encoding='utf-8') as f:
-        stats = json.load(f)
-    
-
+    # Fichiers relus seulement quand ils changent (python -m api.dataset_stats, api.benchmark)
+    stats = load_dataset_stats()
+    if stats is None:
+        st.warning("Statistiques absentes : lancer `python -m api.dataset_stats`")
+        return
     
     metrics = stats['metrics']
     class_dist = stats['class_distribution']
 
+    # Temps/Image mesure par le benchmark (python -m api.benchmark), si disponible
+    benchmark = load_benchmark()
+    if benchmark:
+        # Une mesure de /predict avec des erreurs (ex. modèle non chargé) n'est pas fiable
+        endpoint = benchmark.get('endpoint')
+        if endpoint and endpoint.get('errors'):
+            endpoint = None
+        timing = endpoint or benchmark.get('inference', {}).get('1')
+        if timing:
+            metrics['time_per_image'] = f"~{timing['p50_ms']:.0f}ms"
+
     st.markdown("""
         <div class="modern-card">
             <h2>📊 Apercu du Dataset</h2>
@@ -238,6 +271,17 @@ def render_data_analysis_tab():
     with col4:
         st.metric("⚡ Temps/Image", metrics['time_per_image'])
     
+    # Dimensions et volume, calculés par api.dataset_stats
+    images = stats.get('images')
+    if images and images.get('mean_width'):
+        col5, col6, col7 = st.columns(3)
+        with col5:
+            st.metric("📐 Taille Moyenne", f"{images['mean_width']:.0f}x{images['mean_height']:.0f}")
+        with col6:
+            st.metric("↔️ Côtés", f"{images['min_side']}–{images['max_side']} px")
+        with col7:
+            st.metric("💾 Volume", f"{images['total_mb']} Mo")
+    
     # Distribution des classes
     st.markdown("<br>", unsafe_allow_html=True)
     
@@ -282,9 +326,7 @@ def render_data_analysis_tab():
         st.plotly_chart(fig_bar2, use_container_width=True)
 
 def render_rice_types_tab():
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    with open(os.path.join(BASE_DIR, 'data', 'rice_types.json'), 'r', encoding='utf-8') as f:
-        rice_types = json.load(f)
+    rice_types = load_rice_types() or []
     
     for rice in rice_types:
         st.markdown(f"""
@@ -332,13 +374,14 @@ def render_documentation_tab():
                     <li><code>GET /</code> - Informations generales</li>
                     <li><code>GET /health</code> - Etat de l'API</li>
                     <li><code>POST /predict</code> - Classification</li>
+                    <li><code>POST /predict/batch</code> - Classification de plusieurs images (NDJSON)</li>
                     <li><code>GET /classes</code> - Liste des classes</li>
                 </ul>
             </div>
         """, unsafe_allow_html=True)
         
 
-def render_tabs(api_url, show_probabilities, show_top3, show_confidence_gauge):
+def render_tabs(api_url, show_probabilities, show_top3, show_confidence_gauge, upload_mode="batch"):
     tab1, tab2, tab3, tab4 = st.tabs([
         "🔍 Classification",
         "📊 Donnees & Analyse",
@@ -347,7 +390,7 @@ def render_tabs(api_url, show_probabilities, show_top3, show_confidence_gauge):
     ])
 
     with tab1:
-        render_classification_tab(api_url, show_probabilities, show_top3, show_confidence_gauge)
+        render_classification_tab(api_url, show_probabilities, show_top3, show_confidence_gauge, upload_mode)
     
     with tab2:
         render_data_analysis_tab()
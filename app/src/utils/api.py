@@ -1,22 +1,139 @@
+import json
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
-import io
-from PIL import Image
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# Connexions HTTP gardees ouvertes entre deux appels (keep-alive)
+POOL_SIZE = 16
+TIMEOUT = 30
+# Etat de l'API (sidebar) : verifie au plus une fois par STATUS_TTL secondes
+STATUS_TTL = 15
+STATUS_TIMEOUT = 2
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the shared HTTP session (connection pool reused across calls and reruns).
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
 
-def predict_image(api_url, image: Image.Image):
+@st.cache_data(ttl=STATUS_TTL, show_spinner=False)
+def api_status(api_url):
     """
-    Calls the prediction API with the provided image.
+    Returns (status_code, payload) of the API root, or (None, None) if unreachable.
+    Cached for STATUS_TTL seconds so that reruns do not wait on the network.
     """
-    img_bytes = io.BytesIO()
-    image.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
-    
-    files = {'file': ('image.png', img_bytes, 'image/png')}
-    
-    response = requests.post(
+    try:
+        response = get_session().get(f"{api_url}/", timeout=STATUS_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return None, None
+    payload = response.json() if response.status_code == 200 else None
+    return response.status_code, payload
+
+
+def _file_tuple(filename, content):
+    mime = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return (filename, content, mime)
+
+
+def predict_image(api_url, content, filename="image.jpg"):
+    """
+    Calls the prediction API with the original uploaded bytes (no re-encoding).
+    """
+    response = get_session().post(
         f"{api_url}/predict",
-        files=files,
-        timeout=30
+        files={'file': _file_tuple(filename, content)},
+        timeout=TIMEOUT
     )
-    
+
     response.raise_for_status()
     return response.json()
+
+
+def predict_concurrent(api_url, files, max_workers=8):
+    """
+    Sends one /predict request per file, in parallel.
+    files: list of (filename, bytes). Yields (index, result or exception) as they complete.
+    """
+    with ThreadPoolExecutor(max_workers=min(max_workers, POOL_SIZE)) as executor:
+        futures = {
+            executor.submit(predict_image, api_url, content, filename): index
+            for index, (filename, content) in enumerate(files)
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+
+def predict_batch(api_url, files):
+    """
+    Sends all files in a single /predict/batch call.
+    The API streams one JSON line per image: yields (index, result or error dict) as they arrive.
+    """
+    response = get_session().post(
+        f"{api_url}/predict/batch",
+        files=[('files', _file_tuple(filename, content)) for filename, content in files],
+        timeout=TIMEOUT,
+        stream=True
+    )
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            if "index" not in result:
+                # Erreur sur tout le lot (lecture des fichiers)
+                raise RuntimeError(result.get("error", "Reponse inattendue de l'API"))
+            yield result.pop("index"), result
+
+
+def predict_images(api_url, files, mode="batch"):
+    """
+    Classifies several images; yields (index, result) as soon as each one is available.
+    mode: "batch" (a single /predict/batch call) or "concurrent" (parallel /predict calls).
+    Failed images yield an exception or a dict with an "error" key.
+    """
+    if len(files) == 1:
+        try:
+            yield 0, predict_image(api_url, files[0][1], files[0][0])
+        except Exception as e:
+            yield 0, e
+        return
+    if mode == "concurrent":
+        yield from predict_concurrent(api_url, files)
+        return
+
+    received = set()
+    try:
+        for index, result in predict_batch(api_url, files):
+            received.add(index)
+            yield index, result
+    except Exception as e:
+        response = getattr(e, "response", None)
+        if response is not None and response.status_code == 404:
+            # API sans /predict/batch : repli sur les requetes paralleles
+            yield from predict_concurrent(api_url, files)
+            return
+        for index in range(len(files)):
+            if index not in received:
+                yield index, e
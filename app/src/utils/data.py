@@ -0,0 +1,43 @@
+import json
+import os
+
+import streamlit as st
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+@st.cache_data(show_spinner=False)
+def _read_json(path, mtime):
+    # mtime fait partie de la cle du cache : un fichier modifie est relu
+    if mtime is None:
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_json(name):
+    """
+    Returns the parsed app/data/<name> file (None if missing), re-read only when its mtime changes.
+    """
+    path = os.path.join(DATA_DIR, name)
+    return _read_json(path, _mtime(path))
+
+
+def load_dataset_stats():
+    return load_json('dataset_stats.json')
+
+
+def load_rice_types():
+    return load_json('rice_types.json')
+
+
+def load_benchmark():
+    return load_json('benchmark.json')
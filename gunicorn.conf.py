@@ -0,0 +1,87 @@
+"""Configuration gunicorn de l'API de production (api.app_prod:app)
+
+SERVE_MODE :
+- workers          : chaque worker importe TensorFlow et charge son propre
+                     modele (comportement historique, memoire x WORKERS)
+- preload          : le maitre importe l'application, charge et prechauffe
+                     le modele une fois ; les workers forkes partagent les
+                     poids en copy-on-write et recreent seulement leurs pools
+                     de threads (backends tflite/onnx ; refuse avec keras,
+                     dont les pools de threads ne survivent pas au fork)
+- inference-server : un processus dedie (api.inference_server) possede le
+                     modele et le batching, les workers HTTP lui envoient les
+                     lots par socket Unix (MODEL_BACKEND=remote)
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+SERVE_MODE = os.environ.get("SERVE_MODE", "workers")
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WORKERS", "4"))
+# Threads par worker : le micro-batching a besoin de requetes concurrentes
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", "4"))
+timeout = 120
+accesslog = "-"
+errorlog = "-"
+
+preload_app = SERVE_MODE == "preload"
+
+# Un pool d'inference par worker : on partage les coeurs au lieu de
+# lancer WORKERS x nb_coeurs threads qui se marchent dessus
+if SERVE_MODE != "inference-server":
+    os.environ.setdefault(
+        "INFERENCE_THREADS", str(max(1, multiprocessing.cpu_count() // workers))
+    )
+
+if preload_app:
+    os.environ["PRELOAD_APP"] = "1"
+
+_server_process = None
+
+if SERVE_MODE == "inference-server":
+    # Le serveur d'inference garde le backend configure, les workers passent en remote
+    SERVER_BACKEND = os.environ.get("MODEL_BACKEND", "auto")
+    os.environ["MODEL_BACKEND"] = "remote"
+    os.environ.setdefault("INFERENCE_SOCKET", "/tmp/rice-inference.sock")
+
+
+def _app_module():
+    """Module de l'application s'il est deja importe dans ce processus (preload)"""
+    return sys.modules.get("api.app_prod")
+
+
+def on_starting(server):
+    global _server_process
+    if SERVE_MODE != "inference-server":
+        return
+    env = dict(os.environ, MODEL_BACKEND=SERVER_BACKEND)
+    _server_process = subprocess.Popen(
+        [sys.executable, "-m", "api.inference_server", "--socket", os.environ["INFERENCE_SOCKET"]],
+        env=env
+    )
+    server.log.info(f"Serveur d'inference lance (pid {_server_process.pid})")
+
+
+def pre_fork(server, worker):
+    app = _app_module()
+    if app is not None:
+        app.prepare_fork()
+
+
+def post_fork(server, worker):
+    app = _app_module()
+    if app is not None:
+        app.after_fork()
+
+
+def on_exit(server):
+    if _server_process is not None and _server_process.poll() is None:
+        _server_process.terminate()
+        try:
+            _server_process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _server_process.kill()
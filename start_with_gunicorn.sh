@@ -1,12 +1,12 @@
 #!/bin/bash
 
+# SERVE_MODE: workers (defaut) | preload | inference-server
+# Voir gunicorn.conf.py et la section "Modes multi-workers" du README
+SERVE_MODE=${SERVE_MODE:-workers}
+export SERVE_MODE
 
-echo "🚀 Demarrage de l'API avec Gunicorn..."
+echo "🚀 Demarrage de l'API avec Gunicorn (mode: $SERVE_MODE)..."
 
 gunicorn \
-    --bind 0.0.0.0:5000 \
-    --workers 4 \
-    --timeout 120 \
-    --access-logfile - \
-    --error-logfile - \
-    api.api:app
\ No newline at end of file
+    --config gunicorn.conf.py \
+    api.app_prod:app
@@ -0,0 +1,123 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Tests lances depuis la racine du depot ou depuis tests/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeModel:
+    """Modele factice : softmax deterministe par image, appels enregistres"""
+
+    def __init__(self, num_classes=5, delay=0.0):
+        self.num_classes = num_classes
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, batch):
+        import time
+
+        if self.delay:
+            time.sleep(self.delay)
+        batch = np.asarray(batch)
+        self.calls.append(len(batch))
+        # Classe = premier pixel de chaque image, pour verifier le decoupage du lot
+        outputs = np.zeros((len(batch), self.num_classes), dtype=np.float32)
+        outputs[np.arange(len(batch)), batch.reshape(len(batch), -1)[:, 0].astype(int) % self.num_classes] = 1.0
+        return outputs
+
+
+@pytest.fixture
+def fake_model():
+    return FakeModel()
+
+
+def images(*values, size=4):
+    """Lot (n, size, size, 3) dont le premier pixel de chaque image vaut `value`"""
+    batch = np.zeros((len(values), size, size, 3), dtype=np.float32)
+    for i, value in enumerate(values):
+        batch[i, 0, 0, 0] = value
+    return batch
+
+
+@pytest.fixture
+def ring():
+    from api.shm_ring import SlotRing
+
+    ring = SlotRing.create(n_slots=8, slot_shape=(4, 4, 3), dtype=np.float32)
+    yield ring
+    ring.close()
+    ring.unlink()
+    try:
+        os.remove(ring.lock_path)
+    except OSError:
+        pass
+
+
+def remote_backend(ring, reply=None, error=None):
+    """RemoteBackend branche sur `ring`, sans processus d'inference
+
+    reply : sortie (n, classes) renvoyee par le faux serveur ; error : exception levee
+    """
+    from api.inference_server import RemoteBackend, encode_output
+
+    backend = RemoteBackend.__new__(RemoteBackend)
+    backend.path = "fake.sock"
+    backend.input_shape = ring.slot_shape
+    backend.accepts_uint8 = False
+    backend.ring = ring
+    backend._allocations = {}
+    backend.remote = {"backend": "fake"}
+
+    def call(message):
+        if error is not None:
+            raise error
+        return encode_output(reply)
+
+    backend._call = call
+    return backend
+
+
+class FakeBackend:
+    """Backend local factice (meme interface que api.backends.InferenceBackend)"""
+
+    name = "fake"
+    batches_remotely = False
+    embedding = False
+    input_dtype = np.float32
+
+    def __init__(self, num_classes=5):
+        self.model_fn = FakeModel(num_classes)
+
+    def input_buffer(self, n):
+        return np.empty((n, 224, 224, 3), dtype=self.input_dtype)
+
+    def release_buffer(self, buffer):
+        pass
+
+    def predict(self, batch):
+        return self.model_fn(batch)
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """api.app_prod importe sans chargement de modele ni cache : chaque test
+    branche son propre backend"""
+    os.environ["BACKGROUND_LOAD"] = "0"
+    os.environ["CACHE_ENABLED"] = "0"
+    os.environ["MODEL_BACKEND"] = "fake"
+    from api import app_prod
+
+    return app_prod
+
+
+def png(value=128, size=(32, 32)):
+    import io
+
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (value, value, value)).save(buffer, format="PNG")
+    return buffer.getvalue()
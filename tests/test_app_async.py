@@ -0,0 +1,157 @@
+import asyncio
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from conftest import FakeBackend, png
+
+NUM_CLASSES = 5
+
+
+@pytest.fixture
+def served(engine, monkeypatch):
+    from api import app_async
+
+    monkeypatch.setattr(engine, "model", FakeBackend(NUM_CLASSES))
+    monkeypatch.setattr(engine, "class_names", {i: f"classe_{i}" for i in range(NUM_CLASSES)})
+    monkeypatch.setattr(engine, "experiment", None)
+    monkeypatch.setattr(engine, "shape_cascade", None)
+    return app_async
+
+
+@pytest.fixture
+def process_pool(served, monkeypatch):
+    executor = ProcessPoolExecutor(max_workers=1)
+    monkeypatch.setattr(served, "DECODE_EXECUTOR", "process")
+    monkeypatch.setattr(served, "decode_executor", executor)
+    yield executor
+    executor.shutdown()
+
+
+def test_process_pool_receives_bytes_not_the_upload_generator(served, process_pool):
+    images = enumerate(iter([("a.png", png()), ("b.png", b"pas une image"), ("c.png", png(10))]))
+
+    async def read():
+        return await served._next_chunk(asyncio.get_running_loop(), images)
+
+    valid, batch, errors = asyncio.run(read())
+    assert [index for index, _ in valid] == [0, 2]
+    assert batch.shape == (2, 224, 224, 3)
+    assert errors[0]["index"] == 1
+    assert errors[0]["status"] == 415
+
+
+def test_predict_batch_streams_in_process_mode(served, process_pool):
+    from starlette.testclient import TestClient
+
+    client = TestClient(served.app)
+    files = [("files", ("a.png", png(), "image/png")), ("files", ("b.png", png(3), "image/png"))]
+    response = client.post("/predict/batch", files=files)
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(r["index"] for r in records) == [0, 1]
+    assert all("error" not in r for r in records)
+
+
+def test_http_requests_are_recorded_with_the_declared_route(served):
+    from starlette.testclient import TestClient
+
+    client = TestClient(served.app)
+    before = served.engine.REQUESTS.value(endpoint="/health/live", status="200")
+    client.get("/health/live")
+    client.post("/predict", files={"file": ("a.png", io.BytesIO(png()), "image/png")})
+    client.get("/inexistante")
+    metrics = client.get("/metrics").text
+    assert served.engine.REQUESTS.value(endpoint="/health/live", status="200") == before + 1
+    assert 'rice_http_requests_total{endpoint="/predict",status="200"}' in metrics
+    assert 'endpoint="inconnue",status="404"' in metrics
+    assert 'rice_http_request_duration_seconds_count{endpoint="/predict"}' in metrics
+    assert 'rice_predict_stage_seconds_count{stage="read"}' in metrics
+
+
+def test_cache_hits_are_counted_per_class(served, monkeypatch):
+    from starlette.testclient import TestClient
+
+    from api.cache import PredictionCache
+
+    monkeypatch.setattr(served.engine, "prediction_cache", PredictionCache(max_entries=8))
+    client = TestClient(served.app)
+    before = served.engine.PREDICTIONS.value(class_name="classe_0")
+    for _ in range(3):
+        response = client.post("/predict", files={"file": ("a.png", io.BytesIO(png()), "image/png")})
+        assert response.json()["predicted_class"] == "classe_0"
+    assert served.engine.prediction_cache.hits == 2
+    assert served.engine.PREDICTIONS.value(class_name="classe_0") == before + 3
+
+
+class Recorder:
+    def __init__(self):
+        self.entries = []
+
+    def sampled(self):
+        return True
+
+    def record(self, digest, content, **fields):
+        self.entries.append({"sha256": digest, "size": len(content), **fields})
+
+
+def test_predictions_are_recorded_for_replay(served, monkeypatch):
+    from starlette.testclient import TestClient
+
+    from api.cache import PredictionCache
+
+    recorder = Recorder()
+    monkeypatch.setattr(served.engine, "traffic_recorder", recorder)
+    monkeypatch.setattr(served.engine, "prediction_cache", PredictionCache(max_entries=8))
+    client = TestClient(served.app)
+    for _ in range(2):
+        client.post("/predict", files={"file": ("a.png", io.BytesIO(png()), "image/png")})
+
+    assert [e["status"] for e in recorder.entries] == [200, 200]
+    assert [e["predicted_class"] for e in recorder.entries] == ["classe_0", "classe_0"]
+    assert recorder.entries[0]["sha256"] == recorder.entries[1]["sha256"] is not None
+    assert all(e["latency_ms"] > 0 and e["filename"] == "a.png" for e in recorder.entries)
+
+
+def test_failed_predictions_are_recorded_with_their_status(served, monkeypatch):
+    from starlette.testclient import TestClient
+
+    recorder = Recorder()
+    monkeypatch.setattr(served.engine, "traffic_recorder", recorder)
+
+    def broken(batch):
+        raise RuntimeError("panne")
+
+    monkeypatch.setattr(served.engine.model, "predict", broken)
+    response = TestClient(served.app).post("/predict", files={"file": ("a.png", io.BytesIO(png()), "image/png")})
+    assert response.status_code == 500
+    assert [(e["status"], e["predicted_class"]) for e in recorder.entries] == [(500, None)]
+
+
+def multipart_chunks(content, boundary="limite", chunk_size=512):
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="a.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    # Generateur : httpx envoie le corps en chunked, sans Content-Length
+    return (body[i:i + chunk_size] for i in range(0, len(body), chunk_size))
+
+
+@pytest.mark.parametrize("size, status", [(200, 200), (20000, 413)])
+def test_request_limit_applies_to_chunked_uploads(served, monkeypatch, size, status):
+    from starlette.testclient import TestClient
+
+    monkeypatch.setattr(served.engine, "REQUEST_MAX_BYTES", 4096)
+    content = png(size=(size, 1)) if status == 200 else png() + os.urandom(size)
+    response = TestClient(served.app).post(
+        "/predict",
+        content=multipart_chunks(content),
+        headers={"Content-Type": "multipart/form-data; boundary=limite"}
+    )
+    assert response.status_code == status
+    if status == 413:
+        assert response.json()["reason"] == "request_too_large"
@@ -0,0 +1,154 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+from conftest import FakeModel, png, remote_backend
+
+NUM_CLASSES = 5
+
+
+@pytest.fixture
+def image_ring():
+    from api.shm_ring import SlotRing
+
+    ring = SlotRing.create(n_slots=4, slot_shape=(224, 224, 3), dtype=np.float32)
+    yield ring
+    ring.close()
+    ring.unlink()
+    try:
+        os.remove(ring.lock_path)
+    except OSError:
+        pass
+
+
+@pytest.fixture
+def serving(engine, image_ring, monkeypatch):
+    """app_prod en mode inference-server : le modele principal ecrit dans l'anneau"""
+    reply = np.eye(NUM_CLASSES, dtype=np.float32)[[2]]
+    monkeypatch.setattr(engine, "model", remote_backend(image_ring, reply=reply))
+    monkeypatch.setattr(engine, "class_names", {i: f"classe_{i}" for i in range(NUM_CLASSES)})
+    monkeypatch.setattr(engine, "experiment", None)
+    monkeypatch.setattr(engine, "shape_cascade", None)
+    return engine
+
+
+def post_image(engine, content=None):
+    return engine.app.test_client().post(
+        "/predict",
+        data={"file": (io.BytesIO(content or png()), "grain.png")},
+        content_type="multipart/form-data"
+    )
+
+
+class CandidateBackend:
+    def __init__(self):
+        self.predict = FakeModel(NUM_CLASSES)
+
+
+def test_primary_request_releases_its_ring_slot(serving, image_ring):
+    for _ in range(10):
+        response = post_image(serving)
+        assert response.status_code == 200
+        assert response.get_json()["predicted_class"] == "classe_2"
+    assert image_ring.states.sum() == 0
+
+
+def test_candidate_served_request_releases_the_primary_slot(serving, image_ring, monkeypatch):
+    from api.experiment import Experiment
+
+    experiment = Experiment(CandidateBackend(), serving.class_names, mode="split", fraction=1.0, max_wait_ms=0)
+    monkeypatch.setattr(serving, "experiment", experiment)
+    # Plus de requetes que de cases : une fuite bloquerait l'anneau
+    for _ in range(10):
+        assert post_image(serving).status_code == 200
+    assert image_ring.states.sum() == 0
+    assert experiment.stats.served["candidate"] == 10
+
+
+def test_rejected_request_releases_its_ring_slot(serving, image_ring, monkeypatch):
+    import threading
+
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(serving, "remote_slots", slots)
+    response = post_image(serving)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert image_ring.states.sum() == 0
+
+
+def test_preprocessing_error_releases_its_ring_slot(serving, image_ring, monkeypatch):
+    def broken(content, out, timings=None):
+        raise OSError("image tronquee")
+
+    monkeypatch.setattr(serving.preprocessing, "preprocess_into", broken)
+    response = post_image(serving)
+    assert response.status_code == 500
+    assert image_ring.states.sum() == 0
+
+
+def test_default_response_keeps_the_historical_keys(serving):
+    client = serving.app.test_client()
+    for top_k, keys in ((None, {"top_3_predictions"}), ("3", {"top_3_predictions"}), ("1", {"top_predictions"})):
+        data = {"file": (io.BytesIO(png()), "grain.png")}
+        if top_k is not None:
+            data["top_k"] = top_k
+        payload = client.post("/predict", data=data, content_type="multipart/form-data").get_json()
+        assert {k for k in payload if k.startswith("top_")} == keys
+        if top_k is None:
+            assert set(payload) == {"predicted_class", "confidence", "top_3_predictions", "all_probabilities"}
+
+
+def test_float32_response_carries_the_class_order(serving):
+    response = serving.app.test_client().post(
+        "/predict",
+        data={"file": (io.BytesIO(png()), "grain.png")},
+        content_type="multipart/form-data",
+        headers={"Accept": "application/x-float32"}
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Classes"].split(",")[2] == "classe_2"
+    assert np.frombuffer(response.data, dtype="<f4").argmax() == 2
+
+
+def test_unavailable_format_is_406(serving):
+    response = serving.app.test_client().post(
+        "/predict",
+        data={"file": (io.BytesIO(png()), "grain.png")},
+        content_type="multipart/form-data",
+        headers={"Accept": "text/html"}
+    )
+    assert response.status_code == 406
+
+
+def test_upload_guard_rejects_before_decoding(serving, image_ring):
+    response = post_image(serving, b"GIF89a" + b"\0" * 64)
+    assert response.status_code == 415
+    assert response.get_json()["reason"] == "format"
+    assert image_ring.states.sum() == 0
+
+
+def test_request_over_max_content_length_is_413(serving, monkeypatch):
+    monkeypatch.setitem(serving.app.config, "MAX_CONTENT_LENGTH", 1000)
+    response = post_image(serving, png(size=(400, 400)) + b"\0" * 2000)
+    assert response.status_code == 413
+    assert response.get_json()["reason"] == "request_too_large"
+
+
+def test_batch_rejects_only_the_offending_image(serving, monkeypatch):
+    import json
+
+    from conftest import FakeBackend
+
+    monkeypatch.setattr(serving, "model", FakeBackend(NUM_CLASSES))
+    response = serving.app.test_client().post(
+        "/predict/batch",
+        data={"files": [(io.BytesIO(png()), "a.png"), (io.BytesIO(b"GIF89a" + b"\0" * 64), "b.gif")]},
+        content_type="multipart/form-data"
+    )
+    records = {r["index"]: r for r in map(json.loads, response.get_data(as_text=True).splitlines())}
+    assert "predicted_class" in records[0]
+    assert records[1]["status"] == 415
+    assert records[1]["reason"] == "format"
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from api.backends import InferenceBackend, bucket_for, normalize_buckets, predict_in_buckets
+from conftest import FakeModel, images
+
+
+class PaddedBackend(InferenceBackend):
+    name = "padded"
+
+    def __init__(self, bucket_sizes):
+        super().__init__("modele.bin", bucket_sizes)
+        self.model = FakeModel()
+
+    def _predict_padded(self, batch):
+        return self.model(batch)
+
+
+def test_normalize_buckets():
+    assert normalize_buckets([8, "1", 0, 8, -4, 4]) == (1, 4, 8)
+
+
+@pytest.mark.parametrize("n, expected", [(1, 1), (2, 4), (4, 4), (5, 8), (30, 8)])
+def test_bucket_for(n, expected):
+    assert bucket_for((1, 4, 8), n) == expected
+
+
+def test_batches_are_padded_to_the_next_bucket():
+    backend = PaddedBackend((1, 4, 8))
+    outputs = backend.predict(images(1, 2, 3))
+    assert backend.model.calls == [4]
+    assert outputs.argmax(axis=1).tolist() == [1, 2, 3]
+
+
+def test_large_batches_are_split_on_the_largest_bucket():
+    backend = PaddedBackend((1, 4))
+    outputs = backend.predict(images(*range(9)))
+    assert backend.model.calls == [4, 4, 1]
+    assert outputs.argmax(axis=1).tolist() == [v % 5 for v in range(9)]
+
+
+def test_shared_helper_keeps_the_input_dtype():
+    seen = []
+
+    def predict_padded(batch):
+        seen.append((len(batch), batch.dtype))
+        return np.zeros((len(batch), 2), dtype=np.float32)
+
+    outputs = predict_in_buckets(np.ones((3, 4, 4, 3), dtype=np.uint8), (2, 8), predict_padded)
+    assert outputs.shape == (3, 2)
+    assert seen == [(8, np.uint8)]
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api.batching import MicroBatcher, Rejected, _Request
+from conftest import FakeModel, images
+
+
+def test_single_request_gets_its_own_outputs(fake_model):
+    batcher = MicroBatcher(fake_model, max_batch_size=8, max_wait_ms=1)
+    out = batcher.predict(images(2, 3), timeout=5)
+    assert out.shape == (2, 5)
+    assert list(out.argmax(axis=1)) == [2, 3]
+
+
+def test_three_dimensional_input_is_one_image(fake_model):
+    batcher = MicroBatcher(fake_model, max_wait_ms=1)
+    out = batcher.predict(images(4)[0], timeout=5)
+    assert out.shape == (1, 5)
+    assert out.argmax() == 4
+
+
+def test_concurrent_requests_share_one_call_and_keep_their_slices():
+    model = FakeModel(delay=0.05)
+    batcher = MicroBatcher(model, max_batch_size=16, max_wait_ms=1)
+    # Premier lot : occupe le thread pendant que les suivants s'accumulent
+    batcher.submit(images(0))
+    time.sleep(0.01)
+    futures = [batcher.submit(images(i % 5)) for i in range(8)]
+    results = [f.result(timeout=5) for f in futures]
+    assert [int(r.argmax()) for r in results] == [i % 5 for i in range(8)]
+    assert sum(model.calls) == 9
+    assert model.calls[-1] == 8
+
+
+def test_batch_never_exceeds_max_batch_size():
+    model = FakeModel(delay=0.02)
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=20)
+    futures = [batcher.submit(images(1, 2, 3)) for _ in range(6)]
+    for future in futures:
+        assert future.result(timeout=5).shape == (3, 5)
+    # Une requete de 3 images ne tient pas a cote d'une autre : reportee au lot suivant
+    assert max(model.calls) <= 4
+    assert sum(model.calls) == 18
+
+
+def test_model_error_is_raised_to_every_request_of_the_batch():
+    def failing(batch):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(failing, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="boom"):
+        batcher.predict(images(1), timeout=5)
+    # La boucle survit a l'erreur
+    batcher.predict_fn = FakeModel()
+    assert batcher.predict(images(2), timeout=5).argmax() == 2
+
+
+def test_on_batch_reports_size_and_duration(fake_model):
+    seen = []
+    batcher = MicroBatcher(fake_model, max_wait_ms=1, on_batch=lambda n, s: seen.append((n, s)))
+    batcher.predict(images(1, 2), timeout=5)
+    assert seen[0][0] == 2
+    assert seen[0][1] >= 0
+
+
+def test_concatenated_batch_buffer_is_reused(fake_model):
+    batcher = MicroBatcher(fake_model, max_batch_size=8)
+    first = batcher._concatenate([_Request(images(1)), _Request(images(2))])
+    second = batcher._concatenate([_Request(images(3)), _Request(images(4)), _Request(images(0))])
+    assert len(batcher._buffer) == 8
+    assert np.shares_memory(first, second)
+    assert list(second[:, 0, 0, 0]) == [3, 4, 0]
+
+
+def test_full_queue_is_rejected_with_429():
+    blocker = threading.Event()
+    batcher = MicroBatcher(lambda batch: blocker.wait(5) and FakeModel()(batch), max_wait_ms=0, max_queue=2)
+    first = batcher.submit(images(1))
+    time.sleep(0.05)
+    queued = [batcher.submit(images(1), admit=True) for _ in range(2)]
+    with pytest.raises(Rejected) as excinfo:
+        batcher.submit(images(1), admit=True)
+    assert excinfo.value.status == 429
+    assert excinfo.value.reason == "queue_full"
+    assert excinfo.value.retry_after_header == "1"
+    blocker.set()
+    for future in [first] + queued:
+        future.result(timeout=5)
+
+
+def test_deadline_that_cannot_be_met_is_rejected_before_queueing():
+    batcher = MicroBatcher(FakeModel(delay=0.05), max_batch_size=1, max_wait_ms=0)
+    batcher.predict(images(1), timeout=5)
+    # Un lot dure ~50 ms : une echeance a 10 ms est refusee tout de suite
+    with pytest.raises(Rejected) as excinfo:
+        batcher.submit(images(1), deadline=time.monotonic() + 0.01, admit=True)
+    assert excinfo.value.status == 503
+    assert excinfo.value.reason == "deadline"
+
+
+def test_request_expired_in_queue_is_dropped_without_inference():
+    model = FakeModel(delay=0.1)
+    batcher = MicroBatcher(model, max_batch_size=1, max_wait_ms=0)
+    busy = batcher.submit(images(1))
+    time.sleep(0.02)
+    expired = batcher.submit(images(2), deadline=time.monotonic() + 0.01)
+    busy.result(timeout=5)
+    with pytest.raises(Rejected) as excinfo:
+        expired.result(timeout=5)
+    assert excinfo.value.reason == "expired"
+    assert model.calls == [1]
+
+
+def test_admission_is_skipped_without_admit():
+    batcher = MicroBatcher(FakeModel(), max_wait_ms=0, max_queue=1)
+    batcher._queue.put(_Request(images(0)))
+    # Sans admit, la borne ne s'applique pas (cache, cascade, lots internes)
+    assert batcher.predict(images(3), timeout=5).argmax() == 3
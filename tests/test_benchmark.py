@@ -0,0 +1,21 @@
+import pytest
+
+from api.benchmark import bench_endpoint, summarize
+from conftest import png
+
+
+def test_summarize_percentiles_and_throughput():
+    summary = summarize([0.01, 0.02, 0.03, 0.04], images_per_call=2)
+    assert summary["calls"] == 4
+    assert summary["p50_ms"] == 25.0
+    assert summary["images_per_second"] == 80.0
+
+
+def test_endpoint_is_not_timed_without_a_loaded_model(engine, monkeypatch):
+    # Sans modele, /predict repondrait 503 en quelques µs : la mesure serait fausse
+    monkeypatch.setattr(engine, "model", None)
+    # bench_endpoint ecrit ces variables : monkeypatch les restaure
+    for name in ("MODEL_PATH", "MODEL_BACKEND", "CACHE_ENABLED", "BACKGROUND_LOAD"):
+        monkeypatch.setenv(name, "")
+    with pytest.raises(RuntimeError, match="Modele non charge"):
+        bench_endpoint([("grain.png", png())], "inexistant.keras", "fake")
@@ -0,0 +1,86 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from api.bulk_classify import CsvSink, JsonlSink, classify, output_fields, truncate_partial_line
+from conftest import FakeModel
+
+CLASS_INDICES = {"Arborio": 0, "Basmati": 1}
+
+
+class Backend:
+    input_shape = (224, 224, 3)
+    input_dtype = np.float32
+
+    def __init__(self):
+        self.model_fn = FakeModel(num_classes=2)
+
+    def predict(self, batch):
+        return self.model_fn(batch)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "images"
+    for name in CLASS_INDICES:
+        (root / name).mkdir(parents=True)
+        for i in range(3):
+            Image.new("RGB", (16, 16), (i, i, i)).save(root / name / f"{i}.png")
+    return root
+
+
+def run(root, sink):
+    return classify(str(root), Backend(), CLASS_INDICES, sink, batch_size=2, pipeline="threads", flush_every=1)
+
+
+def test_truncate_partial_line(tmp_path):
+    path = tmp_path / "sortie.jsonl"
+    path.write_bytes(b'{"a": 1}\n{"b": 2}\n{"c"')
+    assert truncate_partial_line(str(path)) == 4
+    assert path.read_bytes() == b'{"a": 1}\n{"b": 2}\n'
+    assert truncate_partial_line(str(path)) == 0
+    path.write_bytes(b"sans fin de ligne")
+    truncate_partial_line(str(path))
+    assert path.read_bytes() == b""
+
+
+@pytest.mark.parametrize("sink_class, suffix", [(CsvSink, "csv"), (JsonlSink, "jsonl")])
+def test_resume_after_a_torn_last_line(tree, tmp_path, sink_class, suffix):
+    output = tmp_path / f"sortie.{suffix}"
+    sink = sink_class(str(output), output_fields(CLASS_INDICES))
+    run(tree, sink)
+    complete = output.read_bytes()
+
+    # Interruption au milieu de l'ecriture de la derniere ligne
+    output.write_bytes(complete[:-8])
+    report = run(tree, sink_class(str(output), output_fields(CLASS_INDICES)))
+
+    assert report["num_images"] == 6
+    rows = sink_class(str(output), output_fields(CLASS_INDICES)).read()
+    assert sorted(r["path"] for r in rows) == sorted({r["path"] for r in rows})
+    assert len(rows) == 6
+    assert all(r["predicted_class"] in CLASS_INDICES for r in rows)
+    # Une nouvelle reprise n'a plus rien a faire
+    assert run(tree, sink_class(str(output), output_fields(CLASS_INDICES)))["num_images"] == 6
+    assert output.read_bytes().count(b"\n") == complete.count(b"\n")
+
+
+def test_csv_rows_with_missing_or_extra_fields_are_redone(tmp_path):
+    fields = ["path", "predicted_class", "confidence"]
+    output = tmp_path / "sortie.csv"
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        writer.writerow(["a", "Arborio", "0.9"])
+        writer.writerow(["b", "Arbo"])
+        writer.writerow(["c", "Basmati", "0.8", "Z"])
+    assert [r["path"] for r in CsvSink(str(output), fields).read()] == ["a"]
+
+
+def test_jsonl_skips_a_corrupt_complete_line(tmp_path):
+    output = tmp_path / "sortie.jsonl"
+    output.write_text('{"path": "a"}\n{pas du json}\n' + json.dumps({"path": "b"}) + "\n")
+    assert [r["path"] for r in JsonlSink(str(output), None).read()] == ["a", "b"]
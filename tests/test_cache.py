@@ -0,0 +1,50 @@
+import os
+import time
+
+from api.cache import PredictionCache, content_hash
+
+
+def test_hit_and_miss_are_counted():
+    cache = PredictionCache(max_entries=4)
+    digest = content_hash(b"image")
+    assert cache.get(digest) is None
+    cache.put(digest, [0.1, 0.9])
+    assert cache.get(digest) == [0.1, 0.9]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1.0]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entry_is_a_miss():
+    cache = PredictionCache(ttl_seconds=0.01)
+    cache.put("a", [1.0])
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_model_file_change_invalidates_the_cache(tmp_path):
+    model = tmp_path / "modele.keras"
+    model.write_bytes(b"v1")
+    cache = PredictionCache(watch_path=str(model), check_interval=0)
+    cache.put("a", [1.0])
+    assert cache.get("a") == [1.0]
+    model.write_bytes(b"version 2")
+    os.utime(model, ns=(time.time_ns() + 10**9,) * 2)
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_unreachable_redis_falls_back_to_the_local_cache():
+    cache = PredictionCache(redis_url="redis://127.0.0.1:1/0")
+    cache.put("a", [1.0])
+    assert cache.get("a") == [1.0]
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from api import cascade
+
+CLASSES = ["Arborio", "Basmati"]
+
+
+def grain(width, height, color=(230, 220, 200), size=224):
+    """Grain elliptique centre sur fond noir, comme dans le dataset"""
+    image = Image.new("RGB", (size, size), (0, 0, 0))
+    x0, y0 = (size - width) // 2, (size - height) // 2
+    ImageDraw.Draw(image).ellipse((x0, y0, x0 + width, y0 + height), fill=color)
+    return image
+
+
+def training_set(seed=0):
+    """Arborio court et rond, Basmati long et fin, quelques tailles par classe"""
+    rng = np.random.default_rng(seed)
+    X, y = [], []
+    for _ in range(30):
+        X.append(cascade.shape_features(np.asarray(grain(*rng.integers(70, 90, size=2)))))
+        y.append(0)
+        X.append(cascade.shape_features(np.asarray(grain(rng.integers(150, 180), rng.integers(30, 40)))))
+        y.append(1)
+    return np.array(X), np.array(y)
+
+
+def feature(features, name):
+    return features[cascade.FEATURES.index(name)]
+
+
+def test_shape_features_describe_the_grain():
+    long_grain = cascade.shape_features(np.asarray(grain(160, 40)))
+    round_grain = cascade.shape_features(np.asarray(grain(80, 80)))
+    assert feature(long_grain, "aspect_ratio") == pytest.approx(4.0, rel=0.1)
+    assert feature(round_grain, "aspect_ratio") == pytest.approx(1.0, rel=0.05)
+    assert feature(round_grain, "extent") == pytest.approx(np.pi / 4, rel=0.05)
+    assert feature(long_grain, "mean_r") == pytest.approx(230)
+    assert not cascade.shape_features(np.zeros((224, 224, 3), dtype=np.uint8)).any()
+
+
+@pytest.fixture
+def classifier_path(tmp_path):
+    X, y = training_set()
+    path = str(tmp_path / "shape_classifier.npz")
+    cascade.ShapeClassifier.fit(X, y, CLASSES).save(path)
+    return path
+
+
+def test_fitted_classifier_separates_shapes_and_survives_a_round_trip(classifier_path):
+    X, y = training_set(seed=1)
+    loaded = cascade.ShapeClassifier.load(classifier_path)
+    assert loaded.classes == CLASSES
+    probs = loaded.predict_proba(X)
+    assert probs.shape == (len(X), 2)
+    assert np.allclose(probs.sum(axis=1), 1.0)
+    assert (probs.argmax(axis=1) == y).all()
+
+
+def test_cascade_answers_only_above_its_threshold(classifier_path):
+    image = grain(165, 35)
+    probs = cascade.ShapeCascade(classifier_path, threshold=0.95).answer(image)
+    assert probs is not None and CLASSES[int(np.argmax(probs))] == "Basmati"
+
+    # Le seuil est inclusif ; juste au-dessus, la requete continue vers le CNN
+    confidence = probs.max()
+    assert cascade.ShapeCascade(classifier_path, threshold=confidence).answer(image) is not None
+    assert cascade.ShapeCascade(classifier_path, threshold=np.nextafter(confidence, 2.0)).answer(image) is None
+
+
+def test_coverage_table():
+    probs = np.array([[0.99, 0.01], [0.85, 0.15], [0.4, 0.6]])
+    predicted = probs.argmax(axis=1)
+    table = cascade.coverage_table(probs, predicted, np.array([0, 1, 1]), thresholds=(0.5, 0.9, 0.995))
+    assert table["0.5"] == {"coverage": 1.0, "accuracy": pytest.approx(2 / 3)}
+    assert table["0.9"] == {"coverage": pytest.approx(1 / 3), "accuracy": 1.0}
+    assert table["0.995"] == {"coverage": 0.0, "accuracy": None}
+
+
+def test_confident_cascade_skips_the_cnn(engine, classifier_path, monkeypatch):
+    import io
+
+    from conftest import FakeBackend
+
+    backend = FakeBackend(len(CLASSES))
+    monkeypatch.setattr(engine, "model", backend)
+    monkeypatch.setattr(engine, "class_names", dict(enumerate(CLASSES)))
+    monkeypatch.setattr(engine, "experiment", None)
+    monkeypatch.setattr(engine, "shape_cascade", cascade.ShapeCascade(classifier_path, threshold=0.95))
+
+    buffer = io.BytesIO()
+    grain(165, 35).save(buffer, format="PNG")
+    response = engine.app.test_client().post(
+        "/predict", data={"file": (io.BytesIO(buffer.getvalue()), "grain.png")}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 200
+    assert response.get_json()["predicted_class"] == "Basmati"
+    assert backend.model_fn.calls == []
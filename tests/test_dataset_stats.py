@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+from api import dataset_stats
+
+
+def save(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, (200, 190, 170)).save(path, format="PNG")
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    root = tmp_path / "dataset"
+    save(str(root / "Arborio" / "a.png"), (40, 30))
+    save(str(root / "Arborio" / "b.png"), (50, 50))
+    save(str(root / "Basmati" / "c.png"), (60, 20))
+    (root / "Basmati" / "notes.txt").write_text("pas une image")
+    return root
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Images dont l'en-tete a ete relu"""
+    opened = []
+    image_size = dataset_stats.image_size
+
+    def counting(path):
+        opened.append(os.path.relpath(path, os.path.dirname(os.path.dirname(path))))
+        return image_size(path)
+
+    monkeypatch.setattr(dataset_stats, "image_size", counting)
+    return opened
+
+
+def run(dataset, tmp_path):
+    return dataset_stats.update(
+        str(dataset), str(tmp_path / "manifest.json"), str(tmp_path / "stats.json"), workers=2
+    )
+
+
+def test_first_scan_reads_every_image(dataset, tmp_path, reads):
+    stats = run(dataset, tmp_path)
+    assert sorted(reads) == ["Arborio/a.png", "Arborio/b.png", "Basmati/c.png"]
+    assert stats["metrics"]["total_images"] == "3"
+    assert stats["class_distribution"][0] == {"Type de Riz": "Arborio", "Nombre": 2, "Pourcentage": 66.7}
+    assert stats["images"]["min_side"] == 20 and stats["images"]["max_side"] == 60
+
+
+def test_rescan_only_reads_new_or_modified_images(dataset, tmp_path, reads):
+    run(dataset, tmp_path)
+    del reads[:]
+    assert run(dataset, tmp_path)["metrics"]["total_images"] == "3"
+    assert reads == []
+
+    changed = str(dataset / "Arborio" / "b.png")
+    save(changed, (80, 70))
+    stat = os.stat(changed)
+    os.utime(changed, (stat.st_atime, stat.st_mtime + 10))
+    save(str(dataset / "Basmati" / "d.png"), (30, 30))
+    os.remove(str(dataset / "Arborio" / "a.png"))
+
+    stats = run(dataset, tmp_path)
+    assert sorted(reads) == ["Arborio/b.png", "Basmati/d.png"]
+    with open(tmp_path / "manifest.json") as f:
+        entries = json.load(f)["entries"]
+    assert sorted(entries) == ["Arborio/b.png", "Basmati/c.png", "Basmati/d.png"]
+    assert (entries["Arborio/b.png"]["width"], entries["Arborio/b.png"]["height"]) == (80, 70)
+    assert stats["metrics"]["total_images"] == "3"
+    assert stats["images"]["max_side"] == 80
+
+
+def test_another_dataset_root_is_rescanned_in_full(dataset, tmp_path, reads):
+    run(dataset, tmp_path)
+    moved = tmp_path / "copie"
+    os.rename(str(dataset), str(moved))
+    del reads[:]
+    run(moved, tmp_path)
+    assert len(reads) == 3
+
+
+def test_unreadable_images_are_skipped_and_metrics_are_kept(dataset, tmp_path):
+    (dataset / "Basmati" / "broken.png").write_bytes(b"pas un png")
+    with open(tmp_path / "stats.json", "w") as f:
+        json.dump({"metrics": {"accuracy": "98.5%", "time_per_image": "12 ms"}}, f)
+
+    stats = run(dataset, tmp_path)
+    assert stats["metrics"]["total_images"] == "3"
+    assert stats["metrics"]["accuracy"] == "98.5%"
+    assert stats["metrics"]["time_per_image"] == "12 ms"
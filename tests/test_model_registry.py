@@ -0,0 +1,101 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import FakeBackend, FakeModel
+
+OLD_NAMES = {"Arborio": 0, "Basmati": 1, "Ipsala": 2, "Jasmine": 3, "Karacadag": 4}
+NEW_NAMES = {"Arborio": 0, "Basmati": 1, "Jasmine": 2}
+
+
+class VersionBackend(FakeBackend):
+    """Backend charge par load_backend() : softmax + embedding de dimension `dim`"""
+
+    embedding = True
+    input_shape = (224, 224, 3)
+
+    def __init__(self, num_classes, dim):
+        super().__init__(num_classes)
+        self.dim = dim
+
+    def warmup(self):
+        return 0.0
+
+    def predict_with_embedding(self, batch):
+        probs = self.model_fn(batch)
+        return np.concatenate([probs, np.ones((len(probs), self.dim), dtype=np.float32)], axis=1)
+
+
+def publish(registry, tmp_path, name, names):
+    source = tmp_path / f"{name}.keras"
+    source.write_bytes(b"")
+    labels = tmp_path / f"{name}.json"
+    labels.write_text(json.dumps(names))
+    registry.publish(str(source), str(labels), name=name)
+
+
+@pytest.fixture
+def registry(engine, tmp_path, monkeypatch):
+    from api.experiment import Experiment
+    from api.model_registry import ModelRegistry
+    from api.similarity import SimilaritySearch
+
+    registry = ModelRegistry(str(tmp_path / "registry"))
+    publish(registry, tmp_path, "v1", OLD_NAMES)
+    publish(registry, tmp_path, "v2", NEW_NAMES)
+    registry.activate("v1")
+
+    old_names = {v: k for k, v in OLD_NAMES.items()}
+    monkeypatch.setattr(engine, "model", FakeBackend(len(OLD_NAMES)))
+    monkeypatch.setattr(engine, "class_names", old_names)
+    monkeypatch.setattr(engine, "model_version", "v1")
+    monkeypatch.setattr(engine, "prediction_cache", None)
+
+    candidate = type("Candidate", (), {"predict": FakeModel(len(OLD_NAMES))})()
+    experiment = Experiment(candidate, old_names, mode="shadow", max_wait_ms=0)
+    experiment.stats.compare(np.eye(5)[0], np.eye(5)[4])
+    monkeypatch.setattr(engine, "experiment", experiment)
+
+    index = type("Index", (), {"dim": 8})()
+    search = SimilaritySearch(index, model_path="absent.keras")
+    search._predictor = object()
+    monkeypatch.setattr(engine, "similarity_search", search)
+    return registry
+
+
+def watcher(engine, registry):
+    from api.model_registry import ModelWatcher
+
+    return ModelWatcher(
+        registry, load=engine.load_registered_version, activate=engine._activate_version, active="v1"
+    )
+
+
+def test_activation_refreshes_experiment_labels_and_embedder(engine, registry, monkeypatch):
+    monkeypatch.setattr(engine, "load_backend", lambda path, **kwargs: VersionBackend(len(NEW_NAMES), 8))
+    registry.activate("v2")
+
+    assert watcher(engine, registry).check()
+    assert engine.model_version == "v2"
+    assert list(engine.class_names.values()) == ["Arborio", "Basmati", "Jasmine"]
+    stats = engine.experiment.stats
+    assert stats.class_names is engine.class_names
+    assert stats.compared == 0
+    # Les anciens indices n'ont plus de sens : 4 n'existe plus dans la nouvelle version
+    stats.compare(np.eye(3)[2], np.eye(3)[2])
+    assert stats.snapshot()["per_class"]["Jasmine"]["requests"] == 1
+    assert engine.similarity_search._predictor is None
+
+
+def test_version_with_another_embedding_size_is_refused(engine, registry, monkeypatch):
+    previous = engine.model
+    monkeypatch.setattr(engine, "load_backend", lambda path, **kwargs: VersionBackend(len(NEW_NAMES), 16))
+    registry.activate("v2")
+
+    probe = watcher(engine, registry)
+    assert not probe.check()
+    assert probe.failed == "v2"
+    assert "dimension 16" in probe.last_error
+    assert engine.model is previous
+    assert engine.model_version == "v1"
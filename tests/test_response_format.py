@@ -0,0 +1,95 @@
+import struct
+
+import numpy as np
+import pytest
+
+from api import response_format
+
+CLASSES = {0: "Arborio", 1: "Basmati", 2: "Ipsala", 3: "Jasmine", 4: "Karacadag"}
+PROBS = np.array([0.05, 0.6, 0.1, 0.2, 0.05], dtype=np.float32)
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, response_format.JSON),
+    ("*/*", response_format.JSON),
+    ("application/x-float32", response_format.FLOAT32),
+    ("application/octet-stream", response_format.FLOAT32),
+    ("application/x-float32;q=0.5, application/json", response_format.JSON),
+    ("text/html;q=1, application/x-float32;q=0.1", response_format.FLOAT32),
+    ("text/html", None),
+    ("application/x-float32;q=0", None),
+])
+def test_negotiate(accept, expected):
+    assert response_format.negotiate(accept) == expected
+
+
+def test_parse_top_k_is_bounded_by_the_number_of_classes():
+    assert response_format.parse_top_k(None, 5) is None
+    assert response_format.parse_top_k("", 5) is None
+    assert response_format.parse_top_k("3", 5) is None
+    assert response_format.parse_top_k("3", 2) is None
+    assert response_format.parse_top_k("0", 5) == 0
+    assert response_format.parse_top_k("50", 5) == 5
+    with pytest.raises(ValueError):
+        response_format.parse_top_k("-1", 5)
+    with pytest.raises(ValueError):
+        response_format.parse_top_k("deux", 5)
+
+
+def test_parse_flag():
+    assert response_format.parse_flag(None) is True
+    assert response_format.parse_flag("0") is False
+    assert response_format.parse_flag("false") is False
+    assert response_format.parse_flag("1") is True
+
+
+def test_top_k_indices_are_sorted_by_probability():
+    assert list(response_format.top_k_indices(PROBS, 2)) == [1, 3]
+    assert list(response_format.top_k_indices(PROBS, 5))[:3] == [1, 3, 2]
+    assert len(response_format.top_k_indices(PROBS, 0)) == 0
+
+
+def test_default_payload_has_exactly_the_historical_keys():
+    payload = response_format.prediction_payload(PROBS, CLASSES)
+    assert list(payload) == ["predicted_class", "confidence", "top_3_predictions", "all_probabilities"]
+    assert payload["predicted_class"] == "Basmati"
+    assert payload["confidence"] == pytest.approx(0.6)
+    assert [p["class"] for p in payload["top_3_predictions"]] == ["Basmati", "Jasmine", "Ipsala"]
+    assert set(payload["all_probabilities"]) == set(CLASSES.values())
+
+
+def test_default_payload_keeps_the_historical_key_with_few_classes():
+    classes = {0: "Arborio", 1: "Basmati"}
+    top_k = response_format.parse_top_k(None, len(classes))
+    payload = response_format.prediction_payload(np.array([0.3, 0.7]), classes, top_k=top_k)
+    assert [p["class"] for p in payload["top_3_predictions"]] == ["Basmati", "Arborio"]
+    assert "top_predictions" not in payload
+
+
+def test_explicit_top_k_uses_top_predictions():
+    for top_k in (1, 2, 4, 5):
+        payload = response_format.prediction_payload(PROBS, CLASSES, top_k=top_k, include_probs=False)
+        assert len(payload["top_predictions"]) == top_k
+        assert "top_3_predictions" not in payload
+        assert "all_probabilities" not in payload
+    payload = response_format.prediction_payload(PROBS, CLASSES, top_k=0)
+    assert not any(key.startswith("top_") for key in payload)
+    assert payload["predicted_class"] == "Basmati"
+
+
+def test_float32_record_layout():
+    record = response_format.float32_record(7, PROBS)
+    assert struct.unpack_from("<i", record)[0] == 7
+    assert np.allclose(np.frombuffer(record, dtype="<f4", offset=4), PROBS)
+    missing = response_format.float32_record(3, None, num_classes=5)
+    assert np.isnan(np.frombuffer(missing, dtype="<f4", offset=4)).all()
+
+
+def test_class_header_follows_output_order():
+    assert response_format.class_header(CLASSES) == "Arborio,Basmati,Ipsala,Jasmine,Karacadag"
+
+
+def test_msgpack_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    payload = response_format.prediction_payload(PROBS, CLASSES, top_k=1)
+    assert msgpack.unpackb(response_format.encode(response_format.MSGPACK, payload)) == payload
@@ -0,0 +1,79 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from api import segmentation
+
+# (x0, y0, x1, y1) de grains allonges, bien separes
+GRAINS = [(20, 20, 80, 45), (120, 30, 180, 55), (220, 20, 280, 45), (40, 150, 100, 175), (200, 160, 260, 185)]
+
+
+def tray(grains=GRAINS, size=(320, 240), background=(10, 10, 10), color=(230, 220, 200), dust=True):
+    image = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(image)
+    for box in grains:
+        draw.ellipse(box, fill=color)
+    if dust:
+        # Poussiere : quelques pixels, sous MIN_AREA_PIXELS
+        draw.rectangle((300, 220, 302, 222), fill=color)
+    return image
+
+
+def encoded(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_otsu_threshold_separates_two_levels():
+    gray = np.full((20, 20), 30, dtype=np.uint8)
+    gray[5:15, 5:15] = 200
+    threshold = segmentation.otsu_threshold(gray)
+    assert 30 <= threshold < 200
+
+
+@pytest.mark.parametrize("background, color", [((10, 10, 10), (230, 220, 200)), ((245, 245, 240), (90, 70, 40))])
+def test_each_grain_is_one_component(background, color):
+    seg = segmentation.segment(encoded(tray(background=background, color=color)))
+    assert len(seg) == len(GRAINS)
+    boxes = sorted(grain.box for grain in seg.grains)
+    for (x0, y0, x1, y1), expected in zip(boxes, sorted(GRAINS)):
+        assert abs(x0 - expected[0]) <= 2 and abs(y0 - expected[1]) <= 2
+        assert abs(x1 - expected[2]) <= 2 and abs(y1 - expected[3]) <= 2
+    assert not any(grain.possibly_merged for grain in seg.grains)
+
+
+def test_touching_grains_are_flagged_as_merged():
+    grains = GRAINS[:4] + [(180, 160, 240, 185), (236, 160, 296, 185)]
+    seg = segmentation.segment(encoded(tray(grains)))
+    assert len(seg) == 5
+    merged = [grain for grain in seg.grains if grain.possibly_merged]
+    assert len(merged) == 1
+    assert merged[0].box[0] <= 181 and merged[0].box[2] >= 295
+
+
+def test_boxes_are_in_full_resolution_coordinates():
+    image = tray(dust=False).resize((1280, 960), Image.NEAREST)
+    seg = segmentation.Segmentation(image, max_side=320)
+    assert seg.scale == pytest.approx(0.25)
+    assert len(seg) == len(GRAINS)
+    x0, y0, x1, y1 = min(grain.box for grain in seg.grains)
+    assert abs(x0 - 80) <= 8 and abs(y0 - 80) <= 8 and abs(x1 - 320) <= 8 and abs(y1 - 180) <= 8
+
+
+def test_crop_isolates_the_grain_on_black():
+    seg = segmentation.segment(encoded(tray()))
+    crop = seg.crop_into(seg.grains[0], np.empty((224, 224, 3), dtype=np.float32))
+    assert crop.shape == (224, 224, 3)
+    # Coins : marge noire ; centre : le grain
+    assert crop[0, 0].max() == 0 and crop[-1, -1].max() == 0
+    assert crop[112, 112].min() > 0
+
+
+def test_composition():
+    summary = segmentation.composition(["Basmati", "Jasmine", "Basmati"], ["Arborio", "Basmati", "Jasmine"])
+    assert summary["counts"] == {"Arborio": 0, "Basmati": 2, "Jasmine": 1}
+    assert summary["proportions"]["Basmati"] == pytest.approx(2 / 3)
+    assert segmentation.composition([], ["Arborio"])["proportions"] == {"Arborio": 0.0}
@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import remote_backend
+
+
+def test_acquire_reserves_consecutive_slots_and_release_frees_them(ring):
+    start = ring.acquire(3)
+    assert start == 0
+    assert list(ring.states[:3]) == [1, 1, 1]
+    assert ring.acquire(3) == 3
+    ring.release(start, 3)
+    assert not ring.states[:3].any()
+
+
+def test_full_ring_returns_none(ring):
+    assert ring.acquire(8) == 0
+    assert ring.acquire(1) is None
+    assert ring.acquire(9) is None
+
+
+def test_batch_wraps_to_the_start_to_stay_contiguous(ring):
+    first = ring.acquire(6)
+    ring.release(first, 6)
+    # Il reste 2 cases en fin d'anneau : un lot de 3 repart a 0
+    assert ring.acquire(3) == 0
+
+
+def test_view_is_located_without_copy(ring):
+    start = ring.acquire(2)
+    view = ring.view(start, 2)
+    view[:] = 7.0
+    assert ring.locate(view) == start
+    assert ring.slots[start:start + 2].min() == 7.0
+    assert ring.locate(np.zeros((2, 4, 4, 3), dtype=np.float32)) is None
+    assert ring.locate(np.zeros((2, 4, 4, 3), dtype=np.uint8)) is None
+
+
+def test_concurrent_acquire_never_hands_out_the_same_slot(ring):
+    got, lock = [], threading.Lock()
+
+    def take():
+        start = ring.acquire(1)
+        if start is not None:
+            with lock:
+                got.append(start)
+
+    threads = [threading.Thread(target=take) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(got) == list(range(8))
+
+
+def test_remote_predict_releases_its_slots(ring):
+    backend = remote_backend(ring, reply=np.ones((2, 5)))
+    buffer = backend.input_buffer(2)
+    assert ring.states.sum() == 2
+    assert backend.predict(buffer).shape == (2, 5)
+    assert ring.states.sum() == 0
+    assert backend._allocations == {}
+
+
+def test_remote_predict_releases_its_slots_on_error(ring):
+    backend = remote_backend(ring, error=EOFError())
+    buffer = backend.input_buffer(1)
+    with pytest.raises(EOFError):
+        backend.predict(buffer)
+    assert ring.states.sum() == 0
+
+
+def test_release_buffer_is_idempotent_and_ignores_local_arrays(ring):
+    backend = remote_backend(ring)
+    buffer = backend.input_buffer(2)
+    other = backend.input_buffer(1)
+    backend.release_buffer(buffer)
+    backend.release_buffer(buffer)
+    backend.release_buffer(np.zeros((1, 4, 4, 3), dtype=np.float32))
+    # La case de `other` reste reservee
+    assert ring.states.sum() == 1
+    backend.release_buffer(other)
+    assert ring.states.sum() == 0
+
+
+def test_full_ring_falls_back_to_a_local_buffer(ring):
+    backend = remote_backend(ring)
+    held = backend.input_buffer(8)
+    local = backend.input_buffer(1)
+    assert ring.locate(local) is None
+    backend.release_buffer(local)
+    backend.release_buffer(held)
+    assert ring.states.sum() == 0
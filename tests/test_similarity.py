@@ -0,0 +1,184 @@
+import io
+import threading
+from multiprocessing import Pipe
+
+import numpy as np
+import pytest
+
+from conftest import FakeBackend, images, png, remote_backend
+
+NUM_CLASSES = 5
+
+
+def make_index(directory, vectors, num_lists=0):
+    from api.similarity import SimilarityIndex, write_index
+
+    paths = [f"img_{i}.jpg" for i in range(len(vectors))]
+    labels = [f"classe_{i % NUM_CLASSES}" for i in range(len(vectors))]
+    write_index(str(directory), vectors, paths, labels, num_lists=num_lists)
+    return SimilarityIndex(str(directory))
+
+
+def test_ivf_search_matches_exact_search_when_probing_all_lists(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(400, 16)).astype(np.float32)
+    exact = make_index(tmp_path / "exact", vectors)
+    ivf = make_index(tmp_path / "ivf", vectors, num_lists=8)
+    assert ivf.describe()["approximate"]
+
+    for query in rng.normal(size=(10, 16)):
+        expected = [(exact.paths[row], round(score, 5)) for row, score in exact.search(query, k=5)]
+        found = [(ivf.paths[row], round(score, 5)) for row, score in ivf.search(query, k=5, nprobe=8)]
+        assert found == expected
+
+
+def test_ivf_search_finds_an_indexed_vector_with_few_probes(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(400, 16)).astype(np.float32)
+    ivf = make_index(tmp_path, vectors, num_lists=8)
+
+    row, score = ivf.search(vectors[42], k=1, nprobe=1)[0]
+    assert ivf.paths[row] == "img_42.jpg"
+    assert score == pytest.approx(1.0)
+
+
+def test_non_positive_nprobe_probes_one_list(tmp_path):
+    rng = np.random.default_rng(2)
+    ivf = make_index(tmp_path, rng.normal(size=(100, 8)), num_lists=4)
+    for nprobe in (0, -3):
+        assert len(ivf.search(rng.normal(size=8), k=3, nprobe=nprobe)) > 0
+
+
+class EmbeddingBackend(FakeBackend):
+    """Backend qui sort l'embedding (one-hot de la classe) avec la softmax"""
+
+    embedding = True
+
+    def predict(self, batch):
+        raise AssertionError("predict_with_embedding attendu : une seule passe")
+
+    def predict_with_embedding(self, batch):
+        probs = self.model_fn(batch)
+        return np.concatenate([probs, probs], axis=1)
+
+
+@pytest.fixture
+def similar(engine, tmp_path, monkeypatch):
+    from api import preprocessing
+    from api.similarity import SimilaritySearch
+
+    index = make_index(tmp_path, np.eye(NUM_CLASSES, dtype=np.float32))
+    # Sous-modele d'embedding introuvable : il ne doit pas etre charge
+    search = SimilaritySearch(index, model_path=str(tmp_path / "absent.keras"))
+    monkeypatch.setattr(engine, "similarity_search", search)
+    monkeypatch.setattr(engine, "class_names", {i: f"classe_{i}" for i in range(NUM_CLASSES)})
+    monkeypatch.setattr(engine, "experiment", None)
+    monkeypatch.setattr(engine, "shape_cascade", None)
+
+    decodes = []
+    preprocess_into = preprocessing.preprocess_into
+
+    def counting(*args, **kwargs):
+        decodes.append(1)
+        return preprocess_into(*args, **kwargs)
+
+    monkeypatch.setattr(preprocessing, "preprocess_into", counting)
+    engine.decodes = decodes
+    return engine
+
+
+def post_similar(engine, value=0):
+    return engine.app.test_client().post(
+        "/predict?similar=2",
+        data={"file": (io.BytesIO(png(value)), "grain.png")},
+        content_type="multipart/form-data"
+    )
+
+
+def test_similar_prediction_uses_one_pass_of_the_active_backend(similar, monkeypatch):
+    backend = EmbeddingBackend(NUM_CLASSES)
+    monkeypatch.setattr(similar, "model", backend)
+
+    response = post_similar(similar)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["predicted_class"] == "classe_0"
+    assert body["similar"][0] == {"path": "img_0.jpg", "label": "classe_0", "similarity": 1.0}
+    assert backend.model_fn.calls == [1]
+    assert len(similar.decodes) == 1
+
+
+def test_similar_prediction_embeds_the_preprocessed_array_without_embedding_output(similar, monkeypatch):
+    backend = FakeBackend(NUM_CLASSES)
+    monkeypatch.setattr(similar, "model", backend)
+    received = []
+
+    def embed(batch):
+        received.append(batch.shape)
+        return np.eye(NUM_CLASSES, dtype=np.float32)[[3]]
+
+    monkeypatch.setattr(similar.similarity_search, "embed", embed)
+
+    response = post_similar(similar)
+    assert response.status_code == 200
+    assert response.get_json()["similar"][0]["path"] == "img_3.jpg"
+    assert received == [(1, 224, 224, 3)]
+    assert len(similar.decodes) == 1
+
+
+def test_similar_route_decodes_once(similar, monkeypatch):
+    monkeypatch.setattr(similar, "model", EmbeddingBackend(NUM_CLASSES))
+    response = similar.app.test_client().post(
+        "/similar?k=1",
+        data={"file": (io.BytesIO(png()), "grain.png")},
+        content_type="multipart/form-data"
+    )
+    assert response.status_code == 200
+    assert response.get_json()["neighbors"][0]["path"] == "img_0.jpg"
+    assert len(similar.decodes) == 1
+
+
+def test_async_similar_prediction_uses_one_pass(similar, monkeypatch):
+    from starlette.testclient import TestClient
+
+    from api import app_async
+
+    backend = EmbeddingBackend(NUM_CLASSES)
+    monkeypatch.setattr(similar, "model", backend)
+    response = TestClient(app_async.app).post(
+        "/predict?similar=2", files={"file": ("grain.png", io.BytesIO(png()), "image/png")}
+    )
+    assert response.status_code == 200
+    assert response.json()["similar"][0]["path"] == "img_0.jpg"
+    assert backend.model_fn.calls == [1]
+
+
+def test_remote_embedding_request_uses_the_ring_slot(ring):
+    reply = np.ones((1, NUM_CLASSES + 3), dtype=np.float32)
+    backend = remote_backend(ring, reply=reply)
+    sent = []
+    call = backend._call
+    backend._call = lambda message: (sent.append(message), call(message))[1]
+
+    buffer = backend.input_buffer(1)
+    outputs = backend.predict_with_embedding(buffer)
+    assert outputs.shape == (1, NUM_CLASSES + 3)
+    assert sent[0][:2] == b"VS"
+    assert ring.states.sum() == 0
+
+
+def test_server_answers_embedding_requests_from_its_backend():
+    from api.inference_server import InferenceServer, decode_output, encode_batch
+
+    server = InferenceServer(EmbeddingBackend(NUM_CLASSES), socket_path="unused.sock", ring_slots=0, max_wait_ms=0)
+    client, conn = Pipe()
+    thread = threading.Thread(target=server._handle, args=(conn,), daemon=True)
+    thread.start()
+    try:
+        client.send_bytes(b"V" + encode_batch(images(2, 4)))
+        outputs = decode_output(client.recv_bytes())
+    finally:
+        client.close()
+        thread.join(timeout=5)
+    assert outputs.shape == (2, 2 * NUM_CLASSES)
+    assert outputs[:, :NUM_CLASSES].argmax(axis=1).tolist() == [2, 4]
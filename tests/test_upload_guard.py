@@ -0,0 +1,99 @@
+import io
+
+import pytest
+from PIL import Image
+
+from api.batch_upload import iter_uploaded_images
+from api.upload_guard import UploadGuard, UploadRejected, parse_formats, read_limited, sniff
+from conftest import png
+
+
+def encoded(fmt, size=(16, 16)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG", "BMP", "WEBP"])
+def test_sniff_recognises_supported_formats(fmt):
+    assert sniff(encoded(fmt)) == fmt
+
+
+def test_sniff_ignores_the_file_name_and_unknown_signatures():
+    assert sniff(b"GIF89a....") is None
+    assert sniff(b"RIFF\0\0\0\0WAVEfmt ") is None
+    assert sniff(b"") is None
+
+
+def test_parse_formats():
+    assert parse_formats(None) == ("JPEG", "PNG", "BMP", "WEBP")
+    assert parse_formats(" jpeg, png ,") == ("JPEG", "PNG")
+
+
+def test_read_limited_stops_after_max_bytes_plus_one():
+    stream = io.BytesIO(b"x" * 1000)
+    with pytest.raises(UploadRejected) as excinfo:
+        read_limited(stream, 100)
+    assert excinfo.value.status == 413
+    assert stream.tell() == 101
+    assert read_limited(io.BytesIO(b"x" * 100), 100) == b"x" * 100
+    assert len(read_limited(io.BytesIO(b"x" * 1000), 0)) == 1000
+
+
+def test_check_accepts_a_valid_image():
+    guard = UploadGuard(max_bytes=1 << 20, max_pixels=10_000)
+    assert guard.check(png(size=(40, 30))) == ("PNG", (40, 30))
+
+
+@pytest.mark.parametrize("content, status, reason", [
+    (b"", 400, "empty"),
+    (b"GIF89a" + b"\0" * 32, 415, "format"),
+    (b"\x89PNG\r\n\x1a\n" + b"\0" * 32, 400, "unreadable"),
+])
+def test_check_rejects_bad_uploads(content, status, reason):
+    with pytest.raises(UploadRejected) as excinfo:
+        UploadGuard().check(content)
+    assert (excinfo.value.status, excinfo.value.reason) == (status, reason)
+
+
+def test_check_rejects_formats_that_are_not_allowed():
+    with pytest.raises(UploadRejected) as excinfo:
+        UploadGuard(formats=("PNG",)).check(encoded("JPEG"))
+    assert excinfo.value.status == 415
+
+
+def test_pixel_budget_is_checked_from_the_header():
+    # PNG de 4000x4000 tres compressible : quelques Ko, 16 Mpx une fois decode
+    content = png(size=(4000, 4000))
+    assert len(content) < 200_000
+    with pytest.raises(UploadRejected) as excinfo:
+        UploadGuard(max_pixels=1_000_000).check(content)
+    assert excinfo.value.status == 422
+    assert excinfo.value.reason == "too_many_pixels"
+
+
+def test_oversized_image_is_rejected_by_check():
+    with pytest.raises(UploadRejected) as excinfo:
+        UploadGuard(max_bytes=10).check(png())
+    assert excinfo.value.reason == "too_large"
+
+
+class Upload:
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.stream = io.BytesIO(content)
+
+
+def test_archive_members_are_read_with_the_same_limit():
+    import zipfile
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("petit.png", png())
+        z.writestr("gros.png", b"\x89PNG" + b"\0" * 5000)
+    items = dict(iter_uploaded_images([Upload("lot.zip", archive.getvalue())], max_bytes=1000))
+    assert items["petit.png"] == png()
+    # Lecture arretee a max_bytes + 1 : le guard refuse sans tout decompresser
+    assert len(items["gros.png"]) == 1001
+    with pytest.raises(UploadRejected):
+        UploadGuard(max_bytes=1000).check(items["gros.png"])